@@ -0,0 +1,37 @@
+'''
+An ASGI app for the asyncio tests.  It needs python 3.6 or later, so it's
+kept out of tests.py, which is only imported from there when it can be.
+'''
+import json
+
+
+async def app(scope, receive, send):
+    request = await receive()
+    if scope['path'] == '/echo':
+        await send({
+            'type': 'http.response.start', 'status': 200,
+            'headers': [(b'content-type', b'text/plain; charset=utf-8')],
+            })
+        await send({
+            'type': 'http.response.body',
+            'body': scope['method'].encode('utf-8') + b' ' + request['body'],
+            })
+    elif scope['path'] == '/stream':
+        await send({
+            'type': 'http.response.start', 'status': 200,
+            'headers': [(b'content-type', b'application/json')],
+            })
+        await send({'type': 'http.response.body',
+                    'body': b'{"data": [', 'more_body': True})
+        for i in range(1000):
+            chunk = json.dumps({'id': i}) + (', ' if i < 999 else '')
+            await send({'type': 'http.response.body',
+                        'body': chunk.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b']}'})
+    elif scope['path'] == '/broken':
+        raise RuntimeError('The app broke')
+    else:
+        await send({
+            'type': 'http.response.start', 'status': 404, 'headers': [],
+            })
+        await send({'type': 'http.response.body', 'body': b''})
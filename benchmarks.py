@@ -0,0 +1,330 @@
+'''
+Benchmarks for flask-should-dsl.
+
+Measures the import time of the package, the overhead of each matcher on a
+typical response, and the time & peak memory of the body matchers on bodies
+of increasing size.  Peak memory needs tracemalloc, so it's reported as n/a
+on python 2.  Results are written to a json file, which can be compared
+against a baseline from an earlier run to catch regressions:
+
+    python benchmarks.py --output baseline.json
+    python benchmarks.py --baseline baseline.json
+'''
+import json
+import optparse
+import subprocess
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import flask_should_dsl
+import flask_should_dsl.direct
+from flask import Flask, Response
+from should_dsl import should, should_not
+
+# Keep pep8 happy
+flask_should_dsl
+have_status = be_200 = be_404 = redirect_to = None
+have_json = have_json_at = have_json_including = None
+have_content = have_all_content = have_any_content = None
+have_content_type = have_header = have_headers = satisfy_all = None
+
+app = Flask('Flask-Should-DSL-Benchmarks')
+
+JSON_DATA = {'a': 'b', 'c': [1, 2, 3], 'd': {'e': 'f'}}
+NEEDLE = b'<needle/>'
+CHUNK = b'x' * (64 * 1024)
+
+_json_bodies = {}
+
+
+def json_body(size):
+    '''
+    Gets a json body of roughly size bytes, as a (bytes, parsed) tuple.  Bodies
+    are cached so building them isn't included in any measurements.
+    '''
+    if size not in _json_bodies:
+        items = [
+            {'id': i, 'name': 'item {0}'.format(i), 'tags': ['a', 'b']}
+            for i in range(max(1, size // 50))
+            ]
+        parsed = {'data': items, 'status': 'ok'}
+        _json_bodies[size] = (json.dumps(parsed).encode('utf-8'), parsed)
+    return _json_bodies[size]
+
+
+@app.route('/ok')
+def ok_route():
+    return ''
+
+
+@app.route('/json')
+def json_route():
+    return Response(json.dumps(JSON_DATA), mimetype='application/json')
+
+
+@app.route('/redirect')
+def redirect_route():
+    return Response('', status=302, headers={'Location': '/target'})
+
+
+@app.route('/json/<int:size>')
+def large_json_route(size):
+    return Response(json_body(size)[0], mimetype='application/json')
+
+
+@app.route('/content/<int:size>')
+def large_content_route(size):
+    def generate():
+        remaining = size - len(NEEDLE)
+        while remaining > 0:
+            chunk = CHUNK[:remaining]
+            remaining -= len(chunk)
+            yield chunk
+        yield NEEDLE
+    return Response(generate(), mimetype='text/plain')
+
+
+# The assertions whose overhead is measured, as (name, url, assertion)
+ASSERTIONS = [
+    ('have_status', '/ok', lambda r: r |should| have_status(200)),
+    ('be_xxx', '/ok', lambda r: r |should| be_200),
+    ('be_xxx_not', '/ok', lambda r: r |should_not| be_404),
+    ('redirect_to', '/redirect', lambda r: r |should| redirect_to('/target')),
+    ('have_json', '/json', lambda r: r |should| have_json(JSON_DATA)),
+    ('have_json_at', '/json', lambda r: r |should| have_json_at('d.e', 'f')),
+    ('have_json_including', '/json',
+        lambda r: r |should| have_json_including(a='b')),
+    ('have_content_type', '/json',
+        lambda r: r |should| have_content_type('application/json')),
+    ('have_header', '/json', lambda r: r |should| have_header('Content-Type')),
+    ('have_headers', '/json',
+        lambda r: r |should| have_headers({'content-type': True})),
+    ('have_content', '/json',
+        lambda r: r |should| have_content('"a"', find=True)),
+    ('have_all_content', '/json',
+        lambda r: r |should| have_all_content(['"a"', '"c"', '"d"'])),
+    ('have_any_content', '/json',
+        lambda r: r |should| have_any_content(['"x"', '"a"'])),
+    ('satisfy_all', '/json',
+        lambda r: r |should| satisfy_all(be_200, have_json(JSON_DATA))),
+    ]
+
+
+# The body matchers measured on large bodies, as (name, url, assertion), where
+# the assertion takes the response and size of the body
+BODY_ASSERTIONS = [
+    ('have_json', '/json/{0}',
+        lambda r, size: r |should| have_json(json_body(size)[1])),
+    ('have_json_at', '/json/{0}',
+        lambda r, size: r |should| have_json_at('data.0.id', 0)),
+    ('have_content', '/content/{0}',
+        lambda r, size: r |should| have_content(NEEDLE, find=True)),
+    ]
+
+# The clients whose round trip (a request plus a few assertions) is
+# measured, as (name, factory)
+CLIENTS = [
+    ('test_client', lambda: app.test_client()),
+    ('direct', lambda: flask_should_dsl.direct.DirectClient(app)),
+    ]
+
+DEFAULT_SIZES = '1K,100K,10M,100M'
+
+
+def parse_size(size):
+    ''' Parses a size such as '100K' or '10M' into a number of bytes '''
+    multipliers = {'K': 1024, 'M': 1024 * 1024}
+    size = size.strip().upper()
+    if size[-1] in multipliers:
+        return int(size[:-1]) * multipliers[size[-1]]
+    return int(size)
+
+
+def benchmark_import(repeat=10):
+    '''
+    Times importing flask_should_dsl in a fresh interpreter.  Its dependencies
+    are imported first, so only the package itself is measured.
+    '''
+    code = (
+        'import sys, time, flask, werkzeug.http, should_dsl\n'
+        'start = time.time()\n'
+        'import flask_should_dsl\n'
+        'sys.stdout.write(repr(time.time() - start))\n'
+        )
+    times = []
+    for _ in range(repeat):
+        process = subprocess.Popen(
+            [sys.executable, '-c', code], stdout=subprocess.PIPE
+            )
+        output = process.communicate()[0]
+        times.append(float(output))
+    return {'time': min(times)}
+
+
+def benchmark_assertion(client, url, assertion, number=200, repeat=5):
+    '''
+    Times an assertion against responses from the test client, returning the
+    best time per assertion out of several rounds
+    '''
+    times = []
+    for _ in range(repeat):
+        responses = [client.get(url) for _ in range(number)]
+        start = time.time()
+        for response in responses:
+            assertion(response)
+        times.append((time.time() - start) / number)
+    return {'time': min(times)}
+
+
+def benchmark_body(client, url, size, assertion, repeat=3):
+    '''
+    Times an assertion against a large body, and measures its peak memory.
+    Memory is measured in a separate run, as tracing allocations slows things
+    down too much to get a useful time.
+    '''
+    times = []
+    for _ in range(repeat):
+        response = client.get(url)
+        start = time.time()
+        assertion(response, size)
+        times.append(time.time() - start)
+    peak = None
+    if tracemalloc is not None:
+        response = client.get(url)
+        tracemalloc.start()
+        assertion(response, size)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {'time': min(times), 'peak_memory': peak}
+
+
+def benchmark_round_trip(client, number=200, repeat=5):
+    '''
+    Times making a request and checking its status, a header & its json,
+    returning the best time per request out of several rounds
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        for _ in range(number):
+            response = client.get('/json')
+            response |should| be_200
+            response |should| have_header('Content-Type')
+            response |should| have_json(JSON_DATA)
+        times.append((time.time() - start) / number)
+    return {'time': min(times)}
+
+
+def run(sizes):
+    '''
+    Runs all the benchmarks
+
+    :param sizes:   A list of body sizes for the body benchmarks
+    :returns:       A dict mapping benchmark names to results
+    '''
+    app.config['TESTING'] = True
+    client = app.test_client()
+    results = {'import.flask_should_dsl': benchmark_import()}
+    for name, url, assertion in ASSERTIONS:
+        results['assert.' + name] = benchmark_assertion(
+            client, url, assertion
+            )
+    for name, factory in CLIENTS:
+        results['round_trip.' + name] = benchmark_round_trip(factory())
+    for size in sizes:
+        json_body(size)
+        for name, url, assertion in BODY_ASSERTIONS:
+            results['body.{0}.{1}'.format(name, size)] = benchmark_body(
+                client, url.format(size), size, assertion
+                )
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Compares results against a baseline.
+
+    :param tolerance:   How much slower (or bigger) than the baseline a result
+                        can be before it's a regression, e.g. 0.2 for 20%
+    :returns:           A list of descriptions of each regression
+    '''
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for metric, value in sorted(results[name].items()):
+            old = baseline[name].get(metric)
+            if value is None or not old:
+                continue
+            if value > old * (1 + tolerance):
+                regressions.append(
+                    '{0} {1}: {2:.4g} -> {3:.4g} ({4:+.0%})'.format(
+                        name, metric, old, value, float(value) / old - 1
+                        )
+                    )
+    return regressions
+
+
+def report(results):
+    for name in sorted(results):
+        result = results[name]
+        line = '{0:<40} {1:>12.1f}us'.format(name, result['time'] * 1e6)
+        if 'peak_memory' in result:
+            peak = result['peak_memory']
+            if peak is None:
+                # Peak memory is measured with tracemalloc, which python 2
+                # doesn't have
+                line += ' {0:>12} peak'.format('n/a')
+            else:
+                line += ' {0:>10.1f}KB peak'.format(peak / 1024.0)
+        print(line)
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option(
+        '--sizes', default=DEFAULT_SIZES,
+        help='comma separated body sizes [default: %default]'
+        )
+    parser.add_option(
+        '--output', default='bench_results.json',
+        help='file to write the results to [default: %default]'
+        )
+    parser.add_option(
+        '--baseline', help='results file from an earlier run to compare to'
+        )
+    parser.add_option(
+        '--tolerance', type='float', default=0.2,
+        help='allowed slow down before a result is a regression '
+             '[default: %default]'
+        )
+    options, _ = parser.parse_args()
+
+    sizes = [parse_size(size) for size in options.sizes.split(',')]
+    results = run(sizes)
+    report(results)
+    with open(options.output, 'w') as output:
+        json.dump(
+            {'python': sys.version.split()[0], 'results': results},
+            output, indent=2, sort_keys=True
+            )
+
+    if options.baseline:
+        with open(options.baseline) as baseline:
+            baseline = json.load(baseline)['results']
+        regressions = compare(results, baseline, options.tolerance)
+        if regressions:
+            print('\nRegressions against {0}:'.format(options.baseline))
+            for regression in regressions:
+                print('  ' + regression)
+            sys.exit(1)
+        print('\nNo regressions against {0}'.format(options.baseline))
+
+
+if __name__ == '__main__':
+    main()
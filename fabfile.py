@@ -7,3 +7,11 @@ def ut():
             "'^(it|ensure|must|should|specs?|examples?|deve|tests?)' "
             "--with-spec --spec-color"
             )
+
+
+def bench(baseline=None):
+    # Runs the benchmarks, optionally comparing against a baseline file
+    command = "python benchmarks.py"
+    if baseline:
+        command += " --baseline {0}".format(baseline)
+    local(command)
@@ -1,4 +1,13 @@
-import matchers
+import os
+
+from . import matchers
+
+# Instrumentation & tracing are only loaded when they're asked for, either
+# by importing them or by setting their environment variables
+if os.environ.get('FLASK_SHOULD_DSL_STATS'):
+    from . import instrumentation
+if os.environ.get('FLASK_SHOULD_DSL_TRACE'):
+    from . import tracing
 
 __version__ = '0.5'
 __author__ = 'Graeme Coupar (grambo@grambo.me.uk)'
@@ -0,0 +1,369 @@
+'''
+Asyncio support.
+
+``AsyncClient`` makes requests to a WSGI or ASGI application without blocking
+the event loop, and returns ``AsyncResponse`` objects whose bodies are read
+asynchronously.  Assertions are made with the awaitable ``should`` and
+``should_not`` methods of a response, so many requests can be in flight &
+asserted on at once::
+
+    client = AsyncClient(app)
+    response = await client.get('/json')
+    await response.should('be_200')
+    await response.should('have_json_at', 'data.0.id', 1)
+
+This module needs python 3.6 or later, so it isn't imported along with the
+rest of the package.
+'''
+import asyncio
+import collections
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.datastructures import Headers
+
+from .cache import BodyStream, parse_content_type
+from .matchers import Expectation
+
+# The number of threads that matchers are run in
+MATCH_THREADS = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _match_executor():
+    '''
+    Gets the executor that matchers are run in.  This is kept apart from the
+    loop's default executor, where WSGI bodies are read, so matchers waiting
+    for chunks can't use up the threads that would read them.
+    '''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(MATCH_THREADS)
+        return _executor
+
+
+class _Body(object):
+    '''
+    A synchronous iterator over an asynchronous body.
+
+    Matchers read bodies synchronously, so they're run in a worker thread and
+    each chunk they ask for is fetched on the event loop.  A body can also be
+    read ahead into a buffer from the loop, after which it can be iterated
+    from anywhere.
+    '''
+
+    def __init__(self, chunks, loop):
+        self._chunks = chunks.__aiter__()
+        self._loop = loop
+        self._thread = threading.current_thread()
+        self._lock = asyncio.Lock()
+        self._buffer = collections.deque()
+        self.done = False
+
+    async def _fetch(self):
+        if self.done:
+            return None
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            self.done = True
+            return None
+
+    async def next_chunk(self):
+        ''' Gets the next chunk, or None at the end of the body '''
+        async with self._lock:
+            if self._buffer:
+                return self._buffer.popleft()
+            return await self._fetch()
+
+    async def read_ahead(self):
+        ''' Reads the rest of the body into the buffer '''
+        async with self._lock:
+            while True:
+                chunk = await self._fetch()
+                if chunk is None:
+                    return
+                self._buffer.append(chunk)
+
+    def on_loop(self):
+        ''' Checks if this is being called from the event loop's thread '''
+        return threading.current_thread() is self._thread
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # Once done is set nothing more is added to the buffer, so it can be
+        # read without going through the loop.
+        if self.done:
+            if self._buffer:
+                return self._buffer.popleft()
+            raise StopIteration
+        chunk = asyncio.run_coroutine_threadsafe(
+            self.next_chunk(), self._loop
+            ).result()
+        if chunk is None:
+            raise StopIteration
+        return chunk
+
+    def close(self):
+        close = getattr(self._chunks, 'aclose', None)
+        if close is not None and not self.done:
+            asyncio.run_coroutine_threadsafe(close(), self._loop)
+
+
+async def _iterate(chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+class AsyncResponse(object):
+    '''
+    A response whose body is read asynchronously.
+
+    It looks enough like a werkzeug response for the matchers to use, and
+    its body is replayable in the same way as a streamed test response, so
+    any number of assertions can read it.
+
+    :param status_code: The status code of the response
+    :param headers:     The headers, as a list of (name, value) pairs
+    :param body:        An async iterable of bytes, or bytes
+    :param charset:     The charset of the body.  Defaults to the charset in
+                        the content type, or utf-8
+    :param loop:        The event loop the body is read on
+    '''
+    is_sequence = False
+
+    def __init__(self, status_code, headers=(), body=b'', charset=None,
+                 loop=None):
+        if isinstance(body, bytes):
+            body = _iterate([body])
+        self.status_code = status_code
+        self.headers = Headers(headers)
+        self.charset = charset or parse_content_type(
+            self.content_type
+            )[1].get('charset', 'utf-8')
+        self._body = _Body(body, loop or asyncio.get_event_loop())
+        self.response = BodyStream(self._body, self.charset)
+
+    @property
+    def content_type(self):
+        return self.headers.get('Content-Type', '')
+
+    @property
+    def mimetype(self):
+        return parse_content_type(self.content_type)[0]
+
+    @property
+    def location(self):
+        return self.headers.get('Location')
+
+    @property
+    def loaded(self):
+        ''' Whether the whole body has been read '''
+        return self._body.done
+
+    @property
+    def data(self):
+        return b''.join(self.iter_encoded())
+
+    def iter_encoded(self):
+        # Reading the body from the event loop would block the loop while it
+        # waited for itself to fetch the next chunk.
+        if not self.loaded and self._body.on_loop():
+            raise RuntimeError(
+                'The body of this response has not been read yet.  Use '
+                "'await response.load()' before reading it from the event loop"
+                )
+        return iter(self.response)
+
+    async def load(self):
+        '''
+        Reads the rest of the body.  Once it has been loaded the response can
+        also be used with the usual ``|should|`` syntax.
+        '''
+        await self._body.read_ahead()
+        return self
+
+    def close(self):
+        self.response.close()
+
+    async def should(self, name, *pargs, **kwargs):
+        '''
+        Asserts that the response matches a matcher.
+
+        :param name:    The name of the matcher, e.g. 'be_200' or 'have_json'
+        :param pargs:   Arguments for the matcher, if it takes any
+        :raises:        ShouldNotSatisfied if the response doesn't match
+        '''
+        await self._check(Expectation.create(name, *pargs, **kwargs))
+
+    async def should_not(self, name, *pargs, **kwargs):
+        ''' Asserts that the response doesn't match a matcher '''
+        await self._check(Expectation.create_not(name, *pargs, **kwargs))
+
+    async def _check(self, expectation):
+        if self.loaded:
+            expectation.check(self)
+        else:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(
+                _match_executor(), expectation.check, self
+                )
+
+
+def _is_asgi(app):
+    if hasattr(app, 'wsgi_app'):
+        return False
+    if not inspect.isroutine(app):
+        app = getattr(app, '__call__', None)
+    return inspect.iscoroutinefunction(app)
+
+
+class AsyncClient(object):
+    '''
+    A client for making requests to an application from asyncio.
+
+    WSGI applications (such as flask apps) are called in a worker thread
+    through their test client, and their bodies are read in worker threads
+    too.  ASGI applications are run as a task on the event loop.
+
+    :param app:         The application
+    :param asgi:        Whether the application is an ASGI one.  By default
+                        this is detected from the application.
+    :param executor:    The executor to run WSGI applications in.  Defaults to
+                        the loop's default executor.
+    '''
+
+    def __init__(self, app, asgi=None, executor=None):
+        self.app = app
+        self.asgi = _is_asgi(app) if asgi is None else asgi
+        self.executor = executor
+
+    async def open(self, path, method='GET', headers=(), data=b''):
+        '''
+        Makes a request.  Only the status & headers have been received when
+        this returns, and the body is read as it's needed.
+
+        :returns:   An AsyncResponse
+        '''
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if self.asgi:
+            return await self._open_asgi(path, method, headers, data)
+        return await self._open_wsgi(path, method, headers, data)
+
+    async def get(self, path, **kwargs):
+        return await self.open(path, method='GET', **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.open(path, method='POST', **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.open(path, method='PUT', **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.open(path, method='DELETE', **kwargs)
+
+    async def _open_wsgi(self, path, method, headers, data):
+        loop = asyncio.get_event_loop()
+
+        def request():
+            client = self.app.test_client()
+            return client.open(
+                path, method=method, headers=list(headers), data=data
+                )
+
+        response = await loop.run_in_executor(self.executor, request)
+        return AsyncResponse(
+            response.status_code, list(response.headers.items()),
+            self._read_wsgi(response, loop), loop=loop
+            )
+
+    async def _read_wsgi(self, response, loop):
+        chunks = response.iter_encoded()
+        try:
+            while True:
+                chunk = await loop.run_in_executor(
+                    self.executor, next, chunks, None
+                    )
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            response.close()
+
+    async def _open_asgi(self, path, method, headers, data):
+        loop = asyncio.get_event_loop()
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode('utf-8'),
+            'query_string': query.encode('latin-1'),
+            'root_path': '',
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+                ],
+            'server': ('localhost', 80),
+            'client': ('127.0.0.1', 0),
+            }
+        start = loop.create_future()
+        chunks = asyncio.Queue()
+        disconnected = asyncio.Event()
+        requests = [{'type': 'http.request', 'body': data}]
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                start.set_result(message)
+            elif message['type'] == 'http.response.body':
+                chunks.put_nowait(message.get('body', b''))
+                if not message.get('more_body', False):
+                    chunks.put_nowait(None)
+
+        def finished(task):
+            error = None
+            if not task.cancelled():
+                error = task.exception()
+            if not start.done():
+                start.set_exception(
+                    error or RuntimeError('The application sent no response')
+                    )
+            chunks.put_nowait(error)
+
+        task = loop.create_task(self.app(scope, receive, send))
+        task.add_done_callback(finished)
+        message = await start
+
+        async def body():
+            try:
+                while True:
+                    chunk = await chunks.get()
+                    if chunk is None:
+                        return
+                    if isinstance(chunk, BaseException):
+                        raise chunk
+                    yield chunk
+            finally:
+                disconnected.set()
+
+        headers = [
+            (name.decode('latin-1'), value.decode('latin-1'))
+            for name, value in message.get('headers', [])
+            ]
+        return AsyncResponse(message['status'], headers, body(), loop=loop)
@@ -0,0 +1,232 @@
+'''
+Bulk assertions.
+
+``check_responses`` sends many requests to an app through its test client
+from a pool of workers, checks every response against a set of expectations,
+and returns the aggregated results::
+
+    result = check_responses(app, urls, 'be_200', expect('have_json_at',
+                             'status', 'ok'))
+    result.assert_passed()
+'''
+import multiprocessing.pool
+import os
+import threading
+import time
+
+from should_dsl.dsl import ShouldNotSatisfied
+
+from .matchers import Expectation
+
+expect = Expectation.create
+expect_not = Expectation.create_not
+
+# The number of failures that are kept in a BulkResult by default
+MAX_FAILURES = 10
+
+
+class BulkResult(object):
+    '''
+    The results of checking many responses.
+
+    :ivar total:        The number of requests that were made
+    :ivar passed:       The number of responses that met every expectation
+    :ivar failed:       The number of responses that didn't
+    :ivar failures:     A list of (request, messages) tuples for the first few
+                        failed responses, in the order they were checked
+    :ivar elapsed:      The wall time taken, in seconds
+    '''
+
+    def __init__(self, max_failures=MAX_FAILURES):
+        self.total = self.passed = self.failed = 0
+        self.failures = []
+        self.elapsed = 0.0
+        self._max_failures = max_failures
+
+    def add(self, request, messages):
+        ''' Records the result of checking one response '''
+        self.total += 1
+        if not messages:
+            self.passed += 1
+            return
+        self.failed += 1
+        if len(self.failures) < self._max_failures:
+            self.failures.append((request, messages))
+
+    @property
+    def throughput(self):
+        ''' The number of requests checked per second '''
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def __str__(self):
+        lines = [
+            '{0} of {1} responses failed ({2:.1f} requests/s)'.format(
+                self.failed, self.total, self.throughput
+                )
+            ]
+        for request, messages in self.failures:
+            lines.append('{0}:'.format(_describe(request)))
+            for message in messages:
+                lines.append('\t' + message.replace('\n', '\n\t'))
+        if self.failed > len(self.failures):
+            lines.append('...and {0} more'.format(
+                self.failed - len(self.failures)
+                ))
+        return '\n'.join(lines)
+
+    def assert_passed(self):
+        '''
+        Raises ShouldNotSatisfied, with a summary of the failures, unless
+        every response met every expectation
+        '''
+        if self.failed:
+            raise ShouldNotSatisfied(str(self))
+
+
+def _describe(request):
+    if isinstance(request, dict):
+        return '{0} {1}'.format(
+            request.get('method', 'GET'), request.get('path', '/')
+            )
+    return 'GET {0}'.format(request)
+
+
+class _Worker(object):
+    '''
+    Makes a request and checks the response.  Each thread gets its own test
+    client, as they keep state between requests.
+    '''
+
+    def __init__(self, app, expectations):
+        self.app = app
+        self.expectations = expectations
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def __call__(self, request):
+        try:
+            if isinstance(request, dict):
+                response = self._client().open(**request)
+            else:
+                response = self._client().get(request)
+        except Exception as e:
+            return request, ['Raised {0}: {1}'.format(type(e).__name__, e)]
+        messages = []
+        try:
+            for expectation in self.expectations:
+                try:
+                    expectation.check(response)
+                except ShouldNotSatisfied as e:
+                    messages.append(str(e))
+                except Exception as e:
+                    messages.append(
+                        'Raised {0}: {1}'.format(type(e).__name__, e)
+                        )
+        finally:
+            response.close()
+        return request, messages
+
+
+# The worker for a process in a process pool.  It's set when the process
+# starts, rather than being sent with each request, as apps can't be pickled.
+_process_worker = None
+
+
+def _start_process(worker):
+    global _process_worker
+    _process_worker = worker
+
+
+def _call_process_worker(request):
+    return _process_worker(request)
+
+
+def _fork_pool(workers, worker):
+    '''
+    Creates a pool of processes that are forked, whatever the platform's
+    default way of starting processes is, so the worker (and its app) is
+    inherited rather than pickled
+    '''
+    if hasattr(multiprocessing, 'get_context'):
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            context = None
+    elif hasattr(os, 'fork'):
+        # Python 2 always forks where it can
+        context = multiprocessing
+    else:
+        context = None
+    if context is None:
+        raise ValueError(
+            'processes=True needs fork, which this platform lacks'
+            )
+    return context.Pool(workers, _start_process, (worker,))
+
+
+def check_responses(app, requests, *expectations, **options):
+    '''
+    Checks the responses to many requests against a set of expectations.
+
+    :param app:             The flask app to make the requests to
+    :param requests:        An iterable of requests.  Each is either a path to
+                            GET, or a dict of arguments to the test client's
+                            open method (e.g. ``{'path': '/', 'method':
+                            'POST'}``)
+    :param expectations:    The expectations every response should meet.
+                            These are either the name of a matcher that takes
+                            no arguments (e.g. ``'be_200'``) or are created
+                            with ``expect`` or ``expect_not``.
+    :param workers:         The number of workers to use.  Defaults to 4
+    :param processes:       If True the workers are processes rather than
+                            threads.  The app is passed to them by forking, so
+                            this raises a ValueError on platforms without
+                            fork.
+    :param max_failures:    The number of failures to keep messages for.
+                            Defaults to MAX_FAILURES
+    :returns:               A BulkResult
+    '''
+    workers = options.pop('workers', 4)
+    processes = options.pop('processes', False)
+    max_failures = options.pop('max_failures', MAX_FAILURES)
+    if options:
+        raise TypeError('Unexpected options: {0}'.format(
+            ', '.join(sorted(options))
+            ))
+    if not expectations:
+        raise Exception('check_responses needs at least one expectation')
+    expectations = [
+        expect(item) if isinstance(item, str) else item
+        for item in expectations
+        ]
+    # Make sure every expectation is valid before starting any requests
+    for expectation in expectations:
+        expectation.matcher()
+
+    worker = _Worker(app, expectations)
+    if processes:
+        pool = _fork_pool(workers, worker)
+        function = _call_process_worker
+    else:
+        pool = multiprocessing.pool.ThreadPool(workers)
+        function = worker
+
+    result = BulkResult(max_failures)
+    start = time.time()
+    try:
+        for request, messages in pool.imap(function, requests, 8):
+            result.add(request, messages)
+    finally:
+        pool.terminate()
+        pool.join()
+    result.elapsed = time.time() - start
+    return result
@@ -0,0 +1,476 @@
+import codecs
+import json
+import tempfile
+import threading
+import weakref
+
+from werkzeug.utils import cached_property
+
+from .decoding import decompress, parse_encoding
+
+# The number of bytes of a streamed body that are kept in memory, before the
+# rest is spooled out to a temporary file.
+SPOOL_MEMORY = 1024 * 1024
+
+# The size of the chunks that spooled data is replayed in
+CHUNK_SIZE = 64 * 1024
+
+
+class BodyStream(object):
+    '''
+    A replayable wrapper around a streamed response body.
+
+    Chunks are only pulled from the underlying iterator as readers need them,
+    and are kept so that later readers (including ``response.data``) still
+    see the whole body.  Chunks are kept in memory until they add up to
+    ``SPOOL_MEMORY`` bytes, and anything after that is written to a temporary
+    file.
+    '''
+
+    def __init__(self, source, charset='utf-8'):
+        self._source = source
+        self._iter = iter(source)
+        self._charset = charset
+        self._memory = []
+        self._memory_size = 0
+        self._spool = None
+        self._spool_size = 0
+        self._exhausted = False
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        ''' The number of bytes pulled from the source so far '''
+        return self._memory_size + self._spool_size
+
+    def __iter__(self):
+        index, offset = 0, 0
+        while True:
+            chunk, index, offset = self._read(index, offset)
+            if chunk is None:
+                return
+            yield chunk
+
+    def _read(self, index, offset):
+        '''
+        Reads the next chunk for a reader, pulling a new chunk from the source
+        if the reader has caught up with everything that's been kept so far.
+
+        :param index:   The index of the next in memory chunk for the reader
+        :param offset:  The reader's offset into the spooled part of the body
+        :returns:       A (chunk, index, offset) tuple, where chunk is None at
+                        the end of the body
+        '''
+        with self._lock:
+            if index < len(self._memory):
+                return self._memory[index], index + 1, offset
+            if offset < self._spool_size:
+                self._spool.seek(offset)
+                chunk = self._spool.read(
+                    min(CHUNK_SIZE, self._spool_size - offset)
+                    )
+                return chunk, index, offset + len(chunk)
+            while not self._exhausted:
+                try:
+                    chunk = next(self._iter)
+                except StopIteration:
+                    self._exhausted = True
+                    break
+                if not isinstance(chunk, bytes):
+                    chunk = chunk.encode(self._charset)
+                if not chunk:
+                    continue
+                if self._spool is None and self._memory_size < SPOOL_MEMORY:
+                    self._memory.append(chunk)
+                    self._memory_size += len(chunk)
+                    return chunk, index + 1, offset
+                if self._spool is None:
+                    self._spool = tempfile.TemporaryFile()
+                self._spool.seek(0, 2)
+                self._spool.write(chunk)
+                self._spool_size += len(chunk)
+                return chunk, index, offset + len(chunk)
+            return None, index, offset
+
+    def close(self):
+        if hasattr(self._source, 'close'):
+            self._source.close()
+        if self._spool is not None:
+            self._spool.close()
+
+
+class LRUCache(object):
+    '''
+    A thread-safe, bounded mapping that discards the least recently used entry
+    once it's full.
+    '''
+
+    # Indexes into the [previous, next, key, value] lists that make up the
+    # circular linked list of entries, from least to most recently used.
+    _PREV, _NEXT, _KEY, _VALUE = range(4)
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._entries = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _unlink(self, entry):
+        entry[self._PREV][self._NEXT] = entry[self._NEXT]
+        entry[self._NEXT][self._PREV] = entry[self._PREV]
+
+    def _append(self, entry):
+        last = self._root[self._PREV]
+        entry[self._PREV], entry[self._NEXT] = last, self._root
+        last[self._NEXT] = self._root[self._PREV] = entry
+
+    def get(self, key, default=None):
+        '''
+        Gets the value for a key, marking it as recently used
+
+        :param key:     The key to look up
+        :param default: The value to return if the key isn't in the cache
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            self._unlink(entry)
+            self._append(entry)
+            return entry[self._VALUE]
+
+    def set(self, key, value):
+        ''' Sets the value for a key, discarding the oldest entry if needed '''
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._unlink(entry)
+            elif len(self._entries) >= self.maxsize:
+                oldest = self._root[self._NEXT]
+                self._unlink(oldest)
+                del self._entries[oldest[self._KEY]]
+            entry = [None, None, key, value]
+            self._append(entry)
+            self._entries[key] = entry
+
+    def get_or_create(self, key, factory):
+        '''
+        Gets the value for a key, creating & caching it if it's missing
+
+        :param key:     The key to look up
+        :param factory: A callable that creates the value from the key
+        '''
+        missing = self._root
+        value = self.get(key, missing)
+        if value is missing:
+            value = factory(key)
+            self.set(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._root[:] = [self._root, self._root, None, None]
+
+
+def parse_content_type(content_type):
+    '''
+    Splits a content type into its mimetype & parameters.
+
+    :param content_type:    A content type, e.g. 'text/html; charset=utf-8'
+    :returns:               A (mimetype, params) tuple, where mimetype is
+                            lowercased and params is a dict with lowercased
+                            keys
+    '''
+    sections = content_type.split(';')
+    params = {}
+    for section in sections[1:]:
+        key, _, value = section.partition('=')
+        key = key.strip().lower()
+        if key:
+            params[key] = value.strip().strip('"')
+    return sections[0].strip().lower(), params
+
+
+class ResponseView(object):
+    '''
+    Lazily parsed views of a response, shared between all the matchers that
+    look at that response.
+
+    Each view is computed at most once, so a body is only read, decoded or
+    parsed the first time a matcher asks for it.
+
+    Bodies sent with a gzip or deflate Content-Encoding are decompressed as
+    they're read, and every view of the body sees the decompressed bytes.
+    '''
+    # Whether the response was closed through the view before its body had
+    # been read
+    closed = False
+
+    def __init__(self, response):
+        try:
+            self._response = weakref.ref(response)
+        except TypeError:
+            # Some responses (e.g. namedtuples) can't be weakly referenced,
+            # but they're also never cached, so a strong reference is fine.
+            self._response = lambda: response
+        self._lock = threading.Lock()
+        self._decoded = None
+        self._raw_read = 0
+
+    @property
+    def response(self):
+        ''' The response this is a view of '''
+        return self._response()
+
+    @cached_property
+    def data(self):
+        ''' The body of the response, decompressed if it was encoded '''
+        self._check_open()
+        if self.content_encoding is None:
+            return self.response.data
+        return b''.join(self.iter_chunks())
+
+    @cached_property
+    def content_encoding(self):
+        '''
+        The encoding the body is compressed with, or None if it isn't (or if
+        it's compressed with something that can't be decompressed)
+        '''
+        try:
+            values = self.headers.get('content-encoding')
+        except AttributeError:
+            return None
+        return parse_encoding(values[-1] if values else None)
+
+    def close(self):
+        '''
+        Closes the response before its body has been read to the end.
+        Reading the body through the view afterwards raises a ValueError,
+        rather than giving back the part of it that had been read.
+        '''
+        self.closed = True
+        if hasattr(self.response, 'close'):
+            self.response.close()
+
+    def _check_open(self):
+        if self.closed:
+            raise ValueError(
+                'The response was closed before its body was read to the end'
+                )
+
+    def cached(self, name):
+        ''' Checks if a view has already been computed '''
+        return name in self.__dict__
+
+    @property
+    def streamable(self):
+        ''' Whether the body of the response can be read in chunks '''
+        return hasattr(self.response, 'iter_encoded')
+
+    @property
+    def bytes_read(self):
+        '''
+        The number of bytes of the body that have been read from the response
+        so far, either by reading the whole body or by streaming part of it.
+        For compressed bodies, this is the number of compressed bytes.
+        '''
+        if self.content_encoding is not None:
+            return self._raw_read
+        if self.cached('data'):
+            return len(self.data)
+        body = getattr(self.response, 'response', None)
+        if isinstance(body, BodyStream):
+            return body.size
+        return 0
+
+    def iter_chunks(self):
+        '''
+        Iterates over the body of the response in chunks.
+
+        Streamed bodies are wrapped in a BodyStream, so only as much of the
+        body as is actually read gets pulled from the application, and the
+        whole body is still available to anything that reads it later.
+        Compressed bodies are decompressed a chunk at a time, and the
+        decompressed chunks are kept in the same way, so they're only
+        decompressed once.
+
+        :returns:   An iterator of bytes
+        '''
+        if not self.cached('data'):
+            self._check_open()
+        if self.content_encoding is not None and not self.cached('data'):
+            return iter(self._decompressed())
+        if self.cached('data') or not self.streamable:
+            return iter([self.data])
+        return self._iter_raw()
+
+    def _decompressed(self):
+        ''' Gets the BodyStream of the decompressed body '''
+        if self._decoded is None:
+            chunks = decompress(
+                self._count_raw(self._iter_raw()), self.content_encoding
+                )
+            with self._lock:
+                if self._decoded is None:
+                    self._decoded = BodyStream(chunks)
+        return self._decoded
+
+    def _count_raw(self, chunks):
+        for chunk in chunks:
+            self._raw_read += len(chunk)
+            yield chunk
+
+    def _iter_raw(self):
+        ''' Iterates over the body as it was sent, in chunks '''
+        if not self.streamable:
+            return iter([self.response.data])
+        response = self.response
+        # Text chunks are encoded as the response itself would encode them
+        charset = getattr(response, 'charset', None) or 'utf-8'
+        with self._lock:
+            if not (response.is_sequence or
+                    isinstance(response.response, BodyStream)):
+                response.response = BodyStream(response.response, charset)
+        return response.iter_encoded()
+
+    @cached_property
+    def charset(self):
+        '''
+        The charset the body should be decoded with: the one in the content
+        type if it's known, or else the response's own
+        '''
+        charset = self.mimetype_params.get('charset')
+        if charset:
+            try:
+                return codecs.lookup(charset).name
+            except LookupError:
+                pass
+        return getattr(self.response, 'charset', None) or 'utf-8'
+
+    @cached_property
+    def text(self):
+        ''' The body of the response, decoded to text '''
+        data = self.data
+        if isinstance(data, bytes):
+            return data.decode(self.charset, 'replace')
+        return data
+
+    @cached_property
+    def json(self):
+        '''
+        The body of the response, parsed as json.
+
+        Bodies are parsed from the shared body rather than by the response's
+        own json parsing, which differs between Flask versions, so the body is
+        only read once and invalid json always raises a ValueError.  Objects
+        with a json attribute but no body (e.g. from flask-testing) give their
+        json attribute.
+        '''
+        if not self.streamable and hasattr(self.response, 'json'):
+            return self.response.json
+        return json.loads(self.text)
+
+    @cached_property
+    def mimetype(self):
+        ''' The mimetype of the response '''
+        try:
+            return self.response.mimetype
+        except AttributeError:
+            return parse_content_type(self.content_type)[0]
+
+    @cached_property
+    def mimetype_parts(self):
+        ''' The mimetype of the response, split into type & subtype '''
+        return tuple(self.mimetype.lower().split('/'))
+
+    @cached_property
+    def mimetype_params(self):
+        ''' The parameters of the content type, with lowercased keys '''
+        try:
+            content_type = self.content_type
+        except AttributeError:
+            return {}
+        return parse_content_type(content_type)[1]
+
+    @cached_property
+    def content_type(self):
+        ''' The full content type of the response, including parameters '''
+        return self.response.content_type
+
+    @cached_property
+    def header_list(self):
+        ''' A list of (name, value) pairs for each header of the response '''
+        response = self.response
+        header_list = getattr(response, 'header_list', None)
+        if header_list is None:
+            header_list = response.headers.items()
+        return list(header_list)
+
+    @cached_property
+    def headers(self):
+        '''
+        An index of the response headers, mapping lowercased header names to
+        a list of values
+        '''
+        index = {}
+        for name, value in self.header_list:
+            index.setdefault(name.lower(), []).append(value)
+        return index
+
+
+_views = weakref.WeakKeyDictionary()
+_views_lock = threading.Lock()
+
+
+def view_for(response):
+    '''
+    Gets the shared ResponseView for a response.
+
+    Views are held against the response weakly, so they live exactly as long
+    as the response does.  Responses that can't be weakly referenced get a
+    fresh view every time.
+
+    :param response:    The response to get a view of
+    :returns:           A ResponseView
+    '''
+    with _views_lock:
+        try:
+            return _views[response]
+        except (KeyError, TypeError):
+            pass
+        view = ResponseView(response)
+        try:
+            _views[response] = view
+        except TypeError:
+            pass
+        return view
+
+
+def view_ref(response):
+    '''
+    Gets a reference to the view of a response, for matchers that need to
+    look at the response again when building a failure message.
+
+    The reference is weak where possible, so holding it doesn't keep the
+    response or its body alive.
+
+    :param response:    The response to get a reference for
+    :returns:           A callable returning the ResponseView, or None if the
+                        response has since been garbage collected
+    '''
+    view = view_for(response)
+    try:
+        weakref.ref(response)
+    except TypeError:
+        # Views of responses that can't be weakly referenced aren't cached,
+        # so a weak reference to one would die straight away.
+        return lambda: view
+    return weakref.ref(view)
@@ -0,0 +1,86 @@
+'''
+Incremental decompression of response bodies that are sent with a
+Content-Encoding.
+
+Bodies are decompressed a chunk at a time as they're read, so matchers that
+stream a body (e.g. ``have_content(find=True)`` or ``have_json_at``) never
+hold the whole of it, compressed or not, in memory.
+'''
+import zlib
+
+# The content encodings that bodies are decompressed from
+ENCODINGS = ('gzip', 'x-gzip', 'deflate')
+
+# The most bytes that are decompressed from a body at a time
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_encoding(header):
+    '''
+    Gets the encoding to decompress a body from, from its Content-Encoding
+    header.
+
+    :param header:  The value of the Content-Encoding header, or None
+    :returns:       One of ENCODINGS, or None if the body isn't encoded (or is
+                    encoded with something that can't be decompressed)
+    '''
+    encoding = (header or '').strip().lower()
+    return encoding if encoding in ENCODINGS else None
+
+
+def _decompressor(encoding, start):
+    '''
+    Creates a decompressor for a body.
+
+    Deflate encoded bodies should have a zlib header, but some servers send
+    raw deflate data, so the start of the body is checked for one.
+
+    :param encoding:    One of ENCODINGS
+    :param start:       The first chunk of the body
+    '''
+    if encoding != 'deflate':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    header = bytearray(start[:2])
+    if len(header) == 2 and (header[0] & 0x0f != 8 or
+                             (header[0] * 256 + header[1]) % 31):
+        return zlib.decompressobj(-zlib.MAX_WBITS)
+    return zlib.decompressobj(zlib.MAX_WBITS)
+
+
+def decompress(chunks, encoding):
+    '''
+    Decompresses a body a chunk at a time.
+
+    :param chunks:      An iterable of the compressed body's bytes
+    :param encoding:    One of ENCODINGS
+    :returns:           An iterator of the decompressed body's bytes, in
+                        chunks of at most CHUNK_SIZE bytes
+    :raises ValueError: If the body isn't validly compressed
+    '''
+    decompressor = None
+    try:
+        for chunk in chunks:
+            while chunk:
+                if decompressor is None:
+                    decompressor = _decompressor(encoding, chunk)
+                # A small chunk can decompress to a huge body, so it's
+                # decompressed a piece at a time
+                data = decompressor.decompress(chunk, CHUNK_SIZE)
+                if data:
+                    yield data
+                # A gzip body can hold several members one after another
+                if decompressor.unused_data:
+                    chunk = decompressor.unused_data
+                    decompressor = None
+                else:
+                    chunk = decompressor.unconsumed_tail
+        if decompressor is not None:
+            data = decompressor.flush()
+            if data:
+                yield data
+    except zlib.error as e:
+        raise ValueError(
+            "Couldn't decompress the {0} encoded body: {1}".format(
+                encoding, e
+                )
+            )
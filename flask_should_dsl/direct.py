@@ -0,0 +1,275 @@
+'''
+A fast path for making requests to an app, for suites that make many simple
+requests.
+
+``DirectClient`` calls an app's ``wsgi_app`` directly, with an environ copied
+from a template that's built once, and wraps what it returns in a slim
+``DirectResponse`` rather than a full werkzeug response.  This skips building
+a request with ``EnvironBuilder`` and wrapping the response, which is most of
+the cost of a test client request::
+
+    client = DirectClient(app)
+    client.get('/users/1') |should| have_json_at('id', 1)
+
+Direct clients don't keep cookies between requests, or follow redirects, so
+use the test client for anything that needs a session.
+'''
+import sys
+from collections import namedtuple
+from io import BytesIO
+from json import dumps, loads
+
+from werkzeug.datastructures import Headers
+from werkzeug.utils import cached_property
+
+from .cache import parse_content_type
+
+try:
+    from urllib.parse import unquote_to_bytes
+except ImportError:
+    from urllib import unquote as unquote_to_bytes
+
+
+# The request a DirectResponse was for
+DirectRequest = namedtuple('DirectRequest', 'method path query_string')
+
+
+def native_string(value):
+    '''
+    Converts a url part to a PEP 3333 native string: bytes on python 2, and
+    bytes decoded as latin-1 on python 3.  Text is encoded as utf-8 first.
+    '''
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    if str is bytes:
+        return value
+    return value.decode('latin-1')
+
+
+class DirectResponse(object):
+    '''
+    A lightweight response, with the parts of a werkzeug response that the
+    matchers use.
+
+    The body is only read from the app when it's needed, either all at once
+    through ``data`` or a chunk at a time through ``iter_encoded``.
+    '''
+    # The body is never a list, so matchers stream it
+    is_sequence = False
+
+    def __init__(self, status, header_list, body, request=None):
+        self.request = request
+        self.status = status
+        self.status_code = int(status.split(None, 1)[0])
+        self.header_list = header_list
+        self.response = self._body = body
+
+    def _header(self, name):
+        name = name.lower()
+        for key, value in self.header_list:
+            if key.lower() == name:
+                return value
+        return None
+
+    @cached_property
+    def headers(self):
+        return Headers(self.header_list)
+
+    @cached_property
+    def content_type(self):
+        return self._header('Content-Type') or ''
+
+    @cached_property
+    def mimetype(self):
+        return parse_content_type(self.content_type)[0]
+
+    @cached_property
+    def charset(self):
+        return parse_content_type(self.content_type)[1].get(
+            'charset', 'utf-8'
+            )
+
+    @cached_property
+    def location(self):
+        return self._header('Location')
+
+    def iter_encoded(self):
+        ''' Iterates over the body in chunks of bytes '''
+        for chunk in self.response:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode(self.charset)
+            yield chunk
+
+    @cached_property
+    def data(self):
+        ''' The whole body '''
+        data = b''.join(self.iter_encoded())
+        self.response = [data]
+        return data
+
+    @cached_property
+    def json(self):
+        ''' The body parsed as json '''
+        return loads(self.data.decode(self.charset))
+
+    def close(self):
+        # Matchers may have wrapped the body, so both it and the app's
+        # original body are closed
+        if self.response is not self._body and \
+                hasattr(self.response, 'close'):
+            self.response.close()
+        if hasattr(self._body, 'close'):
+            self._body.close()
+
+
+class DirectClient(object):
+    '''
+    Makes requests by calling an app's wsgi_app directly.
+
+    :param app:         The flask app (or any object with a wsgi_app, or a
+                        plain WSGI callable)
+    :param host:        The host requests are made to
+    :param scheme:      The url scheme requests are made with
+    :param environ:     Extra keys for the environ of every request
+    '''
+
+    def __init__(self, app, host='localhost', scheme='http', environ=None):
+        self.wsgi_app = getattr(app, 'wsgi_app', app)
+        name, _, port = host.partition(':')
+        self.template = {
+            'REQUEST_METHOD': 'GET',
+            'SCRIPT_NAME': '',
+            'PATH_INFO': '/',
+            'QUERY_STRING': '',
+            'SERVER_NAME': name,
+            'SERVER_PORT': port or ('443' if scheme == 'https' else '80'),
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'HTTP_HOST': host,
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scheme,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': False,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            }
+        if environ:
+            self.template.update(environ)
+
+    def environ(self, path, method='GET', data=None, headers=None,
+                content_type=None):
+        '''
+        Builds the environ for a request, from the template.
+
+        :param path:            The path to request, which may include a
+                                query string
+        :param method:          The request method
+        :param data:            The request body, as bytes or text
+        :param headers:         A dict or list of pairs of extra headers
+        :param content_type:    The content type of the body
+        '''
+        environ = self.template.copy()
+        path, _, query = path.partition('?')
+        if not isinstance(path, bytes):
+            path = path.encode('utf-8')
+        environ['REQUEST_METHOD'] = str(method.upper())
+        environ['PATH_INFO'] = native_string(unquote_to_bytes(path))
+        environ['QUERY_STRING'] = native_string(query)
+        if data is None:
+            data = b''
+        elif not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        environ['wsgi.input'] = BytesIO(data)
+        if data:
+            environ['CONTENT_LENGTH'] = str(len(data))
+        if content_type is not None:
+            environ['CONTENT_TYPE'] = content_type
+        if headers:
+            if hasattr(headers, 'items'):
+                headers = headers.items()
+            for name, value in headers:
+                key = name.upper().replace('-', '_')
+                if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                    key = 'HTTP_' + key
+                environ[key] = value
+        return environ
+
+    def open(self, path, method='GET', data=None, json=None, headers=None,
+             content_type=None):
+        '''
+        Makes a request.
+
+        :param json:    A value to send as a json body, instead of data
+        :returns:       A DirectResponse
+        '''
+        if json is not None:
+            data = dumps(json)
+            content_type = content_type or 'application/json'
+        environ = self.environ(path, method, data, headers, content_type)
+        started = []
+
+        # Nothing is sent until the app returns, so an app starting the
+        # response again after an error just replaces the status & headers
+        def start_response(status, header_list, exc_info=None):
+            started[:] = [status, list(header_list)]
+            return written.append
+
+        written = []
+        body = self.wsgi_app(environ, start_response)
+        if not started:
+            # Apps may wait until their body is iterated to start the response
+            body = _Prefetched(body)
+            if not started:
+                raise RuntimeError('The app did not start a response')
+        if written:
+            body = _Prefetched(body, written)
+        request = DirectRequest(
+            environ['REQUEST_METHOD'], environ['PATH_INFO'],
+            environ['QUERY_STRING']
+            )
+        return DirectResponse(started[0], started[1], body, request)
+
+    def get(self, path, **kwargs):
+        return self.open(path, 'GET', **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.open(path, 'POST', **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.open(path, 'PUT', **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.open(path, 'PATCH', **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.open(path, 'DELETE', **kwargs)
+
+    def head(self, path, **kwargs):
+        return self.open(path, 'HEAD', **kwargs)
+
+
+class _Prefetched(object):
+    '''
+    An app's body, with some chunks read ahead of it.  Closing it closes the
+    original body.
+    '''
+
+    def __init__(self, body, chunks=None):
+        self._body = body
+        self._iter = iter(body)
+        if chunks is None:
+            chunks = []
+            for chunk in self._iter:
+                chunks.append(chunk)
+                break
+        self._chunks = chunks
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield chunk
+        for chunk in self._iter:
+            yield chunk
+
+    def close(self):
+        if hasattr(self._body, 'close'):
+            self._body.close()
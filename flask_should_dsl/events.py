@@ -0,0 +1,147 @@
+'''
+Incremental parsing of streamed events, for the stream_events matcher.
+
+Both parsers here take an iterable of chunks and yield events as soon as the
+chunks holding them have arrived, so a consumer can stop reading (and close
+the stream) once it has seen the events it wants.  Server-sent events are
+parsed as described by the html spec, and newline delimited json as one
+value per non-blank line.
+'''
+import json
+import re
+from collections import namedtuple
+
+_LINE_END = re.compile(b'\r\n|\r|\n')
+
+# The mimetypes that are parsed as server-sent events & as newline delimited
+# json when no format is given
+SSE_MIMETYPES = ('text/event-stream',)
+NDJSON_MIMETYPES = (
+    'application/x-ndjson', 'application/ndjson', 'application/jsonl',
+    'application/x-jsonlines', 'application/json-seq'
+    )
+
+
+class StreamError(ValueError):
+    ''' Raised when a stream can't be parsed '''
+
+
+class Event(namedtuple('Event', 'data event id retry')):
+    '''
+    A server-sent event.
+
+    :ivar data:     The event's data, with multiple data lines joined by
+                    newlines
+    :ivar event:    The event type, which defaults to 'message'
+    :ivar id:       The last event id seen, or None
+    :ivar retry:    The reconnection time from this event in milliseconds, or
+                    None
+    '''
+
+    def __new__(cls, data, event='message', id=None, retry=None):
+        return super(Event, cls).__new__(cls, data, event, id, retry)
+
+    def json(self):
+        ''' Parses the event's data as json '''
+        return json.loads(self.data)
+
+
+def iter_lines(chunks):
+    '''
+    Splits a stream of chunks into lines, without their line endings.
+
+    Any of '\\r\\n', '\\r' and '\\n' end a line.  A '\\r' at the end of a
+    chunk is held back until the next chunk arrives, in case it's the start of
+    a '\\r\\n'.
+
+    :param chunks:  An iterable of bytes
+    :returns:       An iterator of bytes, one for each line.  An unterminated
+                    last line is included.
+    '''
+    buffer = b''
+    for chunk in chunks:
+        buffer += chunk
+        start = 0
+        for end in _LINE_END.finditer(buffer):
+            if end.group() == b'\r' and end.end() == len(buffer):
+                break
+            yield buffer[start:end.start()]
+            start = end.end()
+        buffer = buffer[start:]
+    if buffer:
+        yield buffer[:-1] if buffer.endswith(b'\r') else buffer
+
+
+def parse_sse(chunks):
+    '''
+    Parses a stream of server-sent events.
+
+    :param chunks:  An iterable of bytes
+    :returns:       An iterator of Events.  Events without any data aren't
+                    dispatched, as in a browser, nor is an event that the
+                    stream ended before finishing.
+    '''
+    data, event, last_id, retry = [], None, None, None
+    for line in iter_lines(chunks):
+        if not line:
+            if data:
+                yield Event(
+                    '\n'.join(data), event or 'message', last_id, retry
+                    )
+            data, event, retry = [], None, None
+            continue
+        line = line.decode('utf-8', 'replace')
+        if line.startswith(':'):
+            continue
+        field, _, value = line.partition(':')
+        if value.startswith(' '):
+            value = value[1:]
+        if field == 'data':
+            data.append(value)
+        elif field == 'event':
+            event = value
+        elif field == 'id' and '\0' not in value:
+            last_id = value
+        elif field == 'retry' and value.isdigit():
+            retry = int(value)
+
+
+def parse_ndjson(chunks, charset='utf-8'):
+    '''
+    Parses a stream of newline delimited json.
+
+    Blank lines are skipped, as are the record separators that start each
+    value of a json text sequence.
+
+    :param chunks:  An iterable of bytes
+    :param charset: The charset the stream is encoded with
+    :returns:       An iterator of the decoded values
+    :raises StreamError:    If a line isn't valid json
+    '''
+    for number, line in enumerate(iter_lines(chunks), 1):
+        line = line.decode(charset, 'replace').strip().lstrip('\x1e')
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            raise StreamError(
+                'Line {0} is not valid json: {1}'.format(number, e)
+                )
+
+
+PARSERS = {'sse': parse_sse, 'ndjson': parse_ndjson}
+
+
+def guess_format(mimetype):
+    '''
+    Picks the format to parse a stream in from its mimetype.
+
+    :returns:   'sse' or 'ndjson', or None if the mimetype isn't a known
+                stream format
+    '''
+    if mimetype in SSE_MIMETYPES:
+        return 'sse'
+    if mimetype in NDJSON_MIMETYPES:
+        return 'ndjson'
+    return None
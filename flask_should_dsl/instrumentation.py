@@ -0,0 +1,230 @@
+'''
+Opt-in instrumentation of matchers.
+
+Hooks can be added to be told about every match that any flask-should-dsl
+matcher makes.  The match methods are only wrapped while there are hooks, so
+there's no overhead when instrumentation isn't being used.
+
+The most common use is to collect timing statistics for a whole test run,
+which can be done by calling ``enable()``, or by setting the
+``FLASK_SHOULD_DSL_STATS`` environment variable to a file the summary should
+be written to when the run finishes (or ``-`` for stderr).
+'''
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+from . import matchers
+from .cache import view_for
+
+ENVIRONMENT_VARIABLE = 'FLASK_SHOULD_DSL_STATS'
+
+_timer = getattr(time, 'perf_counter', time.time)
+
+_hooks = []
+_hooks_lock = threading.Lock()
+_originals = {}
+
+
+class MatchEvent(object):
+    '''
+    Details of a single match, as passed to hooks.
+
+    :ivar matcher:  The matcher instance that made the match
+    :ivar name:     The name of the matcher (e.g. 'be_200' or 'have_json')
+    :ivar response: The response that was matched against
+    :ivar matched:  The result of the match, or None if it raised
+    :ivar passed:   Whether the assertion passed, taking should_not into
+                    account
+    :ivar elapsed:  The wall time the match took, in seconds
+    :ivar error:    The exception the match raised, if any
+    '''
+
+    def __init__(self, matcher, response, matched, elapsed, error=None):
+        self.matcher = matcher
+        self.name = getattr(matcher, 'name', type(matcher).__name__)
+        self.response = response
+        self.matched = matched
+        negate = getattr(matcher, 'run_with_negate', False)
+        self.passed = error is None and bool(matched) != negate
+        self.elapsed = elapsed
+        self.error = error
+
+    @property
+    def bytes_read(self):
+        ''' The number of bytes of the response body read by the match '''
+        return view_for(self.response).bytes_read
+
+
+def matcher_classes():
+    '''
+    Gets the matcher classes whose match methods get wrapped.  Subclasses
+    that inherit match don't need wrapping themselves.
+    '''
+    return [
+        value for value in vars(matchers).values()
+        if isinstance(value, type) and 'match' in vars(value)
+        ]
+
+
+def _wrap(match):
+    @functools.wraps(match)
+    def wrapper(self, response):
+        start = _timer()
+        try:
+            matched = match(self, response)
+        except Exception as e:
+            _notify(MatchEvent(self, response, None, _timer() - start, e))
+            raise
+        _notify(MatchEvent(self, response, matched, _timer() - start))
+        return matched
+    return wrapper
+
+
+def _notify(event):
+    for hook in list(_hooks):
+        hook(event)
+
+
+def _install():
+    for cls in matcher_classes():
+        if cls not in _originals:
+            _originals[cls] = vars(cls)['match']
+            cls.match = _wrap(_originals[cls])
+
+
+def _uninstall():
+    for cls, match in _originals.items():
+        cls.match = match
+    _originals.clear()
+
+
+def add_hook(hook):
+    '''
+    Adds a hook that's called after every match.
+
+    :param hook:    A callable taking a MatchEvent
+    '''
+    with _hooks_lock:
+        _hooks.append(hook)
+        _install()
+
+
+def remove_hook(hook):
+    ''' Removes a hook added with add_hook '''
+    with _hooks_lock:
+        _hooks.remove(hook)
+        if not _hooks:
+            _uninstall()
+
+
+class Stats(object):
+    '''
+    A hook that collects statistics for each matcher: how many times it was
+    called, how many of those passed & failed, how long they took and how
+    much of the response bodies they read.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, event):
+        bytes_read = event.bytes_read
+        with self._lock:
+            stats = self._stats.get(event.name)
+            if stats is None:
+                stats = self._stats[event.name] = {
+                    'calls': 0, 'passed': 0, 'failed': 0, 'errors': 0,
+                    'total_time': 0.0, 'max_time': 0.0, 'bytes_read': 0,
+                    }
+            stats['calls'] += 1
+            if event.error is not None:
+                stats['errors'] += 1
+            elif event.passed:
+                stats['passed'] += 1
+            else:
+                stats['failed'] += 1
+            stats['total_time'] += event.elapsed
+            stats['max_time'] = max(stats['max_time'], event.elapsed)
+            stats['bytes_read'] += bytes_read
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self):
+        '''
+        Gets a summary of the statistics
+
+        :returns:   A dict mapping matcher names to dicts of statistics
+        '''
+        with self._lock:
+            summary = {}
+            for name, stats in self._stats.items():
+                stats = dict(stats)
+                stats['mean_time'] = stats['total_time'] / stats['calls']
+                summary[name] = stats
+            return summary
+
+    def report(self, stream=None):
+        ''' Writes a table of the statistics, slowest matchers first '''
+        stream = stream or sys.stderr
+        summary = self.summary()
+        stream.write('{0:<30} {1:>8} {2:>8} {3:>8} {4:>12} {5:>12}\n'.format(
+            'matcher', 'calls', 'passed', 'failed', 'total (ms)', 'bytes read'
+            ))
+        names = sorted(
+            summary, key=lambda name: summary[name]['total_time'],
+            reverse=True
+            )
+        for name in names:
+            stats = summary[name]
+            stream.write(
+                '{0:<30} {1:>8} {2:>8} {3:>8} {4:>12.2f} {5:>12}\n'.format(
+                    name, stats['calls'], stats['passed'], stats['failed'],
+                    stats['total_time'] * 1000, stats['bytes_read']
+                    )
+                )
+
+    def export(self, path):
+        '''
+        Exports the statistics to a file as json, or writes a table to stderr
+        if path is '-'
+        '''
+        if path == '-':
+            self.report()
+            return
+        with open(path, 'w') as output:
+            json.dump(self.summary(), output, indent=2, sort_keys=True)
+
+
+# The statistics collected by enable()
+stats = Stats()
+
+
+def enable(output=None):
+    '''
+    Starts collecting statistics on every match into ``stats``.
+
+    :param output:  An optional file to export the statistics to when the
+                    process exits, or '-' to write a table to stderr
+    '''
+    if stats not in _hooks:
+        add_hook(stats)
+    if output:
+        atexit.register(stats.export, output)
+
+
+def disable():
+    ''' Stops collecting statistics '''
+    if stats in _hooks:
+        remove_hook(stats)
+
+
+if os.environ.get(ENVIRONMENT_VARIABLE):
+    enable(output=os.environ[ENVIRONMENT_VARIABLE])
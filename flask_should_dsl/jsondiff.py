@@ -0,0 +1,162 @@
+'''
+Structural diffs of json documents, for have_json's failure messages.
+
+Rather than printing two whole documents, the expected & actual documents are
+walked together and only the paths where they differ are reported.  The walk
+is lazy, so it stops as soon as enough differences have been found to fill a
+message, and values are only formatted up to a limit, so describing the
+difference between two huge documents is cheap.
+'''
+import itertools
+import json
+
+from .jsonstream import format_path
+from .messages import to_text
+
+# The number of differences that are reported
+DIFF_LIMIT = 20
+
+# The maximum number of characters of each value in a difference
+VALUE_LIMIT = 80
+
+MISSING, UNEXPECTED, CHANGED = 'missing', 'unexpected', 'changed'
+
+
+def iter_differences(expected, actual, path=()):
+    '''
+    Walks two json documents together, yielding the places they differ.
+
+    Dicts are compared key by key.  For lists, the longest matching prefix &
+    suffix are skipped first, so an item added to or removed from the middle
+    of a list is reported once, rather than as a change to every item after
+    it.
+
+    :param expected:    The expected document
+    :param actual:      The actual document
+    :param path:        The path to the documents, as a tuple of segments
+    :returns:           An iterator of (kind, path, expected, actual) tuples,
+                        where kind is MISSING, UNEXPECTED or CHANGED, and
+                        expected or actual is None for a value that's missing
+                        from that document
+    '''
+    if isinstance(expected, dict) and isinstance(actual, dict):
+        for key in sorted(expected, key=to_text):
+            if key not in actual:
+                yield MISSING, path + (to_text(key),), expected[key], None
+            else:
+                for difference in iter_differences(
+                        expected[key], actual[key], path + (to_text(key),)):
+                    yield difference
+        for key in sorted(actual, key=to_text):
+            if key not in expected:
+                yield UNEXPECTED, path + (to_text(key),), None, actual[key]
+    elif isinstance(expected, list) and isinstance(actual, list):
+        for difference in _list_differences(expected, actual, path):
+            yield difference
+    elif expected != actual:
+        yield CHANGED, path, expected, actual
+
+
+def _list_differences(expected, actual, path):
+    shortest = min(len(expected), len(actual))
+    start = 0
+    while start < shortest and expected[start] == actual[start]:
+        start += 1
+    end = 0
+    while end < shortest - start and \
+            expected[-1 - end] == actual[-1 - end]:
+        end += 1
+    middle = shortest - start - end
+    for index in range(start, start + middle):
+        for difference in iter_differences(
+                expected[index], actual[index], path + (str(index),)):
+            yield difference
+    for index in range(start + middle, len(expected) - end):
+        yield MISSING, path + (str(index),), expected[index], None
+    for index in range(start + middle, len(actual) - end):
+        yield UNEXPECTED, path + (str(index),), None, actual[index]
+
+
+def _pieces(value):
+    ''' Serialises a value to json a piece at a time '''
+    if isinstance(value, dict):
+        yield '{'
+        for number, key in enumerate(sorted(value, key=to_text)):
+            if number:
+                yield ', '
+            yield _scalar(to_text(key))
+            yield ': '
+            for piece in _pieces(value[key]):
+                yield piece
+        yield '}'
+    elif isinstance(value, list):
+        yield '['
+        for number, item in enumerate(value):
+            if number:
+                yield ', '
+            for piece in _pieces(item):
+                yield piece
+        yield ']'
+    else:
+        yield _scalar(value)
+
+
+def _scalar(value):
+    try:
+        return json.dumps(value)
+    except (TypeError, ValueError):
+        return repr(value)
+
+
+def format_value(value, limit=None):
+    '''
+    Formats a value as json, for a difference.  Only as much of the value as
+    fits in the limit is serialised.
+
+    :param value:   The value to format
+    :param limit:   The most characters to include.  Defaults to VALUE_LIMIT
+    '''
+    limit = limit or VALUE_LIMIT
+    parts, size = [], 0
+    for piece in _pieces(value):
+        parts.append(piece)
+        size += len(piece)
+        if size > limit:
+            return ''.join(parts)[:limit] + '...'
+    return ''.join(parts)
+
+
+def describe_difference(kind, path, expected, actual):
+    ''' Describes one of the differences from iter_differences '''
+    path = format_path(path) or '<root>'
+    if kind == MISSING:
+        return '{0}: expected {1}, but it was missing'.format(
+            path, format_value(expected)
+            )
+    if kind == UNEXPECTED:
+        return '{0}: did not expect {1}'.format(path, format_value(actual))
+    return '{0}: expected {1}, but got {2}'.format(
+        path, format_value(expected), format_value(actual)
+        )
+
+
+def diff(expected, actual, limit=None):
+    '''
+    Describes how two json documents differ.
+
+    :param expected:    The expected document
+    :param actual:      The actual document
+    :param limit:       The most differences to describe.  Defaults to
+                        DIFF_LIMIT
+    :returns:           A (lines, more) tuple, where lines describe each
+                        difference and more is True if there were more
+                        differences than the limit
+    '''
+    limit = limit or DIFF_LIMIT
+    differences = list(itertools.islice(
+        iter_differences(expected, actual), limit + 1
+        ))
+    lines = [
+        describe_difference(*difference) for difference in differences[:limit]
+        ]
+    return lines, len(differences) > limit
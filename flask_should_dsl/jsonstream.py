@@ -0,0 +1,324 @@
+'''
+Incremental, path directed json parsing.
+
+Rather than parsing a whole document, the parser here walks a stream of
+chunks looking for a set of paths.  Containers that lead towards a wanted path
+are descended into, values at a wanted path are decoded, and everything else
+is skipped over without being built.  Parsing stops as soon as every wanted
+path has been seen.
+'''
+import codecs
+import json
+import re
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_SCALAR = re.compile(r'[^,\]}\s]*')
+
+# Once this many characters of the buffer have been consumed, they're dropped
+_COMPACT_SIZE = 64 * 1024
+
+# Large chunks are fed into the buffer in pieces of this many bytes, so the
+# buffer stays small even if the whole body is one chunk
+_PIECE_SIZE = 64 * 1024
+
+# The bounds on the window of text that containers are skipped over with
+_MIN_WINDOW = 256
+_MAX_WINDOW = 8 * 1024
+
+_decoder = json.JSONDecoder()
+
+
+def _pieces(chunks):
+    ''' Splits an iterable of chunks into pieces of at most _PIECE_SIZE '''
+    for chunk in chunks:
+        if len(chunk) <= _PIECE_SIZE:
+            yield chunk
+            continue
+        for start in range(0, len(chunk), _PIECE_SIZE):
+            yield chunk[start:start + _PIECE_SIZE]
+
+
+def parse_path(path):
+    '''
+    Parses a path into a tuple of segments.
+
+    :param path:    Either a dotted string (e.g. ``'data.0.id'``) or a sequence
+                    of keys & indexes
+    :returns:       A tuple of string segments
+    '''
+    if isinstance(path, (tuple, list)):
+        return tuple(str(segment) for segment in path)
+    return tuple(path.split('.')) if path else ()
+
+
+def format_path(path):
+    ''' Formats a tuple of segments back into a dotted path '''
+    return '.'.join(path)
+
+
+def resolve_path(document, path):
+    '''
+    Looks up a path in an already parsed json document.
+
+    :param document:    The parsed json
+    :param path:        A tuple of segments, as returned by parse_path
+    :returns:           A (found, value) tuple
+    '''
+    value = document
+    for segment in path:
+        if isinstance(value, dict):
+            if segment not in value:
+                return False, None
+            value = value[segment]
+        elif isinstance(value, list):
+            try:
+                value = value[int(segment)]
+            except (ValueError, IndexError):
+                return False, None
+        else:
+            return False, None
+    return True, value
+
+
+class _Done(Exception):
+    ''' Raised internally to stop parsing early '''
+
+
+class _Parser(object):
+    '''
+    A path directed parser over a buffer of text that's refilled from an
+    iterator of chunks
+    '''
+
+    def __init__(self, chunks, paths, until, charset='utf-8'):
+        self._chunks = _pieces(chunks)
+        self._text = codecs.getincrementaldecoder(charset)()
+        self._buf = u''
+        self._pos = 0
+        # The start of a value being decoded, and the text of it that's been
+        # moved out of the buffer
+        self._mark = None
+        self._held = None
+        self._eof = False
+        self._wanted = set(paths)
+        self._prefixes = set(
+            path[:i] for path in self._wanted for i in range(len(path))
+            )
+        self._until = until
+        self._window = _MIN_WINDOW
+        self.found = {}
+
+    def parse(self):
+        try:
+            self._value(())
+        except _Done:
+            pass
+        return self.found
+
+    def _more(self):
+        '''
+        Reads another chunk into the buffer.
+
+        :returns:   False if there's nothing left to read
+        '''
+        if self._mark is not None:
+            # The buffer isn't grown to hold the whole of a value, which would
+            # copy it again for every chunk
+            self._held.append(self._buf[self._mark:self._pos])
+            self._buf = self._buf[self._pos:]
+            self._mark = self._pos = 0
+        elif self._pos > _COMPACT_SIZE:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        while not self._eof:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._eof = True
+                text = self._text.decode(b'', True)
+            else:
+                if isinstance(chunk, bytes):
+                    text = self._text.decode(chunk)
+                else:
+                    text = chunk
+            if text:
+                self._buf += text
+                return True
+        return False
+
+    def _peek(self):
+        ''' Skips whitespace and returns the next character '''
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._more():
+                raise ValueError('Unexpected end of json')
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(
+                "Expected '{0}' at position {1} of json".format(
+                    char, self._pos
+                    )
+                )
+        self._pos += 1
+
+    def _value(self, path):
+        char = self._peek()
+        if path in self._wanted:
+            self.found[path] = self._decode()
+            if len(self.found) == len(self._wanted) or \
+                    self._until(path, self.found[path]):
+                raise _Done()
+        elif path in self._prefixes and char == '{':
+            self._object(path)
+        elif path in self._prefixes and char == '[':
+            self._array(path)
+        else:
+            self._skip()
+
+    def _object(self, path):
+        self._pos += 1
+        if self._peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            if self._peek() != '"':
+                raise ValueError(
+                    'Expected a key at position {0} of json'.format(self._pos)
+                    )
+            key = self._decode()
+            self._expect(':')
+            self._value(path + (key,))
+            char = self._peek()
+            self._pos += 1
+            if char == '}':
+                return
+            elif char != ',':
+                raise ValueError(
+                    'Unexpected {0!r} in json object'.format(char)
+                    )
+
+    def _array(self, path):
+        self._pos += 1
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        index = 0
+        while True:
+            self._value(path + (str(index),))
+            index += 1
+            char = self._peek()
+            self._pos += 1
+            if char == ']':
+                return
+            elif char != ',':
+                raise ValueError(
+                    'Unexpected {0!r} in json array'.format(char)
+                    )
+
+    def _decode(self):
+        '''
+        Decodes the complete json value at the current position.
+
+        The end of the value is found by skipping over it first, which reads
+        as much as it needs to, so the value itself is only decoded once.
+        '''
+        self._peek()
+        self._mark, self._held = self._pos, []
+        try:
+            self._skip()
+            self._held.append(self._buf[self._mark:self._pos])
+            text = u''.join(self._held)
+        finally:
+            self._mark = self._held = None
+        value, end = _decoder.raw_decode(text)
+        if end != len(text):
+            raise ValueError(
+                'Unexpected {0!r} in json'.format(text[end:end + 10])
+                )
+        return value
+
+    def _skip(self):
+        ''' Skips over the json value at the current position '''
+        char = self._peek()
+        if char == '"':
+            self._skip_string()
+        elif char in '[{':
+            self._skip_container()
+        else:
+            while True:
+                end = _SCALAR.match(self._buf, self._pos).end()
+                if end < len(self._buf) or not self._more():
+                    break
+            if end == self._pos:
+                raise ValueError(
+                    'Unexpected {0!r} in json'.format(self._buf[self._pos])
+                    )
+            self._pos = end
+
+    def _skip_string(self):
+        while True:
+            match = _STRING.match(self._buf, self._pos)
+            if match:
+                self._pos = match.end()
+                return
+            if not self._more():
+                raise ValueError('Unterminated string in json')
+
+    def _skip_container(self):
+        '''
+        Skips over the container at the current position.
+
+        Small containers are skipped by decoding a bounded window of the
+        buffer, which is much faster than scanning them a character at a time.
+        Anything that doesn't fit in the window is stepped through one value
+        at a time, so memory use stays bounded by the window size.
+        '''
+        window = self._window
+        while True:
+            text = self._buf[self._pos:self._pos + window]
+            try:
+                end = _decoder.raw_decode(text)[1]
+            except ValueError:
+                if window < _MAX_WINDOW:
+                    window = _MAX_WINDOW
+                    continue
+                break
+            self._pos += end
+            self._window = min(_MAX_WINDOW, max(_MIN_WINDOW, end * 2))
+            return
+        closing = '}' if self._buf[self._pos] == '{' else ']'
+        self._pos += 1
+        while True:
+            char = self._peek()
+            if char == closing:
+                self._pos += 1
+                return
+            elif char in ',:':
+                self._pos += 1
+            else:
+                self._skip()
+
+
+def _never(path, value):
+    return False
+
+
+def find_paths(chunks, paths, until=None, charset='utf-8'):
+    '''
+    Finds the values at a set of paths in a stream of json.
+
+    :param chunks:  An iterable of bytes (or text) containing the json
+    :param paths:   An iterable of paths, as returned by parse_path
+    :param until:   An optional callback taking a path & its value.  If it
+                    returns True parsing stops straight away.
+    :param charset: The charset bytes chunks are decoded with
+    :returns:       A dict mapping each path that was found to its value
+    '''
+    paths = set(paths)
+    if not paths:
+        return {}
+    return _Parser(chunks, paths, until or _never, charset).parse()
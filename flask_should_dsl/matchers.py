@@ -1,8 +1,95 @@
+import copy
+import functools
 import json
-from should_dsl import matcher
+import re
+import threading
+from collections import namedtuple
+
+from should_dsl import matcher, should, should_not
+from should_dsl.dsl import ShouldNotSatisfied
 
 from werkzeug.http import HTTP_STATUS_CODES
 
+from .cache import LRUCache, parse_content_type, view_for, view_ref
+from .jsonstream import find_paths, format_path, parse_path, resolve_path
+from .messages import excerpt, excerpt_difference, to_text
+from .search import decode_chunks, stream_find, stream_find_all, stream_search
+
+
+def isolated(call):
+    '''
+    Decorator for matcher __call__ methods, that runs them against a copy of
+    the matcher.
+
+    should-dsl shares matcher instances between every spec (and every thread)
+    that uses them, so this gives each assertion its own object to hold its
+    arguments and results, and the shared instance is never modified.
+
+    The arguments are also kept on the copy as ``arguments``, a (pargs,
+    kwargs) tuple, for instrumentation hooks to report.
+    '''
+    @functools.wraps(call)
+    def wrapper(self, *pargs, **kwargs):
+        isolated = copy.copy(self)
+        isolated.arguments = (pargs, kwargs)
+        return call(isolated, *pargs, **kwargs)
+    return wrapper
+
+
+class Expectation(namedtuple('Expectation', 'name pargs kwargs negate')):
+    '''
+    A matcher given by name along with its arguments, for checking responses
+    without the ``|should|`` syntax.
+
+    should-dsl keeps the value being checked on a single shared object, so
+    ``|should|`` can't be used from several threads at once, whereas checking
+    an expectation only touches the matcher it creates.  Expectations can
+    also be pickled, so they can be sent to other processes.
+    '''
+
+    @classmethod
+    def create(cls, name, *pargs, **kwargs):
+        ''' Creates an expectation that a response should match '''
+        return cls(name, pargs, kwargs, False)
+
+    @classmethod
+    def create_not(cls, name, *pargs, **kwargs):
+        ''' Creates an expectation that a response should not match '''
+        return cls(name, pargs, kwargs, True)
+
+    def matcher(self):
+        ''' Creates the matcher for this expectation '''
+        dsl = should_not if self.negate else should
+        # should-dsl only exposes matchers by injecting them into the calling
+        # namespace, so they're looked up in its registry instead.
+        try:
+            factory = dsl._matchers_by_name[self.name]
+        except KeyError:
+            raise ValueError('Unknown matcher {0!r}'.format(self.name))
+        # Some matchers (e.g. the status matchers) are shared instances, so
+        # each expectation negates its own copy
+        item = copy.copy(factory())
+        try:
+            item.run_with_negate = self.negate
+        except AttributeError:
+            pass
+        if self.pargs or self.kwargs:
+            item = item(*self.pargs, **self.kwargs)
+        return item
+
+    def check(self, response):
+        '''
+        Checks a response against this expectation
+
+        :raises ShouldNotSatisfied: If the response doesn't meet it
+        '''
+        item = self.matcher()
+        if bool(item.match(response)) == self.negate:
+            if self.negate:
+                raise ShouldNotSatisfied(item.message_for_failed_should_not())
+            raise ShouldNotSatisfied(item.message_for_failed_should())
+
+
 @matcher
 class GenericStatusChecker(object):
     '''
@@ -10,6 +97,7 @@ class GenericStatusChecker(object):
     '''
     name = 'have_status'
 
+    @isolated
     def __call__(self, expected):
         self._expected = expected
         return self
@@ -27,6 +115,48 @@ class GenericStatusChecker(object):
         return 'Expected the status code not to be {0}'.format(self._expected)
 
 
+class StatusMatcher(object):
+    '''
+    Table driven status checking class, used for the be_xxx, abort_xxx and
+    return_xxx matchers.
+
+    Instances are registered with should-dsl directly: calling one returns
+    itself, so the same object serves ``be_200`` and ``be_200()``.  As that
+    object is shared by every thread, the results of a match are kept per
+    thread.
+    '''
+
+    def __init__(self, name, status):
+        self.name = name
+        self._status = status
+        self._results = threading.local()
+
+    def __call__(self):
+        return self
+
+    def match(self, response):
+        results = self._results
+        results.actual = response.status_code
+        # Only the status is needed to match, so just keep a reference for
+        # reading the body if the match fails.
+        results.view = view_ref(response)
+        return results.actual == self._status
+
+    def message_for_failed_should(self):
+        results = self._results
+        message = 'Expected the status code {0}, but got {1}.'.format(
+                  self._status, results.actual
+                  )
+        view = results.view()
+        if view is not None and view.data:
+            response = 'Response Data:\n"{0}"'.format(excerpt(view.data))
+            message = '\n'.join([message, response])
+        return message
+
+    def message_for_failed_should_not(self):
+        return 'Expected the status code not to be {0}'.format(self._status)
+
+
 def make_status_checker(nameprefix, status):
     '''
     Gets a status checker class
@@ -34,37 +164,36 @@ def make_status_checker(nameprefix, status):
     :param status:      The status the checker should check for
     :returns:           A class that will check for the status
     '''
-    class Checker(object):
-        name = '{0}_{1}'.format(nameprefix, status)
+    name = '{0}_{1}'.format(nameprefix, status)
 
-        def __call__(self):
-            return self
+    class Checker(StatusMatcher):
+        def __init__(self):
+            StatusMatcher.__init__(self, name, status)
+    Checker.name = name
+    return Checker
 
-        def match(self, response):
-            self._actual = response.status_code
-            self._response_data = response.data
-            return self._actual == status
 
-        def message_for_failed_should(self):
-            message = 'Expected the status code {0}, but got {1}.'.format(
-                      status, self._actual
-                      )
-            if self._response_data:
-                response = 'Response Data:\n"{0}"'.format(self._response_data)
-                message = '\n'.join([message, response])
-            return message
+STATUS_PREFIXES = ('be', 'abort', 'return')
 
-        def message_for_failed_should_not(self):
-            return 'Expected the status code not to be {0}'.format(status)
-    return Checker
+
+def register_status_matchers(codes, prefixes=STATUS_PREFIXES):
+    '''
+    Registers a be_xxx/abort_xxx/return_xxx matcher for each status code.
+
+    should-dsl injects every registered matcher into the calling namespace
+    on each ``|should|``, so each name is a single shared StatusMatcher
+    rather than a class of its own.
+
+    :param codes:       An iterable of status codes
+    :param prefixes:    The name prefixes to register for each code
+    '''
+    for code in codes:
+        for prefix in prefixes:
+            matcher(StatusMatcher('{0}_{1}'.format(prefix, code), code))
 
 
 # Make be_xxx matchers for all the status codes
-_status_codes = HTTP_STATUS_CODES.keys()
-for code in _status_codes:
-    matcher(make_status_checker('be', code))
-    matcher(make_status_checker('abort', code))
-    matcher(make_status_checker('return', code))
+register_status_matchers(HTTP_STATUS_CODES)
 
 
 @matcher
@@ -72,6 +201,7 @@ class RedirectMatcher(object):
     ''' A matcher to check for redirects '''
     name = 'redirect_to'
 
+    @isolated
     def __call__(self, location):
         self._expected = 'http://localhost' + location
         self._status_ok = True
@@ -83,7 +213,10 @@ class RedirectMatcher(object):
         if self._actual_status not in (301, 302):
             self._status_ok = False
             return False
-        return self._actual_location == self._expected
+        from .redirects import absolute_url
+        # Newer versions of werkzeug leave relative locations as they are
+        return absolute_url(self._actual_location, self._expected) == \
+            self._expected
 
     def message_for_failed_should(self):
         if self._status_ok:
@@ -101,11 +234,77 @@ class RedirectMatcher(object):
                 )
 
 
+@matcher
+class RedirectChainMatcher(object):
+    '''
+    A matcher to check where a chain of redirects ends up.
+
+    Redirects after the first are followed by GETting each location through
+    a test client, so the client (or app) has to be given.
+    '''
+    name = 'redirect_chain_to'
+
+    @isolated
+    def __call__(self, target, client=None, max_hops=10, scheme='http',
+                 host='localhost'):
+        if client is None:
+            raise Exception('redirect_chain_to needs a client to follow the '
+                            'redirects with')
+        from .redirects import RedirectFollower, absolute_url
+        self._follower = RedirectFollower(client, scheme, host)
+        self._target = absolute_url(target, self._follower.base)
+        self._max_hops = max_hops
+        return self
+
+    def match(self, response):
+        from .redirects import REDIRECT_STATUSES
+        self._status = response.status_code
+        self._chain, self._problem = [], None
+        if self._status not in REDIRECT_STATUSES:
+            return False
+        self._chain, self._problem = self._follower.follow(
+            response.headers.get('Location', ''), self._max_hops
+            )
+        return self._problem is None and self._chain[-1][0] == self._target
+
+    def _format_chain(self):
+        from .redirects import REDIRECT_STATUSES
+        steps = ['<response> -{0}->'.format(self._status)]
+        for url, status in self._chain:
+            if status in REDIRECT_STATUSES:
+                steps.append('{0} -{1}->'.format(url, status))
+            else:
+                steps.append(url)
+        return ' '.join(steps)
+
+    def message_for_failed_should(self):
+        from .redirects import REDIRECT_STATUSES
+        if self._status not in REDIRECT_STATUSES:
+            return 'Expected a redirect status, but got {0}'.format(
+                self._status
+                )
+        if self._problem is not None:
+            return 'Expected redirects to end at "{0}", but found a {1}:' \
+                   '\n\t{2}'.format(
+                       self._target, self._problem, self._format_chain()
+                       )
+        return 'Expected redirects to end at "{0}", but they ended at ' \
+               '"{1}":\n\t{2}'.format(
+                   self._target, self._chain[-1][0], self._format_chain()
+                   )
+
+    def message_for_failed_should_not(self):
+        return 'Did not expect redirects to end at "{0}":\n\t{1}'.format(
+            self._target, self._format_chain()
+            )
+
+
 @matcher
 class JsonMatcher(object):
     ''' A matcher to check for json responses '''
     name = 'have_json'
 
+    @isolated
     def __call__(self, *pargs, **kwargs):
         if len(pargs) > 1:
             raise Exception('have_json only accepts one positional argument')
@@ -121,24 +320,242 @@ class JsonMatcher(object):
         return self
 
     def match(self, response):
-        try:
-            self._actual = response.json
-        except AttributeError:
-            self._actual = json.loads(response.data)
-        return self._actual == self._expected
+        self._view = view_ref(response)
+        return self._view().json == self._expected
 
     def message_for_failed_should(self):
-        # TODO: Formatting on this could probably be better
-        #       Thinking a diff option might be good for this one too
-        return "Expected response to have json:\n\t{0}\nbut got:\n\t{1}".format(
-                self._expected, self._actual
+        view = self._view()
+        if view is None:
+            return "Expected response to have json:\n\t{0}".format(
+                excerpt(self._expected)
                 )
+        from .jsondiff import CHANGED, describe_difference, diff
+        lines, more = diff(self._expected, view.json)
+        if not lines:
+            lines = [describe_difference(
+                CHANGED, (), self._expected, view.json
+                )]
+        if more:
+            lines.append('...and more')
+        return "Expected response to have json, but it differs at:\n\t" \
+               "{0}".format('\n\t'.join(lines))
 
     def message_for_failed_should_not(self):
         # TODO: Formatting on this could probably be better
         return "Did not expect response to contain json:\n\t{0}".format(
-                self._expected
+                excerpt(self._expected)
+                )
+
+
+class JsonSubsetMatcher(object):
+    '''
+    Base class for matchers that check parts of a json response.
+
+    Streamable bodies are parsed incrementally, and parsing stops as soon as
+    every expected path has been seen (or one of them doesn't match).
+    '''
+
+    def _set_expected(self, expected):
+        '''
+        Sets the expected values
+        :param expected:    A dict mapping paths (as returned by parse_path)
+                            to their expected values
+        '''
+        self._expected = expected
+        return self
+
+    def match(self, response):
+        view = view_for(response)
+        expected = self._expected
+        if view.streamable and not view.cached('json'):
+            self._found = find_paths(
+                view.iter_chunks(), expected,
+                until=lambda path, value: value != expected[path],
+                charset=view.charset
+                )
+        else:
+            self._found = {}
+            for path in expected:
+                found, value = resolve_path(view.json, path)
+                if found:
+                    self._found[path] = value
+        return all(
+            path in self._found and self._found[path] == value
+            for path, value in expected.items()
+            )
+
+    def message_for_failed_should(self):
+        for path in sorted(self._expected):
+            expected = self._expected[path]
+            if path not in self._found:
+                return "Expected response to have json at '{0}', " \
+                       "but it was not found".format(format_path(path))
+            if self._found[path] != expected:
+                return "Expected response to have json at '{0}':\n\t{1}\n" \
+                       "but got:\n\t{2}".format(
+                           format_path(path),
+                           *excerpt_difference(expected, self._found[path])
+                           )
+
+    def message_for_failed_should_not(self):
+        return "Did not expect response to contain json:\n\t{0}".format(
+            '\n\t'.join(
+                '{0}: {1}'.format(
+                    format_path(path), excerpt(self._expected[path])
+                    )
+                for path in sorted(self._expected)
                 )
+            )
+
+
+@matcher
+class JsonAtMatcher(JsonSubsetMatcher):
+    ''' A matcher to check the json value at a path in a response '''
+    name = 'have_json_at'
+
+    @isolated
+    def __call__(self, path, value):
+        return self._set_expected({parse_path(path): value})
+
+
+@matcher
+class JsonIncludingMatcher(JsonSubsetMatcher):
+    ''' A matcher to check some of the top level keys of a json response '''
+    name = 'have_json_including'
+
+    @isolated
+    def __call__(self, *pargs, **kwargs):
+        if len(pargs) > 1:
+            raise Exception(
+                'have_json_including only accepts one positional argument'
+                )
+        if pargs and kwargs:
+            raise Exception(
+                "have_json_including can't accept positional arguments "
+                "& keyword arguments"
+                )
+        expected = pargs[0] if pargs else kwargs
+        return self._set_expected(
+            dict(((key,), value) for key, value in expected.items())
+            )
+
+
+# Compiled schemas, keyed by the id of the schema.  Each entry keeps the
+# schema it was compiled from, so the id can't be reused while it's cached.
+_schema_validators = LRUCache(128)
+
+
+def compile_schema(schema):
+    '''
+    Gets the Validator for a json schema, from the cache if an equal schema
+    has been compiled before.  Schemas are keyed on their canonical json, so
+    schemas written inline in each test share a Validator too.
+    '''
+    from .schema import SchemaError, Validator
+    try:
+        key = json.dumps(schema, sort_keys=True)
+    except (TypeError, ValueError):
+        raise SchemaError('Invalid schema {0!r}'.format(schema))
+    return _schema_validators.get_or_create(
+        key, lambda key: Validator(schema)
+        )
+
+
+@matcher
+class JsonSchemaMatcher(object):
+    ''' A matcher to check a json response against a json schema '''
+    name = 'have_json_schema'
+
+    @isolated
+    def __call__(self, schema):
+        self._validator = compile_schema(schema)
+        return self
+
+    def match(self, response):
+        self._errors = self._validator.errors(view_for(response).json)
+        return not self._errors
+
+    def message_for_failed_should(self):
+        violations = [
+            '{0}: {1}'.format(format_path(path) or '<root>', message)
+            for path, message in self._errors
+            ]
+        return 'Expected response json to match the schema, but found {0} ' \
+               'violation{1}:\n\t{2}'.format(
+                   len(violations), '' if len(violations) == 1 else 's',
+                   '\n\t'.join(violations)
+                   )
+
+    def message_for_failed_should_not(self):
+        return 'Did not expect response json to match the schema'
+
+
+class ContentTypeSpec(namedtuple('ContentTypeSpec',
+                                 ['expected', 'parts', 'either', 'params'])):
+    '''
+    A compiled content type expectation.
+
+    Specs are immutable, and are cached by compile_content_type, so each
+    expected content type is only parsed once.
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def parse(cls, expected):
+        '''
+        Compiles an expected content type into a spec
+        :param expected:    The expected content type, e.g. 'text/*' or
+                            'text/html; charset=utf-8'
+        '''
+        mimetype, params = parse_content_type(expected)
+        parts = tuple(mimetype.split('/'))
+        if parts in (('*',), ('*', '*')):
+            parts = ()
+        # If there's no / we want to match either half of the
+        # content-type
+        either = mimetype.find('/') == -1
+        return cls(expected, parts, either, tuple(sorted(params.items())))
+
+    @property
+    def has_params(self):
+        return bool(self.params)
+
+    def matches(self, parts, params):
+        '''
+        Checks a content type against the spec
+
+        :param parts:   The (type, subtype) of the mimetype to check
+        :param params:  A dict of the content type parameters, with lowercased
+                        keys.  Any parameters in the spec should be in here,
+                        but this can also contain parameters not in the spec.
+        '''
+        if self.either:
+            if self.parts and self.parts[0] not in parts:
+                return False
+        elif len(parts) != len(self.parts):
+            return False
+        else:
+            for actual, expected in zip(parts, self.parts):
+                if actual != expected and expected != '*':
+                    return False
+        for key, expected in self.params:
+            actual = params.get(key)
+            if key == 'charset' and actual is not None:
+                actual, expected = actual.lower(), expected.lower()
+            if actual != expected:
+                return False
+        return True
+
+
+_content_type_specs = LRUCache(256)
+
+
+def compile_content_type(expected):
+    '''
+    Gets the ContentTypeSpec for an expected content type, from the cache if
+    it's been compiled before.
+    '''
+    return _content_type_specs.get_or_create(expected, ContentTypeSpec.parse)
 
 
 @matcher
@@ -146,45 +563,48 @@ class ContentTypeMatcher(object):
     ''' A matcher to check the content type '''
     name = 'have_content_type'
 
+    @isolated
     def __call__(self, content_type):
-        # If there's a ; in the expected type we want to check
-        # the whole thing.
-        self._mimetype = content_type.find(';') == -1
-        # If there's no / we want to match either half of the
-        # content-type
-        self._match_either = content_type.find('/') == -1
-        # Check if we have any wildcards
-        self._wildcard = any(
-            True for sec in content_type.split('/') if sec == '*'
-            )
-        self._expected = content_type
+        # A list or tuple means any one of the content types is acceptable
+        if isinstance(content_type, (list, tuple)):
+            self._expected = list(content_type)
+        else:
+            self._expected = [content_type]
+        self._specs = [
+            compile_content_type(expected) for expected in self._expected
+            ]
         return self
 
     def match(self, response):
-        if self._expected == '*':
+        if any(not spec.parts and not spec.params for spec in self._specs):
             return True
-        if self._mimetype:
-            self._actual = response.mimetype
-            sections = self._actual.split('/')
-            if self._match_either:
-                return any(True for sec in sections if sec == self._expected)
-            if self._wildcard:
-                expectedsections = self._expected.split('/')
-                for actual, expected in zip(sections, expectedsections):
-                    if actual != expected and expected != '*':
-                        return False
-                return True
-        else:
-            self._actual = response.content_type
-        return self._actual == self._expected
+        view = view_for(response)
+        parts, params = view.mimetype_parts, view.mimetype_params
+        self._show_params = any(spec.has_params for spec in self._specs)
+        self._view = view_ref(response)
+        return any(spec.matches(parts, params) for spec in self._specs)
+
+    @property
+    def _actual(self):
+        view = self._view()
+        if view is None:
+            return '<unavailable>'
+        if self._show_params:
+            return view.content_type
+        return view.mimetype
+
+    def _format_expected(self):
+        return "' or '".join(self._expected)
 
     def message_for_failed_should(self):
         return "Expected content type '{0}', got '{1}'".format(
-            self._expected, self._actual
+            self._format_expected(), self._actual
             )
 
     def message_for_failed_should_not(self):
-        return "Expected content type to not be '{0}'".format(self._expected)
+        return "Expected content type to not be '{0}'".format(
+            self._format_expected()
+            )
 
 
 @matcher
@@ -192,6 +612,7 @@ class HeaderMatcher(object):
     ''' A matcher to check the headers returned '''
     name = 'have_header'
 
+    @isolated
     def __call__(self, *pargs):
         if len(pargs) == 1:
             # One argument - this is either just the header name,
@@ -211,15 +632,13 @@ class HeaderMatcher(object):
         return self
 
     def match(self, response):
-        self._value_found = None
-        for name, value in response.header_list:
-            if name == self._expected_name:
-                self._value_found = value
-                if not self._check_value:
-                    return True
-                elif value == self._expected_value:
-                    return True
-        return False
+        values = view_for(response).headers.get(
+            self._expected_name.lower(), []
+            )
+        self._value_found = values[-1] if values else None
+        if not self._check_value:
+            return bool(values)
+        return self._expected_value in values
 
     def message_for_failed_should(self):
         if self._value_found:
@@ -241,23 +660,135 @@ class HeaderMatcher(object):
             )
 
 
+def header_matches(values, expected):
+    '''
+    Checks the values of a header against an expectation.
+
+    :param values:      A list of the values of the header in a response
+    :param expected:    The expectation.  This can be True to check the header
+                        is present, False or None to check it's absent, a
+                        compiled regex that one of the values should match, a
+                        list of expectations that should all match, or a value
+                        that the header should have.
+    :returns:           True if the header matches
+    '''
+    if expected is True:
+        return bool(values)
+    elif expected is False or expected is None:
+        return not values
+    elif hasattr(expected, 'search'):
+        return any(expected.search(value) for value in values)
+    elif isinstance(expected, (list, tuple)):
+        return all(header_matches(values, item) for item in expected)
+    return expected in values
+
+
+def describe_header(expected):
+    ''' Describes a header expectation for a failure message '''
+    if expected is True:
+        return 'present'
+    elif expected is False or expected is None:
+        return 'absent'
+    elif hasattr(expected, 'search'):
+        return 'matching /{0}/'.format(expected.pattern)
+    elif isinstance(expected, (list, tuple)):
+        return ' and '.join(describe_header(item) for item in expected)
+    return repr(expected)
+
+
+@matcher
+class HeadersMatcher(object):
+    '''
+    A matcher to check many headers in one go.  Header names are compared
+    case-insensitively, and every mismatch is reported together.
+    '''
+    name = 'have_headers'
+
+    @isolated
+    def __call__(self, expected):
+        self._expected = dict(expected)
+        return self
+
+    def match(self, response):
+        headers = view_for(response).headers
+        self._mismatches = []
+        for name, expected in sorted(self._expected.items()):
+            values = headers.get(name.lower(), [])
+            if not header_matches(values, expected):
+                self._mismatches.append((name, expected, values))
+        return not self._mismatches
+
+    def message_for_failed_should(self):
+        lines = []
+        for name, expected, values in self._mismatches:
+            if values:
+                found = ', '.join(repr(value) for value in values)
+            else:
+                found = 'not found'
+            lines.append("'{0}' should be {1}, but was {2}".format(
+                name, describe_header(expected), found
+                ))
+        return "Expected headers did not match:\n\t{0}".format(
+            '\n\t'.join(lines)
+            )
+
+    def message_for_failed_should_not(self):
+        return "Did not expect headers to match:\n\t{0}".format(
+            '\n\t'.join(
+                "'{0}' {1}".format(name, describe_header(expected))
+                for name, expected in sorted(self._expected.items())
+                )
+            )
+
+
 @matcher
 class ContentMatcher(object):
     ''' A matcher to check if a response has some content '''
     name = 'have_content'
 
+    @isolated
     def __call__(self, content, find=False):
         self._expected = content
         self._find = find
         return self
 
     def match(self, response):
-        self._actual = response.data
+        self._view = view_ref(response)
         if self._find:
-            return self._actual.find(self._expected) != -1
+            # Search the body a chunk at a time, so large & streamed
+            # responses never have to be held in memory all at once.
+            view = self._view()
+            needle = self._expected
+            if not isinstance(needle, bytes):
+                needle = needle.encode(view.charset)
+            return stream_find(view.iter_chunks(), needle)
         else:
             return self._actual == self._expected
 
+    @property
+    def _actual(self):
+        '''
+        The body of the response, as bytes or text to match whatever we're
+        expecting
+        '''
+        view = self._view()
+        if view is None:
+            return '<unavailable>'
+        if isinstance(self._expected, bytes):
+            return view.data
+        return view.text
+
+    def _excerpts(self):
+        '''
+        Gets excerpts of the expected & actual content for a failure message,
+        centred on where they differ (or where the content was found)
+        '''
+        actual = self._actual
+        if not self._find:
+            return excerpt_difference(self._expected, actual)
+        around = max(actual.find(self._expected), 0)
+        return excerpt(self._expected), excerpt(actual, around)
+
     def message_for_failed_should(self):
         # TODO: An optional diff might be nice if we've got longer
         #       data.
@@ -271,7 +802,7 @@ class ContentMatcher(object):
                 message = "Expected content:\n{0}\n\nBut got:\n{1}"
             else:
                 message = "Expected content '{0}' but got '{1}'"
-        return message.format(self._expected, self._actual)
+        return message.format(*self._excerpts())
 
     def message_for_failed_should_not(self):
         if self._find:
@@ -280,13 +811,13 @@ class ContentMatcher(object):
                           "Contained within:\n{1}"
             else:
                 message = "Did not expect to find '{0}' in '{1}'"
-            return message.format(self._expected, self._actual)
+            return message.format(*self._excerpts())
         else:
             if self._multiline:
                 message = "Expected content not to be:\n{0}"
             else:
                 message = "Expected content not to be '{0}'"
-            return message.format(self._expected)
+            return message.format(excerpt(self._expected))
 
     @property
     def _multiline(self):
@@ -295,6 +826,608 @@ class ContentMatcher(object):
         more than one line
         '''
         for string in [self._expected, self._actual]:
-            if len(string) > 80 or string.find('\n') != -1:
+            if len(string) > 80 or to_text(string).find('\n') != -1:
                 return True
         return False
+
+
+# The number of characters kept between chunks when searching a streamed body
+# for a pattern.  Matches longer than this that cross a chunk boundary may be
+# missed.
+SEARCH_OVERLAP = 1024
+
+# Compiled patterns, keyed by the pattern, its type & its flags
+_patterns = LRUCache(256)
+
+
+def compile_pattern(pattern, flags=0):
+    '''
+    Gets the compiled regular expression for a pattern, from the cache if
+    it's been compiled before.  Already compiled patterns are returned as is.
+    '''
+    if hasattr(pattern, 'search'):
+        return pattern
+    return _patterns.get_or_create(
+        (type(pattern), pattern, flags), lambda key: re.compile(*key[1:])
+        )
+
+
+@matcher
+class ContentPatternMatcher(object):
+    '''
+    A matcher to check if a response has content matching a regular
+    expression.
+
+    Text patterns are searched for in the decoded body, and bytes patterns in
+    the raw body.
+    '''
+    name = 'have_content_matching'
+
+    @isolated
+    def __call__(self, pattern, flags=0, stream=False,
+                 overlap=SEARCH_OVERLAP):
+        self._regex = compile_pattern(pattern, flags)
+        self._stream = stream
+        self._overlap = overlap
+        return self
+
+    def match(self, response):
+        self._view = view_ref(response)
+        view = self._view()
+        text = not isinstance(self._regex.pattern, bytes)
+        if self._stream:
+            # Search the body a chunk at a time, so only as much of it is
+            # read as is needed to find a match
+            chunks = view.iter_chunks()
+            if text:
+                chunks = decode_chunks(chunks, view.charset)
+            self._match, self._offset = stream_search(
+                chunks, self._regex, self._overlap
+                )
+        else:
+            self._match = self._regex.search(view.text if text else view.data)
+            self._offset = 0
+        return self._match is not None
+
+    def _pattern(self):
+        return to_text(self._regex.pattern)
+
+    def _content(self):
+        view = self._view()
+        if view is None:
+            return '<unavailable>'
+        if isinstance(self._regex.pattern, bytes):
+            return view.data
+        return view.text
+
+    def _groups(self):
+        ''' Describes the capture groups of the match '''
+        names = dict(
+            (index, name) for name, index in self._regex.groupindex.items()
+            )
+        return [
+            '{0}: {1}'.format(
+                names.get(index, index),
+                excerpt(repr(self._match.group(index)))
+                )
+            for index in range(1, self._regex.groups + 1)
+            ]
+
+    def message_for_failed_should(self):
+        return "Expected to find a match for '{0}' in '{1}'".format(
+            self._pattern(), excerpt(self._content())
+            )
+
+    def message_for_failed_should_not(self):
+        message = "Did not expect to find a match for '{0}', but found " \
+                  "'{1}' at {2}".format(
+                      self._pattern(), excerpt(self._match.group(0)),
+                      self._offset + self._match.start()
+                      )
+        groups = self._groups()
+        if groups:
+            message += ' with groups:\n\t' + '\n\t'.join(groups)
+        return message
+
+
+class ManyContentMatcher(object):
+    '''
+    Base class for matchers that search a response for several pieces of
+    content in a single pass over the body
+    '''
+    _stop_at_first = False
+
+    @isolated
+    def __call__(self, contents):
+        self._expected = list(contents)
+        return self
+
+    def match(self, response):
+        view = view_for(response)
+        needles = {}
+        for content in self._expected:
+            needle = content
+            if not isinstance(needle, bytes):
+                needle = needle.encode(view.charset)
+            needles.setdefault(needle, []).append(content)
+        found = stream_find_all(
+            view.iter_chunks(), needles, stop_at_first=self._stop_at_first
+            )
+        self._found = [
+            content for key in found for content in needles[key]
+            ]
+        self._missing = [
+            content for content in self._expected
+            if content not in self._found
+            ]
+        return self._matched()
+
+    def _format(self, contents):
+        return '\n\t'.join(excerpt(repr(content)) for content in contents)
+
+
+@matcher
+class AllContentMatcher(ManyContentMatcher):
+    ''' A matcher to check if a response contains all of some content '''
+    name = 'have_all_content'
+
+    def _matched(self):
+        return not self._missing
+
+    def message_for_failed_should(self):
+        return "Expected to find all of the content, but these were " \
+               "missing:\n\t{0}".format(self._format(self._missing))
+
+    def message_for_failed_should_not(self):
+        return "Did not expect to find all of:\n\t{0}".format(
+            self._format(self._expected)
+            )
+
+
+@matcher
+class AnyContentMatcher(ManyContentMatcher):
+    ''' A matcher to check if a response contains any of some content '''
+    name = 'have_any_content'
+    _stop_at_first = True
+
+    def _matched(self):
+        return bool(self._found)
+
+    def message_for_failed_should(self):
+        return "Expected to find at least one of:\n\t{0}".format(
+            self._format(self._expected)
+            )
+
+    def message_for_failed_should_not(self):
+        return "Did not expect to find any of the content, but found:" \
+               "\n\t{0}".format(self._format(self._found))
+
+
+@matcher
+class AllMatcher(object):
+    '''
+    A matcher that checks a response against several other matchers, and
+    reports every one that failed rather than stopping at the first.
+
+    The matchers all share the response's cached views, so the body is only
+    read & decoded once between them.
+    '''
+    name = 'satisfy_all'
+
+    @isolated
+    def __call__(self, *matchers):
+        if not matchers:
+            raise Exception('satisfy_all needs at least one matcher')
+        self._matchers = matchers
+        return self
+
+    def match(self, response):
+        self._failures = []
+        for item in self._matchers:
+            try:
+                if item.match(response):
+                    continue
+                failure = item.message_for_failed_should()
+            except Exception as e:
+                failure = 'Raised {0}: {1}'.format(type(e).__name__, e)
+            self._failures.append(failure)
+        return not self._failures
+
+    def message_for_failed_should(self):
+        failures = [
+            '{0}) {1}'.format(number, failure.replace('\n', '\n   '))
+            for number, failure in enumerate(self._failures, 1)
+            ]
+        return '{0} of {1} expectations failed:\n{2}'.format(
+            len(self._failures), len(self._matchers), '\n'.join(failures)
+            )
+
+    def message_for_failed_should_not(self):
+        return 'Expected at least one of the {0} expectations to fail'.format(
+            len(self._matchers)
+            )
+
+
+class LatencyMatcher(object):
+    '''
+    Base class for matchers that time a request.
+
+    These match against a callable that makes the request, rather than a
+    response, e.g. ``(lambda: client.get('/')) |should| respond_within(50)``.
+    With ``profile=True``, a request that's too slow is made once more under
+    cProfile and the profile is saved, so there's something to look at.
+    That's off by default, as the request may not be safe to repeat.
+    '''
+
+    def _set_limit(self, milliseconds, profile, profile_dir):
+        self._limit = milliseconds
+        self._profile_enabled = profile
+        self._profile_dir = profile_dir
+        self._profile = None
+
+    def _time(self, request, runs):
+        if not callable(request):
+            raise TypeError(
+                '{0} needs a callable that makes the request'.format(self.name)
+                )
+        from .profiling import time_call
+        return [time_call(request) for _ in range(runs)]
+
+    def _check(self, request, elapsed):
+        matched = elapsed * 1000 <= self._limit
+        if not matched and self._profile_enabled and \
+                not getattr(self, 'run_with_negate', False):
+            from .profiling import capture_profile
+            self._profile = capture_profile(
+                request, self.name, self._profile_dir
+                )
+        return matched
+
+    def _profile_message(self):
+        if self._profile is None:
+            return ''
+        return '\nProfile of a slow request saved to {0}:\n{1}'.format(
+            *self._profile
+            )
+
+
+@matcher
+class RespondWithinMatcher(LatencyMatcher):
+    ''' A matcher to check a request responds within a time limit '''
+    name = 'respond_within'
+
+    @isolated
+    def __call__(self, milliseconds, profile=False, profile_dir=None):
+        self._set_limit(milliseconds, profile, profile_dir)
+        return self
+
+    def match(self, request):
+        self._elapsed = self._time(request, 1)[0]
+        return self._check(request, self._elapsed)
+
+    def message_for_failed_should(self):
+        return 'Expected a response within {0}ms, but it took ' \
+               '{1:.1f}ms{2}'.format(
+                   self._limit, self._elapsed * 1000, self._profile_message()
+                   )
+
+    def message_for_failed_should_not(self):
+        return 'Did not expect a response within {0}ms, but it took ' \
+               '{1:.1f}ms'.format(self._limit, self._elapsed * 1000)
+
+
+@matcher
+class PercentileLatencyMatcher(LatencyMatcher):
+    '''
+    A matcher to check the 95th percentile latency of a request, over a
+    number of runs
+    '''
+    name = 'have_p95_latency_below'
+    _percent = 95
+
+    @isolated
+    def __call__(self, milliseconds, runs=20, profile=False,
+                 profile_dir=None):
+        if runs < 1:
+            raise Exception('{0} needs at least one run'.format(self.name))
+        self._set_limit(milliseconds, profile, profile_dir)
+        self._runs = runs
+        return self
+
+    def match(self, request):
+        from .profiling import percentile
+        self._times = self._time(request, self._runs)
+        self._actual = percentile(self._times, self._percent)
+        return self._check(request, self._actual)
+
+    def _describe(self):
+        from .profiling import describe_times
+        return 'p{0} latency over {1} runs to be below {2}ms, but it was ' \
+               '{3:.1f}ms ({4})'.format(
+                   self._percent, self._runs, self._limit,
+                   self._actual * 1000, describe_times(self._times)
+                   )
+
+    def message_for_failed_should(self):
+        return 'Expected the ' + self._describe() + self._profile_message()
+
+    def message_for_failed_should_not(self):
+        return 'Did not expect the ' + self._describe()
+
+
+class MemoryMatcher(object):
+    '''
+    Base class for matchers that check how much memory a request uses.
+
+    Like the latency matchers, these match against a callable that makes the
+    request.  The request is run under tracemalloc, so they need python 3.4
+    or later.
+    '''
+
+    @isolated
+    def __call__(self, size):
+        self._limit = size
+        return self
+
+    def match(self, request):
+        if not callable(request):
+            raise TypeError(
+                '{0} needs a callable that makes the request'.format(self.name)
+                )
+        from .profiling import trace_allocations
+        allocated, peak, self._sites = trace_allocations(request)
+        self._actual = self._measure(allocated, peak)
+        return self._actual < self._limit
+
+    def _describe(self):
+        from .profiling import describe_size
+        return '{0} less than {1}, but it was {2}'.format(
+            self._measured, describe_size(self._limit),
+            describe_size(self._actual)
+            )
+
+    def message_for_failed_should(self):
+        message = 'Expected the {0}'.format(self._describe())
+        if self._sites:
+            message += '\nTop allocation sites:\n\t' + '\n\t'.join(
+                self._sites
+                )
+        return message
+
+    def message_for_failed_should_not(self):
+        return 'Did not expect the {0}'.format(self._describe())
+
+
+@matcher
+class AllocationMatcher(MemoryMatcher):
+    '''
+    A matcher to check the memory a request leaves allocated, including the
+    response it returns
+    '''
+    name = 'allocate_less_than'
+    _measured = 'memory allocated by the request to be'
+
+    def _measure(self, allocated, peak):
+        return allocated
+
+
+@matcher
+class PeakMemoryMatcher(MemoryMatcher):
+    ''' A matcher to check the peak memory used during a request '''
+    name = 'have_peak_memory_below'
+    _measured = 'peak memory used by the request to be'
+
+    def _measure(self, allocated, peak):
+        return peak
+
+
+@matcher
+class SnapshotMatcher(object):
+    '''
+    A matcher to check a response against a stored snapshot of its body and
+    some of its headers.
+
+    The body's hash is checked first, so the stored body is only read when
+    the response doesn't match it.
+    '''
+    name = 'match_snapshot'
+
+    @isolated
+    def __call__(self, name, headers=('Content-Type',), directory=None,
+                 update=None):
+        from .snapshots import Snapshot, update_mode
+        self._snapshot = Snapshot(directory, name)
+        self._headers = [header.lower() for header in headers]
+        self._update = update_mode() if update is None else update
+        return self
+
+    def match(self, response):
+        view = view_for(response)
+        self._view = view_ref(response)
+        headers = dict(
+            (header, view.headers.get(header, [])) for header in self._headers
+            )
+        snapshot = self._snapshot
+        if self._update:
+            snapshot.write(view.iter_chunks(), headers)
+            return True
+        if not snapshot.exists:
+            self._missing = True
+            return False
+        self._missing = False
+        self._header_differences = [
+            (header, snapshot.meta['headers'].get(header, []), headers[header])
+            for header in self._headers
+            if headers[header] != snapshot.meta['headers'].get(header, [])
+            ]
+        from .snapshots import digest_chunks
+        self._digest, self._size = digest_chunks(view.iter_chunks())
+        return self._digest == snapshot.meta['sha1'] and \
+            not self._header_differences
+
+    def _describe_body(self):
+        from .snapshots import excerpt_body, read_window
+        view = self._view()
+        if view is None:
+            return '\tThe body differs'
+        snapshot = self._snapshot
+        offset = snapshot.find_difference(view.iter_chunks())
+        expected = excerpt_body(snapshot.read, offset, snapshot.meta['size'])
+        actual = excerpt_body(
+            lambda start, length: read_window(
+                view.iter_chunks(), start, length
+                ),
+            offset, self._size
+            )
+        return '\tThe body differs at byte {0}, expected:\n\t\t{1}\n' \
+               '\tbut got:\n\t\t{2}'.format(offset, expected, actual)
+
+    def message_for_failed_should(self):
+        from .snapshots import UPDATE_VARIABLE
+        snapshot = self._snapshot
+        if self._missing:
+            return "Snapshot '{0}' does not exist.  Set {1}=1 to create " \
+                   "it".format(snapshot.name, UPDATE_VARIABLE)
+        lines = ["Response did not match snapshot '{0}':".format(
+            snapshot.name
+            )]
+        if self._digest != snapshot.meta['sha1']:
+            lines.append(self._describe_body())
+        for header, expected, actual in self._header_differences:
+            lines.append(
+                "\tHeader '{0}' should be {1}, but was {2}".format(
+                    header, self._format_values(expected),
+                    self._format_values(actual)
+                    )
+                )
+        lines.append('Set {0}=1 to update the snapshot'.format(
+            UPDATE_VARIABLE
+            ))
+        return '\n'.join(lines)
+
+    def _format_values(self, values):
+        if not values:
+            return 'missing'
+        return ', '.join("'{0}'".format(value) for value in values)
+
+    def message_for_failed_should_not(self):
+        return "Did not expect response to match snapshot '{0}'".format(
+            self._snapshot.name
+            )
+
+
+@matcher
+class StreamEventsMatcher(object):
+    '''
+    A matcher to check the first events a response streams, as server-sent
+    events or newline delimited json.
+
+    Events are parsed as the body's chunks are pulled from the app, so only
+    as much of the stream as is needed gets read, and streams that never end
+    can be checked this way too.  With ``close=True`` the response is then
+    closed, after which other matchers can't read its body.
+    '''
+    name = 'stream_events'
+
+    @isolated
+    def __call__(self, expected=None, count=None, where=None, format=None,
+                 close=False):
+        if expected is None and count is None and where is None:
+            raise Exception(
+                'stream_events needs expected events, a count or a predicate'
+                )
+        if expected is not None and count is not None:
+            raise Exception(
+                "stream_events can't accept expected events & a count"
+                )
+        from .events import PARSERS
+        if format is not None and format not in PARSERS:
+            raise ValueError('Unknown stream format {0!r}'.format(format))
+        self._expected = list(expected) if expected is not None else None
+        if count is None:
+            count = len(self._expected) if expected is not None else 1
+        self._count = count
+        self._where = where
+        self._format = format
+        self._close = close
+        return self
+
+    def match(self, response):
+        from .events import guess_format, parse_ndjson, parse_sse
+        view = view_for(response)
+        format = self._format or guess_format(view.mimetype)
+        if format is None:
+            raise ValueError(
+                "Can't tell how to parse a {0} stream, pass format='sse' "
+                "or format='ndjson'".format(view.mimetype)
+                )
+        if format == 'sse':
+            events = parse_sse(view.iter_chunks())
+        else:
+            events = parse_ndjson(view.iter_chunks(), view.charset)
+        self._events = []
+        try:
+            if self._count:
+                for event in events:
+                    if self._where is None or self._where(event):
+                        self._events.append(event)
+                        if len(self._events) >= self._count:
+                            break
+        finally:
+            events.close()
+            if self._close:
+                view.close()
+        if self._expected is None:
+            return len(self._events) >= self._count
+        return len(self._events) == len(self._expected) and all(
+            self._same(expected, actual)
+            for expected, actual in zip(self._expected, self._events)
+            )
+
+    def _same(self, expected, actual):
+        '''
+        Compares an expected event with one from the stream.  Server-sent
+        events can be expected by their data, or by their data's json.
+        '''
+        from .events import Event
+        if not isinstance(actual, Event) or isinstance(expected, Event):
+            return expected == actual
+        if isinstance(expected, (str, type(u''))):
+            return expected == actual.data
+        try:
+            return expected == actual.json()
+        except ValueError:
+            return False
+
+    def _describe(self):
+        return '{0} event{1}{2}'.format(
+            self._count, '' if self._count == 1 else 's',
+            ' matching the predicate' if self._where is not None else ''
+            )
+
+    def _format_events(self, events):
+        return excerpt('\n\t'.join(to_text(event) for event in events))
+
+    def message_for_failed_should(self):
+        if len(self._events) < self._count:
+            message = 'Expected the response to stream {0}, but it ended ' \
+                      'after {1}'.format(self._describe(), len(self._events))
+            if self._events:
+                message += ':\n\t' + self._format_events(self._events)
+            return message
+        for index, (expected, actual) in enumerate(
+                zip(self._expected, self._events)):
+            if not self._same(expected, actual):
+                return 'Expected event {0} of the stream to be:\n\t{1}\n' \
+                       'but got:\n\t{2}'.format(
+                           index, *excerpt_difference(expected, actual)
+                           )
+
+    def message_for_failed_should_not(self):
+        if self._expected is not None:
+            return 'Did not expect the stream to start with:\n\t{0}'.format(
+                self._format_events(self._expected)
+                )
+        return 'Expected the response to stream fewer than {0}'.format(
+            self._describe()
+            )
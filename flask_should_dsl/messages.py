@@ -0,0 +1,76 @@
+'''
+Helpers for building failure messages.
+
+Response bodies and json documents can be huge, so rather than putting whole
+values into failure messages, matchers use these helpers to include a bounded
+excerpt of them.
+'''
+
+# The maximum number of characters of any one value that's included in a
+# failure message.  Set this to None to always include values in full.
+MESSAGE_LIMIT = 1000
+
+
+def to_text(value):
+    '''
+    Converts a value to a string for display in a message.  Bytes are decoded
+    on python 3, and left alone on python 2 where they're already strings.
+    '''
+    if isinstance(value, bytes) and not isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, (str, type(u''))):
+        return value
+    return '{0}'.format(value)
+
+
+def first_difference(first, second):
+    '''
+    Finds the index of the first character that differs between two strings.
+
+    :returns:   The length of the common prefix of first & second
+    '''
+    low, high = 0, min(len(first), len(second))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if first[:middle] == second[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def excerpt(value, around=0, limit=None):
+    '''
+    Cuts a value down to a window of at most ``limit`` characters, for use in
+    a failure message.
+
+    :param value:   The value to cut down.  Non-strings are formatted first.
+    :param around:  The index of the character the window should be centred
+                    on (e.g. the first difference between two values)
+    :param limit:   The size of the window.  Defaults to MESSAGE_LIMIT
+    :returns:       The excerpt, with '...' marking anything cut off
+    '''
+    value = to_text(value)
+    if limit is None:
+        limit = MESSAGE_LIMIT
+    if limit is None or len(value) <= limit:
+        return value
+    start = max(0, min(around - limit // 2, len(value) - limit))
+    end = start + limit
+    text = value[start:end]
+    if start:
+        text = '...' + text
+    if end < len(value):
+        text += '...'
+    return text
+
+
+def excerpt_difference(expected, actual, limit=None):
+    '''
+    Cuts down two values to excerpts around the first place they differ.
+
+    :returns:   An (expected, actual) tuple of excerpts
+    '''
+    expected, actual = to_text(expected), to_text(actual)
+    around = first_difference(expected, actual)
+    return excerpt(expected, around, limit), excerpt(actual, around, limit)
@@ -0,0 +1,164 @@
+'''
+Helpers for the performance matchers: timing requests, summarising timings,
+capturing profiles of slow requests and tracing their memory allocations.
+'''
+import cProfile
+import math
+import os
+import pstats
+import tempfile
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+timer = getattr(time, 'perf_counter', time.time)
+
+# The directory profiles of slow requests are saved to.  None means the
+# system's temporary directory.
+PROFILE_DIR = None
+
+# The number of functions included in the summary of a profile
+PROFILE_LIMIT = 10
+
+PERCENTILES = (50, 90, 95, 99)
+
+# The number of allocation sites reported when a request uses too much memory
+ALLOCATION_LIMIT = 10
+
+
+def time_call(call):
+    '''
+    Times a call, closing any response it returns.
+
+    :returns:   The time taken in seconds
+    '''
+    start = timer()
+    result = call()
+    elapsed = timer() - start
+    if hasattr(result, 'close'):
+        result.close()
+    return elapsed
+
+
+def percentile(times, percent):
+    ''' Gets a percentile of a list of times, by the nearest rank method '''
+    times = sorted(times)
+    rank = int(math.ceil(percent / 100.0 * len(times)))
+    return times[max(0, rank - 1)]
+
+
+def describe_times(times):
+    '''
+    Describes the distribution of some times, for failure messages.
+
+    :param times:   A list of times in seconds
+    :returns:       A string such as 'min 1.0ms, p50 2.0ms, ... max 9.0ms'
+    '''
+    parts = ['min {0:.1f}ms'.format(min(times) * 1000)]
+    for percent in PERCENTILES:
+        parts.append('p{0} {1:.1f}ms'.format(
+            percent, percentile(times, percent) * 1000
+            ))
+    parts.append('max {0:.1f}ms'.format(max(times) * 1000))
+    return ', '.join(parts)
+
+
+def capture_profile(call, name, directory=None):
+    '''
+    Runs a call under cProfile and saves the profile.
+
+    :param call:        The call to profile
+    :param name:        A name to include in the profile's file name
+    :param directory:   The directory to save the profile in.  Defaults to
+                        PROFILE_DIR
+    :returns:           A (path, summary) tuple, where the summary lists the
+                        functions with the highest cumulative time
+    '''
+    profile = cProfile.Profile()
+    result = profile.runcall(call)
+    if hasattr(result, 'close'):
+        result.close()
+    handle, path = tempfile.mkstemp(
+        prefix='{0}-'.format(name), suffix='.prof',
+        dir=directory or PROFILE_DIR
+        )
+    os.close(handle)
+    profile.dump_stats(path)
+    stream = StringIO()
+    stats = pstats.Stats(profile, stream=stream)
+    stats.sort_stats('cumulative').print_stats(PROFILE_LIMIT)
+    return path, stream.getvalue().strip('\n')
+
+
+def describe_size(size):
+    ''' Formats a number of bytes, e.g. as '1.5MB' '''
+    if abs(size) < 1024:
+        return '{0}B'.format(size)
+    for unit in ('KB', 'MB', 'GB'):
+        size /= 1024.0
+        if abs(size) < 1024 or unit == 'GB':
+            return '{0:.1f}{1}'.format(size, unit)
+
+
+def trace_allocations(call, limit=None):
+    '''
+    Runs a call under tracemalloc.
+
+    Any response the call returns is kept alive until after the allocations
+    are measured, so its body is included in them.
+
+    :param call:    The call to trace
+    :param limit:   The number of allocation sites to return.  Defaults to
+                    ALLOCATION_LIMIT
+    :returns:       An (allocated, peak, sites) tuple, where allocated is the
+                    number of bytes still allocated when the call returned,
+                    peak is the most that were allocated at once during it,
+                    and sites describes the lines that allocated the most
+    '''
+    if tracemalloc is None:
+        raise RuntimeError('Tracing allocations needs python 3.4 or later')
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start()
+    elif hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    try:
+        # The snapshot is taken first, so the memory it uses is part of the
+        # baseline rather than the call's allocations
+        before = tracemalloc.take_snapshot()
+        baseline = tracemalloc.get_traced_memory()[0]
+        result = call()
+        current, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        if hasattr(result, 'close'):
+            result.close()
+        del result
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+    ignored = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        tracemalloc.Filter(False, '<unknown>'),
+        ]
+    differences = after.filter_traces(ignored).compare_to(
+        before.filter_traces(ignored), 'lineno'
+        )
+    differences = [stat for stat in differences if stat.size_diff > 0]
+    sites = [
+        '{0}:{1}: {2} in {3} blocks'.format(
+            stat.traceback[0].filename, stat.traceback[0].lineno,
+            describe_size(stat.size_diff), stat.count_diff
+            )
+        for stat in differences[:limit or ALLOCATION_LIMIT]
+        ]
+    return current - baseline, peak - baseline, sites
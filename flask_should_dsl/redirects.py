@@ -0,0 +1,113 @@
+'''
+Following chains of redirects through a test client, for the
+redirect_chain_to matcher.
+
+Hops are memoized for as long as the test client they were followed through
+is alive, so when many URLs redirect through the same intermediate pages and
+are checked with the same client, each of those pages is only requested once.
+When an app is given rather than a client, a client is made for each chain,
+so nothing is remembered between matches.
+'''
+import threading
+import weakref
+
+try:
+    from urlparse import urljoin, urlsplit
+except ImportError:
+    from urllib.parse import urljoin, urlsplit
+
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# The memoized hops of each test client
+_hops = weakref.WeakKeyDictionary()
+_hops_lock = threading.Lock()
+
+
+def absolute_url(location, base):
+    '''
+    Resolves a location (which may be relative) against a base url
+
+    :param location:    The location, e.g. '/target' or
+                        'http://localhost/target'
+    :param base:        The url the location is relative to
+    '''
+    return urljoin(base, location)
+
+
+class RedirectFollower(object):
+    '''
+    Follows redirects through a test client.
+
+    :param client:  A test client, or a flask app to make one for
+    :param scheme:  The scheme of the app, used for relative urls
+    :param host:    The host of the app.  Redirects to any other host end
+                    the chain, as they can't be followed through the client.
+    '''
+
+    def __init__(self, client, scheme='http', host='localhost'):
+        if hasattr(client, 'test_client'):
+            client = client.test_client()
+        self.client = client
+        self.base = '{0}://{1}/'.format(scheme, host)
+        self.host = host
+        with _hops_lock:
+            try:
+                self._hops = _hops.setdefault(client, {})
+            except TypeError:
+                self._hops = {}
+
+    def hop(self, url):
+        '''
+        Requests a url, returning where it redirects to.
+
+        :param url:     An absolute url on the app's host
+        :returns:       A (status, location) tuple, where location is the
+                        absolute url redirected to, or None if the response
+                        wasn't a redirect
+        '''
+        hop = self._hops.get(url)
+        if hop is None:
+            parts = urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            response = self.client.get(
+                path, base_url='{0}://{1}'.format(parts.scheme, parts.netloc)
+                )
+            location = None
+            if response.status_code in REDIRECT_STATUSES:
+                location = absolute_url(
+                    response.headers.get('Location', ''), url
+                    )
+            response.close()
+            hop = self._hops[url] = (response.status_code, location)
+        return hop
+
+    def follow(self, location, max_hops):
+        '''
+        Follows a chain of redirects.
+
+        :param location:    Where the first redirect went to
+        :param max_hops:    The most redirects to follow
+        :returns:           A (chain, problem) tuple, where chain is a list of
+                            (url, status) tuples for each url visited, and
+                            problem describes why the chain was cut short
+                            (or is None if it wasn't)
+        '''
+        url = absolute_url(location, self.base)
+        chain, seen = [], set()
+        while True:
+            if url in seen:
+                return chain + [(url, None)], 'redirect loop'
+            if urlsplit(url).netloc != self.host:
+                return chain + [(url, None)], None
+            seen.add(url)
+            status, next_url = self.hop(url)
+            chain.append((url, status))
+            if next_url is None:
+                return chain, None
+            # The redirect that started the chain counts as the first hop
+            if len(chain) + 1 > max_hops:
+                return chain + [(next_url, None)], \
+                    'more than {0} redirects'.format(max_hops)
+            url = next_url
@@ -0,0 +1,514 @@
+'''
+A small json schema validator, for the have_json_schema matcher.
+
+Schemas are compiled once into a tree of check functions, so validating a
+document doesn't have to interpret the schema again.  The validation keywords
+of drafts 4 to 7 are supported:
+
+* type, enum & const
+* properties, required, additionalProperties, patternProperties,
+  propertyNames, dependencies, minProperties & maxProperties
+* items, additionalItems, contains, minItems, maxItems & uniqueItems
+* minLength, maxLength & pattern
+* minimum, maximum, exclusiveMinimum, exclusiveMaximum & multipleOf
+* allOf, anyOf, oneOf, not and if, then & else
+* $ref, for references within the same schema
+
+The annotations in ANNOTATIONS (e.g. format, title or description) are
+ignored.  Any other keyword raises a SchemaError, rather than being skipped
+and letting documents that break it pass.
+'''
+import json
+import numbers
+import re
+
+_STRING_TYPES = (str, type(u''))
+
+# The keywords that don't affect validation.  then & else are compiled along
+# with if.
+ANNOTATIONS = frozenset([
+    '$schema', '$id', 'id', '$comment', 'title', 'description', 'default',
+    'examples', 'definitions', 'format', 'readOnly', 'writeOnly',
+    'contentMediaType', 'contentEncoding', 'then', 'else',
+    ])
+
+
+class SchemaError(ValueError):
+    ''' Raised when a schema can't be compiled '''
+
+
+def _is_integer(value):
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, numbers.Integral):
+        return True
+    return isinstance(value, float) and value.is_integer()
+
+
+def _is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool)
+
+
+_TYPES = {
+    'null': lambda value: value is None,
+    'boolean': lambda value: isinstance(value, bool),
+    'integer': _is_integer,
+    'number': _is_number,
+    'string': lambda value: isinstance(value, _STRING_TYPES),
+    'array': lambda value: isinstance(value, list),
+    'object': lambda value: isinstance(value, dict),
+    }
+
+
+def _type_name(value):
+    for name in ('null', 'boolean', 'integer', 'number', 'string', 'array'):
+        if _TYPES[name](value):
+            return name
+    return 'object'
+
+
+def _describe(value):
+    return json.dumps(value, sort_keys=True)
+
+
+def _equal(first, second):
+    ''' Compares json values, without treating True as equal to 1 '''
+    if isinstance(first, bool) or isinstance(second, bool):
+        return isinstance(first, bool) and isinstance(second, bool) and \
+            first == second
+    if isinstance(first, list) and isinstance(second, list):
+        return len(first) == len(second) and all(
+            _equal(a, b) for a, b in zip(first, second)
+            )
+    if isinstance(first, dict) and isinstance(second, dict):
+        return sorted(first) == sorted(second) and all(
+            _equal(first[key], second[key]) for key in first
+            )
+    return first == second
+
+
+class Validator(object):
+    '''
+    A compiled schema.
+
+    :param schema:  The schema, as parsed json
+    :raises SchemaError:    If the schema is invalid
+    '''
+
+    def __init__(self, schema):
+        self.schema = schema
+        self._refs = {}
+        self._check = self._compile(schema)
+
+    def errors(self, document):
+        '''
+        Validates a document against the schema
+
+        :returns:   A list of (path, message) tuples for every violation,
+                    where path is a tuple of keys & indexes
+        '''
+        errors = []
+        self._check(document, (), errors)
+        return errors
+
+    def _compile(self, schema):
+        if schema is True or schema == {}:
+            return lambda value, path, errors: None
+        if schema is False:
+            return lambda value, path, errors: errors.append(
+                (path, 'no value is allowed here')
+                )
+        if not isinstance(schema, dict):
+            raise SchemaError('Invalid schema {0!r}'.format(schema))
+        if '$ref' in schema:
+            # As of draft 7, $ref overrides any other keywords
+            return self._compile_ref(schema['$ref'])
+        checks = []
+        for keyword in sorted(schema):
+            if keyword in ANNOTATIONS:
+                continue
+            compile_keyword = getattr(self, '_keyword_' + keyword, None)
+            if compile_keyword is None:
+                raise SchemaError(
+                    'Unsupported keyword {0!r}'.format(keyword)
+                    )
+            checks.append(compile_keyword(schema[keyword], schema))
+        checks = [check for check in checks if check is not None]
+
+        def check(value, path, errors):
+            for item in checks:
+                item(value, path, errors)
+        return check
+
+    def _compile_ref(self, ref):
+        if not ref.startswith('#'):
+            raise SchemaError(
+                'Only references within the schema are supported, not '
+                '{0!r}'.format(ref)
+                )
+        if ref not in self._refs:
+            # A placeholder lets recursive schemas refer back to themselves
+            compiled = []
+            self._refs[ref] = compiled
+            target = self.schema
+            for part in ref[1:].split('/')[1:]:
+                part = part.replace('~1', '/').replace('~0', '~')
+                try:
+                    if isinstance(target, list):
+                        target = target[int(part)]
+                    else:
+                        target = target[part]
+                except (KeyError, IndexError, ValueError, TypeError):
+                    raise SchemaError('Unresolvable reference {0!r}'.format(
+                        ref
+                        ))
+            compiled.append(self._compile(target))
+        compiled = self._refs[ref]
+        return lambda value, path, errors: compiled[0](value, path, errors)
+
+    # Generic keywords
+
+    def _keyword_type(self, expected, schema):
+        types = [expected] if isinstance(expected, _STRING_TYPES) else expected
+        for name in types:
+            if name not in _TYPES:
+                raise SchemaError('Unknown type {0!r}'.format(name))
+        tests = [_TYPES[name] for name in types]
+        description = ' or '.join(types)
+
+        def check(value, path, errors):
+            if not any(test(value) for test in tests):
+                errors.append((path, 'expected {0}, got {1}'.format(
+                    description, _type_name(value)
+                    )))
+        return check
+
+    def _keyword_enum(self, options, schema):
+        def check(value, path, errors):
+            if not any(_equal(value, option) for option in options):
+                errors.append((path, '{0} is not one of {1}'.format(
+                    _describe(value), _describe(options)
+                    )))
+        return check
+
+    def _keyword_const(self, expected, schema):
+        def check(value, path, errors):
+            if not _equal(value, expected):
+                errors.append((path, 'expected {0}, got {1}'.format(
+                    _describe(expected), _describe(value)
+                    )))
+        return check
+
+    # Objects
+
+    def _keyword_properties(self, properties, schema):
+        compiled = [
+            (name, self._compile(subschema))
+            for name, subschema in sorted(properties.items())
+            ]
+
+        def check(value, path, errors):
+            if isinstance(value, dict):
+                for name, item in compiled:
+                    if name in value:
+                        item(value[name], path + (name,), errors)
+        return check
+
+    def _keyword_patternProperties(self, patterns, schema):
+        compiled = [
+            (re.compile(pattern), self._compile(subschema))
+            for pattern, subschema in patterns.items()
+            ]
+
+        def check(value, path, errors):
+            if isinstance(value, dict):
+                for name in sorted(value):
+                    for pattern, item in compiled:
+                        if pattern.search(name):
+                            item(value[name], path + (name,), errors)
+        return check
+
+    def _keyword_additionalProperties(self, additional, schema):
+        known = set(schema.get('properties', {}))
+        patterns = [
+            re.compile(pattern) for pattern in schema.get(
+                'patternProperties', {}
+                )
+            ]
+        item = None if additional is False else self._compile(additional)
+
+        def check(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            for name in sorted(value):
+                if name in known or any(p.search(name) for p in patterns):
+                    continue
+                if item is None:
+                    errors.append((path, 'unexpected property {0}'.format(
+                        _describe(name)
+                        )))
+                else:
+                    item(value[name], path + (name,), errors)
+        return check
+
+    def _keyword_required(self, required, schema):
+        def check(value, path, errors):
+            if isinstance(value, dict):
+                for name in required:
+                    if name not in value:
+                        errors.append((path, 'missing property {0}'.format(
+                            _describe(name)
+                            )))
+        return check
+
+    def _keyword_propertyNames(self, subschema, schema):
+        item = self._compile(subschema)
+
+        def check(value, path, errors):
+            if isinstance(value, dict):
+                for name in sorted(value):
+                    if _errors(item, name):
+                        errors.append((path, 'property name {0} does not '
+                                             'match the propertyNames '
+                                             'schema'.format(_describe(name))))
+        return check
+
+    def _keyword_dependencies(self, dependencies, schema):
+        compiled = []
+        for name, dependency in sorted(dependencies.items()):
+            if isinstance(dependency, list):
+                compiled.append((name, dependency, None))
+            else:
+                compiled.append((name, None, self._compile(dependency)))
+
+        def check(value, path, errors):
+            if not isinstance(value, dict):
+                return
+            for name, required, item in compiled:
+                if name not in value:
+                    continue
+                if item is not None:
+                    item(value, path, errors)
+                    continue
+                for other in required:
+                    if other not in value:
+                        errors.append((path, 'missing property {0}, which '
+                                             '{1} depends on'.format(
+                                                 _describe(other),
+                                                 _describe(name)
+                                                 )))
+        return check
+
+    def _keyword_minProperties(self, limit, schema):
+        return self._size_check(dict, limit, 'properties', 'fewer', min)
+
+    def _keyword_maxProperties(self, limit, schema):
+        return self._size_check(dict, limit, 'properties', 'more', max)
+
+    # Arrays
+
+    def _keyword_items(self, items, schema):
+        if isinstance(items, list):
+            compiled = [self._compile(subschema) for subschema in items]
+
+            def check(value, path, errors):
+                if isinstance(value, list):
+                    for index, item in enumerate(compiled[:len(value)]):
+                        item(value[index], path + (str(index),), errors)
+            return check
+        item = self._compile(items)
+
+        def check(value, path, errors):
+            if isinstance(value, list):
+                for index, element in enumerate(value):
+                    item(element, path + (str(index),), errors)
+        return check
+
+    def _keyword_additionalItems(self, additional, schema):
+        items = schema.get('items')
+        if not isinstance(items, list):
+            return None
+        start = len(items)
+        item = None if additional is False else self._compile(additional)
+
+        def check(value, path, errors):
+            if not isinstance(value, list) or len(value) <= start:
+                return
+            if item is None:
+                errors.append((path, 'expected at most {0} items'.format(
+                    start
+                    )))
+                return
+            for index in range(start, len(value)):
+                item(value[index], path + (str(index),), errors)
+        return check
+
+    def _keyword_contains(self, contains, schema):
+        item = self._compile(contains)
+
+        def check(value, path, errors):
+            if isinstance(value, list) and not any(
+                    not _errors(item, element) for element in value):
+                errors.append((path, 'no item matches the contains schema'))
+        return check
+
+    def _keyword_minItems(self, limit, schema):
+        return self._size_check(list, limit, 'items', 'fewer', min)
+
+    def _keyword_maxItems(self, limit, schema):
+        return self._size_check(list, limit, 'items', 'more', max)
+
+    def _keyword_uniqueItems(self, unique, schema):
+        if not unique:
+            return None
+
+        def check(value, path, errors):
+            if not isinstance(value, list):
+                return
+            for index, element in enumerate(value):
+                if any(_equal(element, other) for other in value[:index]):
+                    errors.append((path, 'item {0} is not unique'.format(
+                        index
+                        )))
+                    return
+        return check
+
+    # Strings
+
+    def _keyword_minLength(self, limit, schema):
+        return self._size_check(_STRING_TYPES, limit, 'characters', 'fewer',
+                                min)
+
+    def _keyword_maxLength(self, limit, schema):
+        return self._size_check(_STRING_TYPES, limit, 'characters', 'more',
+                                max)
+
+    def _keyword_pattern(self, pattern, schema):
+        compiled = re.compile(pattern)
+
+        def check(value, path, errors):
+            if isinstance(value, _STRING_TYPES) and not compiled.search(value):
+                errors.append((path, '{0} does not match {1}'.format(
+                    _describe(value), _describe(pattern)
+                    )))
+        return check
+
+    def _size_check(self, types, limit, things, comparison, bound):
+        def check(value, path, errors):
+            if isinstance(value, types) and bound(len(value), limit) != limit:
+                errors.append((path, 'has {0} {1}, {2} than {3}'.format(
+                    len(value), things, comparison, limit
+                    )))
+        return check
+
+    # Numbers
+
+    def _keyword_minimum(self, limit, schema):
+        if schema.get('exclusiveMinimum') is True:
+            return self._keyword_exclusiveMinimum(limit, {})
+        return self._bound_check(
+            lambda value: value < limit, 'less than the minimum', limit
+            )
+
+    def _keyword_maximum(self, limit, schema):
+        if schema.get('exclusiveMaximum') is True:
+            return self._keyword_exclusiveMaximum(limit, {})
+        return self._bound_check(
+            lambda value: value > limit, 'more than the maximum', limit
+            )
+
+    def _keyword_exclusiveMinimum(self, limit, schema):
+        # In draft 4 this is a flag on minimum, and it's a number after that
+        if isinstance(limit, bool):
+            return None
+        return self._bound_check(
+            lambda value: value <= limit,
+            'not more than the exclusive minimum', limit
+            )
+
+    def _keyword_exclusiveMaximum(self, limit, schema):
+        if isinstance(limit, bool):
+            return None
+        return self._bound_check(
+            lambda value: value >= limit,
+            'not less than the exclusive maximum', limit
+            )
+
+    def _bound_check(self, fails, description, limit):
+        def check(value, path, errors):
+            if _is_number(value) and fails(value):
+                errors.append((path, '{0} is {1} of {2}'.format(
+                    _describe(value), description, limit
+                    )))
+        return check
+
+    def _keyword_multipleOf(self, factor, schema):
+        def check(value, path, errors):
+            if not _is_number(value):
+                return
+            quotient = value / float(factor)
+            if abs(quotient - round(quotient)) > 1e-9:
+                errors.append((path, '{0} is not a multiple of {1}'.format(
+                    _describe(value), factor
+                    )))
+        return check
+
+    # Combinations
+
+    def _keyword_allOf(self, subschemas, schema):
+        compiled = [self._compile(subschema) for subschema in subschemas]
+
+        def check(value, path, errors):
+            for item in compiled:
+                item(value, path, errors)
+        return check
+
+    def _keyword_anyOf(self, subschemas, schema):
+        compiled = [self._compile(subschema) for subschema in subschemas]
+
+        def check(value, path, errors):
+            if all(_errors(item, value) for item in compiled):
+                errors.append((path, 'does not match any of the anyOf '
+                                     'schemas'))
+        return check
+
+    def _keyword_oneOf(self, subschemas, schema):
+        compiled = [self._compile(subschema) for subschema in subschemas]
+
+        def check(value, path, errors):
+            matches = len([
+                item for item in compiled if not _errors(item, value)
+                ])
+            if matches != 1:
+                errors.append((path, 'matches {0} of the oneOf schemas, '
+                                     'rather than exactly one'.format(
+                                         matches
+                                         )))
+        return check
+
+    def _keyword_not(self, subschema, schema):
+        item = self._compile(subschema)
+
+        def check(value, path, errors):
+            if not _errors(item, value):
+                errors.append((path, 'should not match the not schema'))
+        return check
+
+    def _keyword_if(self, subschema, schema):
+        condition = self._compile(subschema)
+        then = self._compile(schema.get('then', True))
+        otherwise = self._compile(schema.get('else', True))
+
+        def check(value, path, errors):
+            if _errors(condition, value):
+                otherwise(value, path, errors)
+            else:
+                then(value, path, errors)
+        return check
+
+
+def _errors(check, value):
+    ''' Gets the errors of a compiled check against a value '''
+    errors = []
+    check(value, (), errors)
+    return errors
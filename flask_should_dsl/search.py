@@ -0,0 +1,132 @@
+'''
+Searching for content in a stream of chunks
+'''
+import codecs
+
+
+def stream_find(chunks, needle):
+    '''
+    Checks if a needle occurs anywhere in a stream of chunks, stopping at the
+    first occurrence.
+
+    Only the last ``len(needle) - 1`` bytes of the previous chunk are kept
+    around, to catch needles that cross a chunk boundary.
+
+    :param chunks:  An iterable of bytes
+    :param needle:  The bytes to search for
+    :returns:       True if the needle was found
+    '''
+    if not needle:
+        return True
+    overlap = len(needle) - 1
+    tail = b''
+    for chunk in chunks:
+        if needle in chunk:
+            return True
+        if tail and needle in tail + chunk[:overlap]:
+            return True
+        if overlap:
+            if len(chunk) >= overlap:
+                tail = chunk[-overlap:]
+            else:
+                tail = (tail + chunk)[-overlap:]
+    return False
+
+
+def stream_find_all(chunks, needles, stop_at_first=False):
+    '''
+    Finds which of a set of needles occur in a stream of chunks, in a single
+    pass over the stream.
+
+    Each chunk is checked for every needle that hasn't been found yet, and
+    found needles are dropped from the search, so the stream is only read
+    until every needle has been seen.
+
+    :param chunks:          An iterable of bytes
+    :param needles:         An iterable of bytes to search for
+    :param stop_at_first:   If True, stop as soon as any needle is found
+    :returns:               A set of the needles that were found
+    '''
+    remaining = set(needles)
+    found = set(needle for needle in remaining if not needle)
+    remaining -= found
+    if not remaining or (found and stop_at_first):
+        return found
+    overlap = max(len(needle) for needle in remaining) - 1
+    tail = b''
+    for chunk in chunks:
+        window = tail + chunk if tail else chunk
+        for needle in list(remaining):
+            if needle in window:
+                found.add(needle)
+                remaining.discard(needle)
+        if not remaining or (found and stop_at_first):
+            break
+        if overlap:
+            tail = window[-overlap:]
+    return found
+
+
+def decode_chunks(chunks, charset):
+    ''' Decodes a stream of chunks to text, a chunk at a time '''
+    decoder = codecs.getincrementaldecoder(charset)('replace')
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b'', True)
+    if text:
+        yield text
+
+
+def stream_search(chunks, regex, overlap):
+    '''
+    Searches a stream of chunks for a regular expression, stopping at the
+    first match.
+
+    Each chunk is searched along with the last ``overlap`` characters of the
+    chunks before it, so matches that cross a chunk boundary are found as
+    long as they're no longer than that.  A match that runs to the end of the
+    chunks read so far, or to just before a newline that ends them (where a
+    ``$`` would match), is held back until the next chunk arrives, in case it
+    would match more of it or not match at all.
+
+    The characters before where each search starts are kept as context &
+    passed to the regex as the string it's searching, rather than sliced off,
+    so anchors, word boundaries and lookbehinds only match where they would
+    in the whole body.
+
+    :param chunks:  An iterable of bytes or text, to match the pattern
+    :param regex:   A compiled regular expression
+    :param overlap: The number of characters kept between chunks
+    :returns:       A (match, offset) tuple, where offset is the position in
+                    the stream of the string the match was made against, or
+                    (None, None) if nothing matched
+    '''
+    # window holds the characters from offset in the stream onwards, and
+    # matches are searched for from pos in it
+    window, offset, pos = None, 0, 0
+    for chunk in chunks:
+        window = chunk if window is None else window + chunk
+        end = len(window)
+        if window[-1:] in ('\n', b'\n'):
+            end -= 1
+        match = regex.search(window, pos)
+        if match is None:
+            pos = max(pos, len(window) - overlap)
+        elif match.end() < end or \
+                len(window) - match.start() > overlap:
+            return match, offset
+        else:
+            pos = match.start()
+        # At least one character of context is kept, so the start of the
+        # window is never taken for the start of the body
+        keep = max(0, pos - max(overlap, 1))
+        window = window[keep:]
+        offset += keep
+        pos -= keep
+    if window is not None:
+        match = regex.search(window, pos)
+        if match is not None:
+            return match, offset
+    return None, None
@@ -0,0 +1,164 @@
+'''
+Storage & comparison of response snapshots, for the match_snapshot matcher.
+
+Each snapshot is a pair of files in the snapshot directory: ``<name>.body``
+holds the raw body, and ``<name>.json`` holds its hash & size along with any
+headers that were recorded.  Responses are compared against the hash first,
+and the body file is only read (through mmap) to find where a response
+differs from it.
+'''
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+
+from . import messages
+from .messages import first_difference, to_text
+
+# The directory snapshots are kept in, relative to the working directory
+SNAPSHOT_DIR = 'snapshots'
+
+# Setting this environment variable updates snapshots rather than checking
+# against them
+UPDATE_VARIABLE = 'FLASK_SHOULD_DSL_UPDATE_SNAPSHOTS'
+
+
+def update_mode():
+    ''' Checks if snapshots should be updated rather than checked '''
+    return os.environ.get(UPDATE_VARIABLE, '') not in ('', '0')
+
+
+class Snapshot(object):
+    '''
+    A stored snapshot.
+
+    :param directory:   The snapshot directory.  Defaults to SNAPSHOT_DIR
+    :param name:        The name of the snapshot, which may contain slashes
+                        to group snapshots into subdirectories
+    '''
+
+    def __init__(self, directory, name):
+        if os.path.isabs(name) or '..' in name.split('/'):
+            raise ValueError('Invalid snapshot name {0!r}'.format(name))
+        path = os.path.join(directory or SNAPSHOT_DIR, *name.split('/'))
+        self.name = name
+        self.body_path = path + '.body'
+        self.meta_path = path + '.json'
+        self._meta = None
+
+    @property
+    def exists(self):
+        return os.path.exists(self.meta_path)
+
+    @property
+    def meta(self):
+        ''' The stored digest, size & headers of the snapshot '''
+        if self._meta is None:
+            with open(self.meta_path) as meta:
+                self._meta = json.load(meta)
+        return self._meta
+
+    def write(self, chunks, headers):
+        '''
+        Writes the snapshot.  The body is written to a temporary file first,
+        so a snapshot is never left half written.
+
+        :param chunks:  An iterable of the body's bytes
+        :param headers: A dict mapping lowercased header names to lists of
+                        values
+        '''
+        directory = os.path.dirname(self.body_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        digest, size = hashlib.sha1(), 0
+        handle, temp_path = tempfile.mkstemp(dir=directory or '.')
+        with os.fdopen(handle, 'wb') as body:
+            for chunk in chunks:
+                body.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+        if os.path.exists(self.body_path):
+            os.remove(self.body_path)
+        os.rename(temp_path, self.body_path)
+        self._meta = {
+            'sha1': digest.hexdigest(), 'size': size, 'headers': headers
+            }
+        with open(self.meta_path, 'w') as meta:
+            json.dump(self._meta, meta, indent=2, sort_keys=True)
+
+    def find_difference(self, chunks):
+        '''
+        Finds the first byte where a body differs from the snapshot's.
+
+        :param chunks:  An iterable of the body's bytes
+        :returns:       The offset of the first difference, or None if the
+                        bodies are the same
+        '''
+        with open(self.body_path, 'rb') as body:
+            if not self.meta['size']:
+                stored = b''
+            else:
+                stored = mmap.mmap(body.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                offset = 0
+                for chunk in chunks:
+                    expected = stored[offset:offset + len(chunk)]
+                    if expected != chunk:
+                        return offset + first_difference(expected, chunk)
+                    offset += len(chunk)
+                return None if offset == len(stored) else offset
+            finally:
+                if isinstance(stored, mmap.mmap):
+                    stored.close()
+
+    def read(self, start, length):
+        ''' Reads part of the snapshot's body '''
+        with open(self.body_path, 'rb') as body:
+            body.seek(start)
+            return body.read(length)
+
+
+def digest_chunks(chunks):
+    '''
+    Hashes a body.
+
+    :returns:   A (sha1, size) tuple
+    '''
+    digest, size = hashlib.sha1(), 0
+    for chunk in chunks:
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def read_window(chunks, start, length):
+    ''' Reads length bytes from start of a body '''
+    window, offset, end = [], 0, start + length
+    for chunk in chunks:
+        if offset + len(chunk) > start:
+            window.append(chunk[max(0, start - offset):end - offset])
+        offset += len(chunk)
+        if offset >= end:
+            break
+    return b''.join(window)
+
+
+def excerpt_body(read, offset, size):
+    '''
+    Gets an excerpt of a body around an offset, for a failure message.
+
+    :param read:    A callable taking a start & length, that reads that part
+                    of the body
+    :param offset:  The offset the excerpt should be centred on
+    :param size:    The size of the body
+    '''
+    limit = messages.MESSAGE_LIMIT or size
+    start = max(0, min(offset - limit // 2, size - limit))
+    window = read(start, limit)
+    text = to_text(window)
+    if start:
+        text = '...' + text
+    if start + len(window) < size:
+        text += '...'
+    return text
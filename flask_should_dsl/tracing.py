@@ -0,0 +1,292 @@
+'''
+Recording a trace of every match, for offline analysis.
+
+A ``TraceRecorder`` is an instrumentation hook that writes a compact json
+record for each match a matcher makes: the matcher & its arguments, whether
+it passed, how long it took, and the response's request, status, headers and
+the number of bytes of its body the matchers read.  Records are buffered and
+appended to the trace file in batches, one per line, so tracing a long run
+doesn't keep anything much in memory.
+
+To trace a whole test run, set the ``FLASK_SHOULD_DSL_TRACE`` environment
+variable to the file to append records to::
+
+    FLASK_SHOULD_DSL_TRACE=trace.ndjson python -m pytest
+
+Trace files are read back with ``read_trace``, and ``aggregate`` & ``report``
+summarise them, e.g. to find the slowest or largest endpoints.
+'''
+import atexit
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+import weakref
+
+from . import instrumentation
+from .cache import view_for
+from .jsondiff import format_value
+
+TRACE_VARIABLE = 'FLASK_SHOULD_DSL_TRACE'
+
+# The number of records that are buffered before they're written
+BATCH_SIZE = 500
+
+# The most bytes of each body that are hashed.  Bodies bigger than this are
+# marked as truncated, and only their first HASH_LIMIT bytes are hashed.
+HASH_LIMIT = 10 * 1024 * 1024
+
+# The most characters of a matcher's arguments that are recorded
+ARGUMENTS_LIMIT = 200
+
+
+def describe_arguments(matcher):
+    '''
+    Describes the arguments a matcher was called with, e.g.
+    ``'"a.b", 1, find=true'``, or returns None if it wasn't called
+    '''
+    arguments = getattr(matcher, 'arguments', None)
+    if arguments is None:
+        return None
+    pargs, kwargs = arguments
+    parts = [format_value(value) for value in pargs]
+    parts.extend(
+        '{0}={1}'.format(name, format_value(kwargs[name]))
+        for name in sorted(kwargs)
+        )
+    text = ', '.join(parts)
+    if len(text) > ARGUMENTS_LIMIT:
+        text = text[:ARGUMENTS_LIMIT] + '...'
+    return text
+
+
+def describe_request(response):
+    '''
+    Describes the request a response was for, e.g. ``'GET /users'``, for
+    responses that keep their request (as newer werkzeug test responses and
+    direct client responses do)
+    '''
+    request = getattr(response, 'request', None)
+    if request is None:
+        return None
+    try:
+        return '{0} {1}'.format(request.method, request.path)
+    except AttributeError:
+        return None
+
+
+class TraceRecorder(object):
+    '''
+    A hook that records every match to a trace file.
+
+    :param path:        The file to append records to
+    :param batch_size:  The number of records buffered between writes
+    :param hash_bodies: If True, each body is hashed too, and its full size is
+                        recorded rather than the number of bytes the matchers
+                        read.  Hashing reads the whole body (up to HASH_LIMIT
+                        bytes), even for matchers that would only have read
+                        part of it, so it's off by default.
+    '''
+
+    def __init__(self, path, batch_size=BATCH_SIZE, hash_bodies=False):
+        self.path = path
+        self.batch_size = batch_size
+        self.hash_bodies = hash_bodies
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._digests = weakref.WeakKeyDictionary()
+
+    def __call__(self, event):
+        response = event.response
+        record = {
+            'time': round(time.time(), 3),
+            'matcher': event.name,
+            'arguments': describe_arguments(event.matcher),
+            'negate': getattr(event.matcher, 'run_with_negate', False),
+            'passed': event.passed,
+            'error': type(event.error).__name__ if event.error else None,
+            'elapsed_ms': round(event.elapsed * 1000, 3),
+            'request': describe_request(response),
+            'status': getattr(response, 'status_code', None),
+            }
+        view = view_for(response)
+        try:
+            record['headers'] = view.header_list
+        except AttributeError:
+            record['headers'] = None
+        record.update(self._describe_body(response, view))
+        with self._lock:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._write()
+
+    def _describe_body(self, response, view):
+        if not self.hash_bodies:
+            return {'body_size': view.bytes_read}
+        with self._lock:
+            try:
+                return self._digests[response]
+            except (KeyError, TypeError):
+                pass
+        digest, size, truncated = hashlib.sha1(), 0, False
+        try:
+            for chunk in view.iter_chunks():
+                chunk = chunk[:HASH_LIMIT - size]
+                digest.update(chunk)
+                size += len(chunk)
+                if size >= HASH_LIMIT:
+                    truncated = True
+                    break
+        except Exception:
+            # The body can't be read (e.g. it's corrupt, or it's an async
+            # body that hasn't been loaded), which is the matcher's business
+            return {'body_sha1': None, 'body_size': None}
+        description = {'body_sha1': digest.hexdigest(), 'body_size': size}
+        if truncated:
+            description['body_truncated'] = True
+        with self._lock:
+            try:
+                self._digests[response] = description
+            except TypeError:
+                pass
+        return description
+
+    def _write(self):
+        ''' Appends the buffered records to the trace.  Needs the lock. '''
+        if not self._buffer:
+            return
+        lines = [
+            json.dumps(record, sort_keys=True, separators=(',', ':'))
+            for record in self._buffer
+            ]
+        with open(self.path, 'a') as trace:
+            trace.write('\n'.join(lines) + '\n')
+        del self._buffer[:]
+
+    def flush(self):
+        ''' Writes any buffered records '''
+        with self._lock:
+            self._write()
+
+
+# The recorder added by start()
+recorder = None
+
+
+def start(path, **options):
+    '''
+    Starts recording every match to a trace file.  Any buffered records are
+    written when the process exits, or when ``stop`` is called.
+
+    :param path:    The file to append records to
+    :param options: Options for the TraceRecorder
+    :returns:       The TraceRecorder
+    '''
+    global recorder
+    stop()
+    recorder = TraceRecorder(path, **options)
+    instrumentation.add_hook(recorder)
+    atexit.register(recorder.flush)
+    return recorder
+
+
+def stop():
+    ''' Stops recording, and writes any buffered records '''
+    global recorder
+    if recorder is not None:
+        instrumentation.remove_hook(recorder)
+        recorder.flush()
+        recorder = None
+
+
+def read_trace(path):
+    '''
+    Reads the records from a trace file.  A partly written last record (from
+    a run that was killed) is skipped.
+
+    :returns:   An iterator of record dicts
+    '''
+    with open(path) as trace:
+        for line in trace:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def aggregate(paths, key='request'):
+    '''
+    Summarises the records from some trace files.
+
+    :param paths:   A trace file, or a list of them
+    :param key:     The record field to group records by, e.g. 'request' or
+                    'matcher', or a callable taking a record and returning
+                    its group
+    :returns:       A dict mapping each group to a dict of statistics:
+                    calls, passed, failed, errors, total_ms, max_ms, mean_ms
+                    and max_size (the largest body, in bytes)
+    '''
+    if isinstance(paths, (str, type(u''))):
+        paths = [paths]
+    group_of = key if callable(key) else lambda record: record.get(key)
+    summary = {}
+    for path in paths:
+        for record in read_trace(path):
+            group = group_of(record)
+            stats = summary.get(group)
+            if stats is None:
+                stats = summary[group] = {
+                    'calls': 0, 'passed': 0, 'failed': 0, 'errors': 0,
+                    'total_ms': 0.0, 'max_ms': 0.0, 'max_size': 0,
+                    }
+            stats['calls'] += 1
+            if record.get('error'):
+                stats['errors'] += 1
+            elif record.get('passed'):
+                stats['passed'] += 1
+            else:
+                stats['failed'] += 1
+            elapsed = record.get('elapsed_ms') or 0.0
+            stats['total_ms'] += elapsed
+            stats['max_ms'] = max(stats['max_ms'], elapsed)
+            stats['max_size'] = max(
+                stats['max_size'], record.get('body_size') or 0
+                )
+    for stats in summary.values():
+        stats['mean_ms'] = stats['total_ms'] / stats['calls']
+    return summary
+
+
+def report(summary, sort='total_ms', limit=20, stream=None):
+    '''
+    Writes a table of a summary from ``aggregate``, e.g. the slowest groups
+    first, or with ``sort='max_size'`` the largest
+
+    :param sort:    The statistic to sort by, largest first
+    :param limit:   The most groups to include
+    '''
+    stream = stream or sys.stderr
+    stream.write('{0:<40} {1:>8} {2:>8} {3:>12} {4:>10} {5:>12}\n'.format(
+        'group', 'calls', 'failed', 'total (ms)', 'max (ms)', 'max size'
+        ))
+    groups = sorted(
+        summary, key=lambda group: summary[group][sort], reverse=True
+        )
+    for group in groups[:limit]:
+        stats = summary[group]
+        stream.write(
+            '{0:<40} {1:>8} {2:>8} {3:>12.2f} {4:>10.2f} {5:>12}\n'.format(
+                '{0}'.format(group), stats['calls'],
+                stats['failed'] + stats['errors'],
+                stats['total_ms'], stats['max_ms'], stats['max_size']
+                )
+            )
+
+
+if os.environ.get(TRACE_VARIABLE):
+    start(os.environ[TRACE_VARIABLE])
@@ -1,10 +1,52 @@
+import gc
+import hashlib
+import itertools
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import weakref
+import zlib
 import flask_should_dsl
+import flask_should_dsl.bulk
+import flask_should_dsl.direct
+import flask_should_dsl.events
+import flask_should_dsl.instrumentation
+import flask_should_dsl.jsondiff
+import flask_should_dsl.profiling
+import flask_should_dsl.redirects
+import flask_should_dsl.schema
+import flask_should_dsl.snapshots
+import flask_should_dsl.tracing
 from collections import namedtuple
 from unittest import TestCase
-from flask import Flask, abort, redirect, jsonify, make_response
+from flask import Flask, Response, abort, redirect, jsonify, make_response
+from flask import request
 from should_dsl import should, should_not
 from should_dsl.dsl import ShouldNotSatisfied
 
+try:
+    from unittest import SkipTest
+except ImportError:
+    # python 2.6
+    from nose import SkipTest
+
+if sys.version_info >= (3, 6):
+    import asyncio
+    import asgi_app
+    from flask_should_dsl import aio
+else:
+    # The asyncio support needs python 3.6
+    aio = None
+
 app = Flask('Flask-Should-DSL-Test')
 
 # Keep pep8 happy
@@ -15,6 +57,15 @@ abort_404 = abort_500 = return_404 = return_500 = None
 redirect_to = None
 have_content = have_json = have_content_type = have_header = None
 have_content = None
+have_json_at = have_json_including = None
+have_all_content = have_any_content = None
+have_headers = satisfy_all = None
+respond_within = have_p95_latency_below = None
+allocate_less_than = have_peak_memory_below = None
+match_snapshot = have_json_schema = None
+redirect_chain_to = stream_events = None
+have_content_matching = None
+equal_to = be = include = be_less_than = be_greater_than = None
 
 JSON_DATA = {'a': 'b', 'c': 'd'}
 
@@ -39,15 +90,155 @@ def redir2():
     return redirect('/redir_target2')
 
 
+@app.route('/bad_json')
+def bad_json_route():
+    return Response('{"a": ', mimetype='application/json')
+
+
+@app.route('/slow')
+def slow_route():
+    time.sleep(0.02)
+    return ''
+
+
+REDIRECT_HITS = {}
+MOVING_REDIRECT = {'target': '/chain/end'}
+
+
+@app.route('/chain/<name>')
+def chain_route(name):
+    REDIRECT_HITS[name] = REDIRECT_HITS.get(name, 0) + 1
+    chain = {
+        'a': ('/chain/b', 301), 'b': ('/chain/c', 303),
+        'c': ('/chain/d', 307), 'd': ('/chain/end', 308),
+        'loop': ('/chain/loop2', 302), 'loop2': ('/chain/loop', 302),
+        'external': ('http://example.com/page', 302),
+        'secure': ('https://localhost/chain/end', 301),
+        'moving': (MOVING_REDIRECT['target'], 302),
+        'to_moving': ('/chain/moving', 302),
+        }
+    if name not in chain:
+        return name
+    return redirect(*chain[name])
+
+
 @app.route('/json')
 def json_route():
     return jsonify(JSON_DATA)
 
 
+STREAM_STATE = {'chunks': 0}
+
+
+@app.route('/json_stream')
+def json_stream_route():
+    def generate():
+        yield '{"status": "ok", "data": ['
+        for i in range(100):
+            STREAM_STATE['chunks'] += 1
+            yield '{0}{{"id": {1}, "name": "item {1}"}}'.format(
+                ',' if i else '', i
+                )
+        yield ']}'
+    return Response(generate(), mimetype='application/json')
+
+
+@app.route('/latin1_json')
+def latin1_json_route():
+    def generate():
+        yield b'{"name": "caf'
+        yield b'\xe9"}'
+    return Response(
+        generate(), content_type='application/json; charset=latin-1'
+        )
+
+
+@app.route('/download')
+def download_route():
+    def generate():
+        for i in range(1000):
+            STREAM_STATE['chunks'] += 1
+            yield 'line {0:04d}\n'.format(i)
+    return Response(generate(), mimetype='text/plain')
+
+
+EVENT_STATE = {'sent': 0, 'closed': False}
+
+
+@app.route('/events')
+def events_route():
+    def generate():
+        EVENT_STATE['closed'] = False
+        try:
+            yield ': keep alive\n\nretry: 500\n'
+            for i in itertools.count():
+                EVENT_STATE['sent'] += 1
+                yield 'id: {0}\r\nevent: tick\r\ndata: {{"n": {0}}}\r\n' \
+                    '\r\n'.format(i)
+        finally:
+            EVENT_STATE['closed'] = True
+    return Response(generate(), mimetype='text/event-stream')
+
+
+@app.route('/ndjson')
+def ndjson_route():
+    def generate():
+        for i in range(5):
+            yield '{{"n": {0}, "even": {1}}}\n'.format(
+                i, 'true' if i % 2 == 0 else 'false'
+                )
+        yield '\n{"n": 5, '
+        yield '"even": false}'
+    return Response(generate(), mimetype='application/x-ndjson')
+
+
+def compress(chunks, wbits):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, wbits)
+    for chunk in chunks:
+        yield compressor.compress(chunk.encode('utf-8'))
+        yield compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+@app.route('/gzip')
+def gzip_route():
+    response = Response(
+        b''.join(compress([json.dumps(JSON_DATA)], 16 + zlib.MAX_WBITS)),
+        mimetype='application/json'
+        )
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@app.route('/deflate_stream')
+def deflate_stream_route():
+    def generate():
+        for i in range(1000):
+            STREAM_STATE['chunks'] += 1
+            yield 'line {0:04d}\n'.format(i)
+    wbits = -zlib.MAX_WBITS if 'raw' in request.args else zlib.MAX_WBITS
+    response = Response(compress(generate(), wbits), mimetype='text/plain')
+    response.headers['Content-Encoding'] = 'deflate'
+    return response
+
+
+@app.route('/big')
+def big_route():
+    return 'a' * 5000 + 'XYZ' + 'b' * 5000
+
+
+@app.route('/table')
+def table_route():
+    rows = [{'id': i, 'name': 'row {0}'.format(i)} for i in range(20000)]
+    return jsonify(rows=rows[:10])
+
+
 @app.route('/headers')
 def header_route():
     response = make_response('')
     response.headers['X-Wing'] = 'Awesome'
+    response.headers.add('X-Multi', 'one')
+    response.headers.add('X-Multi', 'two')
     return response
 
 
@@ -56,6 +247,16 @@ def hello_route():
     return "hello"
 
 
+@app.route('/echo', methods=['GET', 'POST'])
+def echo_route():
+    return jsonify(
+        method=request.method, path=request.path, args=request.args,
+        body=request.get_data().decode('utf-8'),
+        content_type=request.headers.get('Content-Type'),
+        header=request.headers.get('X-Test')
+        )
+
+
 class BaseTest(TestCase):
     def setUp(self):
         app.config['TESTING'] = True
@@ -114,6 +315,17 @@ class TestBeXxx(BaseTest):
         self.app.get('/missing') |should| return_404
         self.app.get('/ok') |should_not| return_500
 
+    def should_allow_calling_matchers(self):
+        self.app.get('/ok') |should| be_200()
+        self.app.get('/missing') |should_not| be_200()
+
+    def should_make_status_checker_classes(self):
+        make_status_checker = flask_should_dsl.matchers.make_status_checker
+        checker = make_status_checker('be', 200)()
+        checker.name |should| equal_to('be_200')
+        checker.match(self.app.get('/ok')) |should| be(True)
+        checker.match(self.app.get('/missing')) |should| be(False)
+
 
 class TestRedirects(BaseTest):
     def should_handle_redirects(self):
@@ -141,6 +353,96 @@ class TestRedirects(BaseTest):
                 )
 
 
+class TestRedirectChains(BaseTest):
+    def setUp(self):
+        super(TestRedirectChains, self).setUp()
+        REDIRECT_HITS.clear()
+        MOVING_REDIRECT['target'] = '/chain/end'
+
+    def failure(self, url, target, **kwargs):
+        try:
+            self.app.get(url) |should| redirect_chain_to(
+                target, client=app, **kwargs
+                )
+        except ShouldNotSatisfied as e:
+            return str(e)
+        self.fail('Redirects ended at the target')
+
+    def should_follow_every_kind_of_redirect(self):
+        response = self.app.get('/chain/a')
+        response |should| redirect_chain_to('/chain/end', client=app)
+        response |should_not| redirect_chain_to('/chain/d', client=app)
+        self.app.get('/redir') |should| redirect_chain_to(
+            '/redir_target', client=self.app
+            )
+
+    def should_memoize_hops_per_client(self):
+        client = app.test_client()
+        for url in ('/chain/a', '/chain/b', '/chain/a'):
+            self.app.get(url) |should| redirect_chain_to(
+                '/chain/end', client=client
+                )
+        # Only the first requests are repeated, not the hops after them
+        REDIRECT_HITS['a'] |should| equal_to(2)
+        REDIRECT_HITS['b'] |should| equal_to(2)
+        REDIRECT_HITS['c'] |should| equal_to(1)
+        REDIRECT_HITS['end'] |should| equal_to(1)
+
+    def should_not_remember_hops_between_matches_given_an_app(self):
+        self.app.get('/chain/c') |should| redirect_chain_to(
+            '/chain/end', client=app
+            )
+        self.app.get('/chain/c') |should| redirect_chain_to(
+            '/chain/end', client=app
+            )
+        REDIRECT_HITS['d'] |should| equal_to(2)
+        self.app.get('/chain/to_moving') |should| redirect_chain_to(
+            '/chain/end', client=app
+            )
+        MOVING_REDIRECT['target'] = '/chain/moved'
+        self.app.get('/chain/to_moving') |should| redirect_chain_to(
+            '/chain/moved', client=app
+            )
+
+    def should_limit_hops(self):
+        self.app.get('/chain/a') |should| redirect_chain_to(
+            '/chain/end', client=app, max_hops=4
+            )
+        message = self.failure('/chain/a', '/chain/end', max_hops=3)
+        message |should| include('but found a more than 3 redirects')
+
+    def should_detect_loops(self):
+        message = self.failure('/chain/loop', '/chain/end')
+        message |should| include('found a redirect loop')
+        message |should| include(
+            '<response> -302-> http://localhost/chain/loop2 -302-> '
+            'http://localhost/chain/loop -302-> '
+            'http://localhost/chain/loop2'
+            )
+
+    def should_stop_at_other_hosts(self):
+        self.app.get('/chain/external') |should| redirect_chain_to(
+            'http://example.com/page', client=app
+            )
+        message = self.failure('/chain/external', '/chain/end')
+        message |should| include('ended at "http://example.com/page"')
+
+    def should_follow_other_schemes(self):
+        self.app.get('/chain/secure') |should| redirect_chain_to(
+            'https://localhost/chain/end', client=app
+            )
+        self.app.get('/chain/secure') |should_not| redirect_chain_to(
+            '/chain/end', client=app
+            )
+        self.app.get('/chain/secure') |should| redirect_chain_to(
+            '/chain/end', client=app, scheme='https'
+            )
+
+    def should_need_a_redirect(self):
+        message = self.failure('/ok', '/chain/end')
+        message |should| equal_to('Expected a redirect status, but got 200')
+
+
 class TestHaveJson(BaseTest):
     def should_handle_expected_json(self):
         response = self.app.get('/json')
@@ -186,6 +488,250 @@ class TestHaveJson(BaseTest):
                 lambda: response |should| have_json(2, arg='')
                 )
 
+    def json_failure(self, expected, actual):
+        response = namedtuple('fakeResponse', ['json'])(actual)
+        try:
+            response |should| have_json(expected)
+        except ShouldNotSatisfied as e:
+            return str(e)
+        self.fail('Response had the json')
+
+    def should_describe_differing_paths(self):
+        message = self.json_failure(
+            {'a': 'b', 'c': {'d': [1, 2]}, 'e': 1},
+            {'a': 'b', 'c': {'d': [1, 3]}, 'f': None}
+            )
+        message |should| equal_to(
+            'Expected response to have json, but it differs at:\n'
+            '\tc.d.1: expected 2, but got 3\n'
+            '\te: expected 1, but it was missing\n'
+            '\tf: did not expect null'
+            )
+
+    def should_report_shifted_list_items_once(self):
+        expected = [{'id': i} for i in range(1000)]
+        actual = expected[:500] + [{'id': 'new'}] + expected[500:]
+        message = self.json_failure({'data': expected}, {'data': actual})
+        message |should| equal_to(
+            'Expected response to have json, but it differs at:\n'
+            '\tdata.500: did not expect {"id": "new"}'
+            )
+        message = self.json_failure(expected, expected[1:])
+        message |should| include('0: expected {"id": 0}, but it was missing')
+
+    def should_bound_json_differences(self):
+        expected = dict(
+            ('key{0:03d}'.format(i), 'x' * 1000) for i in range(100)
+            )
+        actual = dict((key, 'y') for key in expected)
+        message = self.json_failure(expected, actual)
+        len(message.splitlines()) |should| equal_to(
+            flask_should_dsl.jsondiff.DIFF_LIMIT + 2
+            )
+        message |should| include('...and more')
+        len(message) |should| be_less_than(5000)
+
+
+class TestHaveJsonSubsets(BaseTest):
+    def should_check_json_at_path(self):
+        response = self.app.get('/json_stream')
+        response |should| have_json_at('data.1.id', 1)
+        response |should| have_json_at(['data', 2, 'name'], 'item 2')
+        response |should_not| have_json_at('data.1.id', 2)
+        response |should_not| have_json_at('data.100.id', 100)
+        response |should_not| have_json_at('missing', None)
+
+    def should_check_included_keys(self):
+        response = self.app.get('/json_stream')
+        response |should| have_json_including(status='ok')
+        response |should| have_json_including({'status': 'ok'})
+        response |should_not| have_json_including(status='bad')
+        response |should_not| have_json_including(status='ok', other=1)
+
+    def should_decode_with_the_response_charset(self):
+        response = self.app.get('/latin1_json')
+        response |should| have_json_at('name', u'caf\xe9')
+
+    def should_stop_reading_once_paths_are_found(self):
+        STREAM_STATE['chunks'] = 0
+        response = self.app.get('/json_stream')
+        response |should| have_json_at('data.2.id', 2)
+        STREAM_STATE['chunks'] |should| equal_to(3)
+
+    def should_leave_the_whole_body_readable(self):
+        response = self.app.get('/json_stream')
+        response |should| have_json_at('data.0.id', 0)
+        response |should| have_json_at('data.99.id', 99)
+        len(json.loads(response.data)['data']) |should| equal_to(100)
+
+    def should_handle_values_split_across_chunks(self):
+        chunks = [
+            b'{"a": [1, "x\\"', b'y", {"b": 12', b'34}], "c": tr', b'ue}'
+            ]
+        find_paths = flask_should_dsl.jsonstream.find_paths
+        found = find_paths(chunks, [('a', '2', 'b'), ('c',), ('a', '1')])
+        found |should| equal_to({
+            ('a', '2', 'b'): 1234, ('c',): True, ('a', '1'): 'x"y'
+            })
+
+    def should_handle_numbers_split_after_their_first_digits(self):
+        chunks = [
+            b'{"price": 12.', b'5, "big": 1e', b'3, "small": -2E-',
+            b'2, "id": 1}'
+            ]
+        find_paths = flask_should_dsl.jsonstream.find_paths
+        found = find_paths(chunks, [('price',), ('big',), ('small',)])
+        found |should| equal_to({
+            ('price',): 12.5, ('big',): 1000.0, ('small',): -0.02
+            })
+
+    def should_decode_large_values_in_linear_time(self):
+        items = [{'id': i, 'name': 'item {0}'.format(i)} for i in range(50000)]
+        body = json.dumps({'data': items, 'status': 'ok'}).encode('utf-8')
+        chunks = [body[i:i + 4096] for i in range(0, len(body), 4096)]
+        find_paths = flask_should_dsl.jsonstream.find_paths
+        started = time.time()
+        found = find_paths(chunks, [('data',)])
+        found[('data',)] |should| equal_to(items)
+        (time.time() - started) |should| be_less_than(2)
+
+    def should_fall_back_to_json_attribute(self):
+        fakeResponse = namedtuple('fakeResponse', ['json'])
+        response = fakeResponse({'data': [{'id': 1}]})
+        response |should| have_json_at('data.0.id', 1)
+        response |should_not| have_json_including(data=[])
+
+    def should_report_the_failing_path(self):
+        response = self.app.get('/json_stream')
+        try:
+            response |should| have_json_at('data.1.id', 2)
+        except ShouldNotSatisfied as e:
+            str(e) |should| include("json at 'data.1.id'")
+        else:
+            self.fail('ShouldNotSatisfied not raised')
+
+
+class TestHaveJsonSchema(BaseTest):
+    SCHEMA = {
+        'type': 'object',
+        'required': ['a', 'c'],
+        'properties': {
+            'a': {'type': 'string', 'enum': ['b', 'x']},
+            'c': {'type': 'string', 'minLength': 1},
+            },
+        'additionalProperties': False,
+        }
+
+    def should_match_valid_json(self):
+        self.app.get('/json') |should| have_json_schema(self.SCHEMA)
+        self.app.get('/json') |should_not| have_json_schema(
+            {'type': 'array'}
+            )
+
+    def should_report_every_violation(self):
+        schema = {
+            'type': 'object',
+            'required': ['status', 'missing'],
+            'properties': {
+                'status': {'const': 'error'},
+                'data': {
+                    'type': 'array',
+                    'maxItems': 50,
+                    'items': {'$ref': '#/definitions/item'},
+                    },
+                },
+            'definitions': {
+                'item': {
+                    'properties': {
+                        'id': {'type': 'integer', 'maximum': 97},
+                        'name': {'pattern': '^item'},
+                        },
+                    },
+                },
+            }
+        try:
+            self.app.get('/json_stream') |should| have_json_schema(schema)
+        except ShouldNotSatisfied as e:
+            message = str(e)
+        else:
+            self.fail('Schema matched')
+        message |should| include('found 5 violations')
+        message |should| include('<root>: missing property "missing"')
+        message |should| include('status: expected "error", got "ok"')
+        message |should| include('data: has 100 items, more than 50')
+        message |should| include('data.98.id: 98 is more than the maximum')
+        message |should| include('data.99.id: 99 is more than the maximum')
+
+    def should_check_combinations(self):
+        schema = {
+            'anyOf': [{'type': 'array'}, {'required': ['missing']}],
+            'not': {'required': ['a']},
+            }
+        try:
+            self.app.get('/json') |should| have_json_schema(schema)
+        except ShouldNotSatisfied as e:
+            message = str(e)
+        else:
+            self.fail('Schema matched')
+        message |should| include('does not match any of the anyOf schemas')
+        message |should| include('should not match the not schema')
+
+    def should_cache_compiled_schemas(self):
+        compile_schema = flask_should_dsl.matchers.compile_schema
+        schema = {'type': 'object', 'required': ['a']}
+        compile_schema(schema) |should| be(compile_schema(schema))
+        compile_schema(dict(schema)) |should| be(compile_schema(schema))
+        compile_schema({'type': 'object'}) |should_not| be(
+            compile_schema(schema)
+            )
+
+    def should_reject_invalid_schemas(self):
+        self.assertRaises(
+            flask_should_dsl.schema.SchemaError,
+            lambda: self.app.get('/json') |should| have_json_schema(
+                {'type': 'thing'}
+                )
+            )
+
+    def should_reject_unsupported_keywords(self):
+        self.assertRaises(
+            flask_should_dsl.schema.SchemaError,
+            lambda: self.app.get('/json') |should| have_json_schema(
+                {'type': 'object', 'properties': {'a': {'maxWords': 1}}}
+                )
+            )
+
+    def should_check_conditions_and_dependencies(self):
+        response = self.app.get('/json')
+        response |should| have_json_schema({
+            'if': {'properties': {'a': {'const': 'b'}}},
+            'then': {'required': ['c']},
+            'else': {'required': ['missing']},
+            'dependencies': {'a': ['c'], 'missing': ['other']},
+            'propertyNames': {'maxLength': 1},
+            'title': 'A document',
+            })
+        try:
+            response |should| have_json_schema({
+                'if': {'required': ['a']},
+                'then': {'required': ['missing']},
+                'dependencies': {'c': {'required': ['other']}, 'a': ['x']},
+                'propertyNames': {'pattern': '^c'},
+                })
+        except ShouldNotSatisfied as e:
+            message = str(e)
+        else:
+            self.fail('Schema matched')
+        message |should| include('found 4 violations')
+        message |should| include('<root>: missing property "missing"')
+        message |should| include(
+            '<root>: missing property "x", which "a" depends on'
+            )
+        message |should| include('<root>: missing property "other"')
+        message |should| include(
+            '<root>: property name "a" does not match the propertyNames schema'
+            )
+
 
 class TestHaveContentType(BaseTest):
     CTFakeResponse = namedtuple('CTFakeResponse', ['content_type'])
@@ -237,6 +783,47 @@ class TestHaveContentType(BaseTest):
         response = self.app.get('/json')
         response |should| have_content_type('application/json')
 
+    def should_match_parameters_in_any_order(self):
+        response = self.CTFakeResponse('text/html; charset=UTF-8; level=1')
+        response |should| have_content_type(
+            'text/html; level=1; charset=utf-8'
+            )
+        response |should| have_content_type('text/*; charset=utf-8')
+        response |should| have_content_type('html; level=1')
+        response |should_not| have_content_type('text/html; level=2')
+        response |should_not| have_content_type('text/html; format=flowed')
+
+    def should_accept_lists_of_content_types(self):
+        response = self.app.get('/json')
+        response |should| have_content_type(['text/html', 'application/json'])
+        response |should| have_content_type(('text/*', 'json'))
+        response |should_not| have_content_type(['text/html', 'text/plain'])
+
+    def should_cache_compiled_specs(self):
+        compile_content_type = flask_should_dsl.matchers.compile_content_type
+        spec = compile_content_type('text/html; charset=utf-8')
+        spec.parts |should| equal_to(('text', 'html'))
+        spec.params |should| equal_to((('charset', 'utf-8'),))
+        compile_content_type('text/html; charset=utf-8') |should| be(spec)
+
+
+class TestLRUCache(BaseTest):
+    def should_discard_least_recently_used_entries(self):
+        cache = flask_should_dsl.cache.LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a') |should| equal_to(1)
+        cache.set('c', 3)
+        ('b' in cache) |should| be(False)
+        cache.get('a') |should| equal_to(1)
+        cache.get('c') |should| equal_to(3)
+        len(cache) |should| equal_to(2)
+
+    def should_create_missing_entries(self):
+        cache = flask_should_dsl.cache.LRUCache(2)
+        cache.get_or_create('a', lambda key: key * 2) |should| equal_to('aa')
+        cache.get_or_create('a', lambda key: 'other') |should| equal_to('aa')
+
 
 class TestHaveHeader(BaseTest):
     def should_reject_too_many_arguments(self):
@@ -268,6 +855,49 @@ class TestHaveHeader(BaseTest):
         response |should_not| have_header('X-Wing', 'Bad')
         response |should_not| have_header('X-Something', 'Bad')
 
+    def should_ignore_header_name_case(self):
+        response = self.app.get('/headers')
+        response |should| have_header('x-wing', 'Awesome')
+        response |should| have_header('X-WING: Awesome')
+
+    def should_check_multi_valued_headers(self):
+        response = self.app.get('/headers')
+        response |should| have_header('X-Multi', 'one')
+        response |should| have_header('X-Multi', 'two')
+
+
+class TestHaveHeaders(BaseTest):
+    def should_check_many_headers(self):
+        response = self.app.get('/headers')
+        response |should| have_headers({
+            'x-wing': 'Awesome',
+            'Content-Type': re.compile('^text/html'),
+            'X-Multi': ['one', 'two'],
+            'Content-Length': True,
+            'X-Missing': None,
+            })
+        response |should_not| have_headers({'X-Wing': 'Bad'})
+        response |should_not| have_headers({'X-Multi': ['one', 'three']})
+        response |should_not| have_headers({'X-Wing': False})
+
+    def should_report_every_mismatch(self):
+        response = self.app.get('/headers')
+        try:
+            response |should| have_headers({
+                'X-Wing': 'Bad',
+                'X-Missing': True,
+                'X-Multi': re.compile('three'),
+                'Content-Length': '0',
+                })
+        except ShouldNotSatisfied as e:
+            message = str(e)
+        else:
+            self.fail('ShouldNotSatisfied not raised')
+        message |should| include("'X-Wing' should be 'Bad', but was 'Awesome'")
+        message |should| include("'X-Missing' should be present, but was not")
+        message |should| include("'X-Multi' should be matching /three/")
+        message |should_not| include('Content-Length')
+
 
 class TestHaveContent(BaseTest):
     def should_handle_non_find_success(self):
@@ -304,3 +934,1129 @@ class TestHaveContent(BaseTest):
                 ShouldNotSatisfied,
                 lambda: response |should_not| have_content('ello', find=True)
                 )
+
+
+class CountingResponse(object):
+    ''' A fake response that counts how often it's body is read '''
+    status_code = 200
+    mimetype = 'application/json'
+
+    def __init__(self, data):
+        self._data = data
+        self.reads = 0
+
+    @property
+    def data(self):
+        self.reads += 1
+        return self._data
+
+
+class TestCompressedContent(BaseTest):
+    def should_decompress_gzip_bodies(self):
+        response = self.app.get('/gzip')
+        response |should| have_json(JSON_DATA)
+        response |should| have_json_at('c', 'd')
+        response |should| have_content(json.dumps(JSON_DATA).encode('ascii'))
+
+    def should_decompress_streamed_deflate_bodies(self):
+        for url in ['/deflate_stream', '/deflate_stream?raw=1']:
+            STREAM_STATE['chunks'] = 0
+            response = self.app.get(url)
+            response |should| have_content('line 0009', find=True)
+            STREAM_STATE['chunks'] |should| be_less_than(20)
+            response |should_not| have_content('line 1000', find=True)
+            view = flask_should_dsl.cache.view_for(response)
+            len(view.data) |should| equal_to(10000)
+
+    def should_only_decompress_once(self):
+        calls = []
+        decompress = flask_should_dsl.cache.decompress
+
+        def counting_decompress(chunks, encoding):
+            calls.append(encoding)
+            return decompress(chunks, encoding)
+        flask_should_dsl.cache.decompress = counting_decompress
+        try:
+            response = self.app.get('/deflate_stream')
+            response |should| have_content('line 0500', find=True)
+            response |should| have_all_content(['line 0001', 'line 0999'])
+            response |should_not| have_content('line 1000', find=True)
+        finally:
+            flask_should_dsl.cache.decompress = decompress
+        calls |should| equal_to(['deflate'])
+
+    def should_decompress_a_chunk_at_a_time(self):
+        body = b''.join(compress(
+            ['<needle/>', 'x' * (20 * 1024 * 1024)], 16 + zlib.MAX_WBITS
+            ))
+        response = Response(body, headers={'Content-Encoding': 'gzip'})
+        sizes = []
+        decompress = flask_should_dsl.cache.decompress
+
+        def counting_decompress(chunks, encoding):
+            for chunk in decompress(chunks, encoding):
+                sizes.append(len(chunk))
+                yield chunk
+        flask_should_dsl.cache.decompress = counting_decompress
+        try:
+            response |should| have_content(b'<needle/>', find=True)
+        finally:
+            flask_should_dsl.cache.decompress = decompress
+        sum(sizes) |should| be_less_than(1024 * 1024)
+        len(response.data) |should| equal_to(len(body))
+
+    def should_count_compressed_bytes_read(self):
+        response = self.app.get('/deflate_stream')
+        response |should| have_content('line 0999', find=True)
+        view = flask_should_dsl.cache.view_for(response)
+        view.bytes_read |should| be_less_than(len(response.data))
+        len(view.data) |should| equal_to(10000)
+        view.bytes_read |should| equal_to(len(response.data))
+
+    def should_report_corrupt_bodies(self):
+        response = Response(b'not gzip', headers={'Content-Encoding': 'gzip'})
+        self.assertRaises(
+            ValueError, lambda: response |should| have_content('not gzip')
+            )
+
+
+class TestStreamedContent(BaseTest):
+    def should_find_content_in_streamed_responses(self):
+        response = self.app.get('/download')
+        response |should| have_content('line 0500', find=True)
+        response |should_not| have_content('line 1000', find=True)
+
+    def should_find_content_across_chunk_boundaries(self):
+        response = self.app.get('/download')
+        response |should| have_content('0499\nline 05', find=True)
+
+    def should_stop_at_the_first_match(self):
+        STREAM_STATE['chunks'] = 0
+        response = self.app.get('/download')
+        response |should| have_content('line 0009', find=True)
+        STREAM_STATE['chunks'] |should| equal_to(10)
+
+    def should_leave_the_whole_body_readable(self):
+        response = self.app.get('/download')
+        response |should| have_content('line 0001', find=True)
+        len(response.data) |should| equal_to(10000)
+
+    def should_find_needles_across_many_chunks(self):
+        stream_find = flask_should_dsl.search.stream_find
+        chunks = [b'ab', b'c', b'd', b'ef']
+        stream_find(chunks, b'bcde') |should| be(True)
+        stream_find(chunks, b'abcdef') |should| be(True)
+        stream_find(chunks, b'abd') |should| be(False)
+
+
+class TestHaveManyContent(BaseTest):
+    def should_check_for_all_content(self):
+        response = self.app.get('/download')
+        response |should| have_all_content(['line 0001', 'line 0999'])
+        response |should_not| have_all_content(['line 0001', 'line 1000'])
+        response |should| have_all_content([])
+
+    def should_check_for_any_content(self):
+        response = self.app.get('/download')
+        response |should| have_any_content(['line 1000', 'line 0999'])
+        response |should_not| have_any_content(['line 1000', 'line 1001'])
+
+    def should_report_missing_content(self):
+        response = self.app.get('/download')
+        try:
+            response |should| have_all_content(
+                ['line 0001', 'line 2000', 'line 0002', 'line 3000']
+                )
+        except ShouldNotSatisfied as e:
+            str(e) |should| include("'line 2000'")
+            str(e) |should| include("'line 3000'")
+            str(e) |should_not| include("'line 0001'")
+        else:
+            self.fail('ShouldNotSatisfied not raised')
+
+    def should_stop_reading_once_all_content_is_found(self):
+        STREAM_STATE['chunks'] = 0
+        response = self.app.get('/download')
+        response |should| have_all_content(['line 0003', 'line 0001'])
+        STREAM_STATE['chunks'] |should| equal_to(4)
+
+    def should_find_needles_across_chunks(self):
+        stream_find_all = flask_should_dsl.search.stream_find_all
+        chunks = [b'ab', b'c', b'de', b'f']
+        found = stream_find_all(chunks, [b'bcd', b'ef', b'x', b'abcdef'])
+        found |should| equal_to(set([b'bcd', b'ef', b'abcdef']))
+
+
+class TestHaveContentMatching(BaseTest):
+    def should_match_patterns(self):
+        response = self.app.get('/hello')
+        response |should| have_content_matching(r'^h\w+o$')
+        response |should| have_content_matching('HELLO', re.IGNORECASE)
+        response |should_not| have_content_matching('HELLO')
+        response |should| have_content_matching(b'l{2}')
+        response |should| have_content_matching(re.compile('e.l'))
+
+    def should_search_streamed_bodies(self):
+        STREAM_STATE['chunks'] = 0
+        response = self.app.get('/download')
+        response |should| have_content_matching(
+            r'line 00(0\d)\nline 0010', stream=True
+            )
+        # The match ends just before a chunk's trailing newline, so it's held
+        # back until the next chunk
+        STREAM_STATE['chunks'] |should| equal_to(12)
+        response |should_not| have_content_matching(r'line 1\d+', stream=True)
+        response |should| have_content_matching(b'line 0999\n$', stream=True)
+
+    def should_hold_back_matches_at_the_end_of_a_chunk(self):
+        stream_search = flask_should_dsl.search.stream_search
+        match, offset = stream_search(
+            [b'ab', b'12', b'34c', b'5'], re.compile(b'[0-9]+'), 100
+            )
+        match.group(0) |should| equal_to(b'1234')
+        (offset + match.start()) |should| equal_to(2)
+
+    def should_only_match_anchors_where_the_body_does(self):
+        response = self.app.get('/download')
+        response |should_not| have_content_matching(
+            '^line 0500', stream=True, overlap=20
+            )
+        response |should_not| have_content_matching(
+            r'\Aline 0500', stream=True, overlap=0
+            )
+        response |should| have_content_matching(
+            '^line 0500', re.MULTILINE, stream=True, overlap=20
+            )
+        response |should_not| have_content_matching(
+            r'(?<=4\n)line 0500', stream=True, overlap=20
+            )
+        response |should| have_content_matching(
+            r'(?<=9\n)line 0500', stream=True, overlap=20
+            )
+
+    def should_only_match_end_anchors_where_the_body_does(self):
+        stream_search = flask_should_dsl.search.stream_search
+        match, offset = stream_search(
+            iter(['xab\n', 'more']), re.compile('ab$'), 1024
+            )
+        match |should| be(None)
+        response = self.app.get('/download')
+        response |should_not| have_content_matching(
+            'line 0500$', stream=True, overlap=20
+            )
+        response |should| have_content_matching(
+            'line 0999$', stream=True, overlap=20
+            )
+        response |should| have_content_matching(
+            'line 0500$', re.MULTILINE, stream=True, overlap=20
+            )
+
+    def should_report_capture_groups(self):
+        response = self.app.get('/download')
+        try:
+            response |should_not| have_content_matching(
+                r'line (?P<hundreds>\d)(\d\d)5', stream=True
+                )
+        except ShouldNotSatisfied as e:
+            message = str(e)
+        message |should| equal_to(
+            "Did not expect to find a match for "
+            "'line (?P<hundreds>\\d)(\\d\\d)5', but found 'line 0005' at "
+            "50 with groups:\n\thundreds: '0'\n\t2: '00'"
+            )
+
+    def should_compile_patterns_once(self):
+        patterns = flask_should_dsl.matchers._patterns
+        patterns.clear()
+        for _ in range(10):
+            self.app.get('/hello') |should| have_content_matching('hel+o')
+        len(patterns) |should| equal_to(1)
+        compile_pattern = flask_should_dsl.matchers.compile_pattern
+        compile_pattern(u'hel+o', re.I)
+        compile_pattern(b'hel+o')
+        compile_pattern(u'hel+o') |should| be(compile_pattern(u'hel+o'))
+        len(patterns) |should| equal_to(3)
+
+
+class TestFailureMessages(BaseTest):
+    def message_for(self, assertion):
+        try:
+            assertion()
+        except ShouldNotSatisfied as e:
+            return str(e)
+        self.fail('ShouldNotSatisfied not raised')
+
+    def should_not_keep_responses_alive(self):
+        response = self.app.get('/big')
+        ref = weakref.ref(response)
+        checker = flask_should_dsl.matchers.StatusMatcher('be_200', 200)
+        checker.match(response) |should| be(True)
+        del response
+        gc.collect()
+        ref() |should| be(None)
+
+    def should_excerpt_around_the_first_difference(self):
+        response = self.app.get('/big')
+        expected = 'a' * 5000 + 'XYQ' + 'b' * 5000
+        message = self.message_for(
+            lambda: response |should| have_content(expected)
+            )
+        len(message) |should| be_less_than(2500)
+        message |should| include('aXYZb')
+        message |should| include('aXYQb')
+
+    def should_excerpt_status_failure_bodies(self):
+        response = self.app.get('/big')
+        message = self.message_for(lambda: response |should| be_404)
+        len(message) |should| be_less_than(1200)
+
+    def should_allow_configuring_the_limit(self):
+        messages = flask_should_dsl.messages
+        limit = messages.MESSAGE_LIMIT
+        messages.MESSAGE_LIMIT = None
+        try:
+            response = self.app.get('/big')
+            message = self.message_for(lambda: response |should| be_404)
+            len(message) |should| be_greater_than(10000)
+        finally:
+            messages.MESSAGE_LIMIT = limit
+
+    def should_excerpt_values(self):
+        excerpt = flask_should_dsl.messages.excerpt
+        excerpt('abcdef', limit=10) |should| equal_to('abcdef')
+        excerpt('abcdefghij', around=5, limit=4) |should| equal_to(
+            '...defg...'
+            )
+        excerpt('abcdefghij', around=9, limit=4) |should| equal_to('...ghij')
+
+
+class TestConcurrency(BaseTest):
+    THREADS = 8
+    ITERATIONS = 200
+
+    def setUp(self):
+        super(TestConcurrency, self).setUp()
+        # Switch threads as often as possible, to give races a chance
+        if hasattr(sys, 'setswitchinterval'):
+            self._interval = sys.getswitchinterval()
+            sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        if hasattr(sys, 'setswitchinterval'):
+            sys.setswitchinterval(self._interval)
+
+    def run_threads(self, target):
+        errors = []
+
+        def run(index):
+            try:
+                for _ in range(self.ITERATIONS):
+                    target(index)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [
+            threading.Thread(target=run, args=(index,))
+            for index in range(self.THREADS)
+            ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        errors |should| equal_to([])
+
+    def should_keep_status_results_per_thread(self):
+        matchers = flask_should_dsl.matchers
+        be_200 = matchers.StatusMatcher('be_200', 200)
+        responses = [self.app.get('/ok'), self.app.get('/missing')]
+
+        def check(index):
+            response = responses[index % 2]
+            if be_200.match(response) != (response.status_code == 200):
+                raise AssertionError('Wrong result')
+            message = be_200.message_for_failed_should()
+            if 'but got {0}'.format(response.status_code) not in message:
+                raise AssertionError('Wrong message: ' + message)
+        self.run_threads(check)
+
+    def should_isolate_called_matchers(self):
+        have_json = flask_should_dsl.matchers.JsonMatcher()
+        response = self.app.get('/json')
+
+        def check(index):
+            expected = {'index': index}
+            bound = have_json(expected)
+            if bound.match(response):
+                raise AssertionError('Unexpected match')
+            message = bound.message_for_failed_should()
+            if 'index: expected {0},'.format(index) not in message:
+                raise AssertionError('Wrong message: ' + message)
+        self.run_threads(check)
+
+    def should_share_response_views_between_threads(self):
+        have_content = flask_should_dsl.matchers.ContentMatcher()
+        responses = [self.app.get('/download') for _ in range(4)]
+
+        def check(index):
+            response = responses[index % 4]
+            line = 'line {0:04d}'.format(index * 100)
+            if not have_content(line, find=True).match(response):
+                raise AssertionError('Content not found')
+            if len(response.data) != 10000:
+                raise AssertionError('Body was corrupted')
+        self.run_threads(check)
+
+
+class TestAsync(BaseTest):
+    def setUp(self):
+        if aio is None:
+            raise SkipTest('The asyncio support needs python 3.6')
+        super(TestAsync, self).setUp()
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.client = aio.AsyncClient(app)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_async(self, *awaitables):
+        return self.loop.run_until_complete(asyncio.gather(*awaitables))
+
+    def get(self, url):
+        return self.run_async(self.client.get(url))[0]
+
+    def should_match_async_responses(self):
+        response = self.get('/json')
+        self.run_async(
+            response.should('be_200'),
+            response.should_not('be_404'),
+            response.should('have_json', JSON_DATA),
+            response.should('have_content_type', 'application/json'),
+            )
+
+    def should_raise_when_not_matched(self):
+        response = self.get('/json')
+        self.assertRaises(
+            ShouldNotSatisfied, self.run_async,
+            response.should('have_json', {'a': 'x'})
+            )
+        self.assertRaises(
+            ShouldNotSatisfied, self.run_async,
+            response.should_not('be_200')
+            )
+
+    def should_stream_bodies_without_reading_them_all(self):
+        STREAM_STATE['chunks'] = 0
+        response = self.get('/json_stream')
+        self.run_async(response.should('have_json_at', 'data.2.id', 2))
+        STREAM_STATE['chunks'] |should| be_less_than(10)
+
+    def should_assert_on_many_responses_concurrently(self):
+        responses = self.run_async(
+            *[self.client.get('/json_stream') for _ in range(20)]
+            )
+        self.run_async(*[
+            response.should('have_json_at', 'data.99.id', 99)
+            for response in responses
+            ])
+
+    def should_only_read_loaded_bodies_on_the_loop(self):
+        response = self.get('/download')
+        self.assertRaises(RuntimeError, lambda: response.data)
+        self.run_async(response.load())
+        response |should| be_200
+        response |should| have_content('line 0999', find=True)
+
+    def should_read_async_iterables(self):
+        response = aio.AsyncResponse(
+            200, [('Content-Type', 'text/plain')],
+            AsyncChunks([b'hello ', b'world'], self.loop), loop=self.loop
+            )
+        self.run_async(response.should('have_content', 'hello world'))
+        response.loaded |should| be(True)
+
+    def should_match_asgi_responses(self):
+        client = aio.AsyncClient(asgi_app.app)
+        client.asgi |should| be(True)
+        response = self.run_async(client.post('/echo', data='hello'))[0]
+        self.run_async(
+            response.should('be_200'),
+            response.should('have_content', 'POST hello'),
+            response.should('have_content_type', 'text/plain'),
+            )
+        response = self.run_async(client.get('/stream'))[0]
+        self.run_async(response.should('have_json_at', 'data.999.id', 999))
+        response = self.run_async(client.get('/missing'))[0]
+        self.run_async(response.should('be_404'))
+
+    def should_raise_asgi_app_errors(self):
+        client = aio.AsyncClient(asgi_app.app)
+        self.assertRaises(
+            RuntimeError, self.run_async, client.get('/broken')
+            )
+
+
+class AsyncChunks(object):
+    ''' An async iterable of chunks, for testing AsyncResponse '''
+
+    def __init__(self, chunks, loop):
+        self.chunks = list(chunks)
+        self.loop = loop
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = self.loop.create_future()
+        if self.chunks:
+            future.set_result(self.chunks.pop(0))
+        else:
+            future.set_exception(StopAsyncIteration())
+        return future
+
+
+class TestSatisfyAll(BaseTest):
+    def should_pass_when_every_matcher_passes(self):
+        response = self.app.get('/json')
+        response |should| satisfy_all(
+            be_200,
+            have_json(JSON_DATA),
+            have_json_including(a='b'),
+            have_header('Content-Type'),
+            have_content_type('json'),
+            )
+        response |should_not| satisfy_all(be_200, have_json({}))
+
+    def should_report_every_failure(self):
+        response = self.app.get('/json')
+        try:
+            response |should| satisfy_all(
+                be_404,
+                have_json(JSON_DATA),
+                have_header('X-Missing'),
+                have_content_type('text/html'),
+                )
+        except ShouldNotSatisfied as e:
+            message = str(e)
+        else:
+            self.fail('ShouldNotSatisfied not raised')
+        message |should| include('3 of 4 expectations failed')
+        message |should| include('1) Expected the status code 404')
+        message |should| include("2) Expected header 'X-Missing'")
+        message |should| include("3) Expected content type 'text/html'")
+
+    def should_report_matchers_that_raise(self):
+        response = self.app.get('/bad_json')
+        try:
+            response |should| satisfy_all(be_200, have_json({}))
+        except ShouldNotSatisfied as e:
+            str(e) |should| include('1) Raised ')
+        else:
+            self.fail('ShouldNotSatisfied not raised')
+
+    def should_read_the_body_once(self):
+        response = CountingResponse(b'{"a": "b", "c": "d"}')
+        response |should| satisfy_all(
+            be_200,
+            have_json(JSON_DATA),
+            have_content('"a"', find=True),
+            have_json_including(c='d'),
+            )
+        response.reads |should| equal_to(1)
+
+
+class TestLatency(BaseTest):
+    def setUp(self):
+        super(TestLatency, self).setUp()
+        self.profile_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir)
+
+    def should_pass_fast_requests(self):
+        (lambda: self.app.get('/ok')) |should| respond_within(1000)
+        (lambda: self.app.get('/ok')) |should| have_p95_latency_below(
+            1000, runs=5
+            )
+
+    def should_fail_slow_requests_with_a_profile(self):
+        try:
+            (lambda: self.app.get('/slow')) |should| respond_within(
+                1, profile=True, profile_dir=self.profile_dir
+                )
+        except ShouldNotSatisfied as e:
+            message = str(e)
+        else:
+            self.fail('Slow request passed')
+        message |should| include('Expected a response within 1ms')
+        message |should| include('Profile of a slow request saved to')
+        profiles = os.listdir(self.profile_dir)
+        len(profiles) |should| equal_to(1)
+        message |should| include(os.path.join(self.profile_dir, profiles[0]))
+
+    def should_report_percentiles(self):
+        request = lambda: self.app.get('/slow')
+        try:
+            request |should| have_p95_latency_below(
+                1, runs=3, profile=True, profile_dir=self.profile_dir
+                )
+        except ShouldNotSatisfied as e:
+            message = str(e)
+        else:
+            self.fail('Slow request passed')
+        message |should| include('p95 latency over 3 runs')
+        message |should| include('p50 ')
+        message |should| include('max ')
+
+    def should_not_profile_for_should_not(self):
+        request = lambda: self.app.get('/slow')
+        request |should_not| respond_within(
+            1, profile=True, profile_dir=self.profile_dir
+            )
+        os.listdir(self.profile_dir) |should| equal_to([])
+
+    def should_only_repeat_requests_when_profiling(self):
+        calls = []
+
+        def request():
+            calls.append(1)
+            return self.app.get('/slow')
+        self.assertRaises(
+            ShouldNotSatisfied,
+            lambda: request |should| respond_within(
+                1, profile_dir=self.profile_dir
+                )
+            )
+        len(calls) |should| equal_to(1)
+        os.listdir(self.profile_dir) |should| equal_to([])
+        self.assertRaises(
+            ShouldNotSatisfied,
+            lambda: request |should| respond_within(
+                1, profile=True, profile_dir=self.profile_dir
+                )
+            )
+        len(calls) |should| equal_to(3)
+
+    def should_need_a_callable(self):
+        response = self.app.get('/ok')
+        self.assertRaises(
+            TypeError, lambda: response |should| respond_within(1000)
+            )
+
+
+class TestMemory(BaseTest):
+    def setUp(self):
+        super(TestMemory, self).setUp()
+        self.tracemalloc = flask_should_dsl.profiling.tracemalloc
+
+    def need_tracemalloc(self):
+        if self.tracemalloc is None:
+            raise SkipTest('Tracing allocations needs python 3.4')
+
+    def should_pass_requests_within_budget(self):
+        self.need_tracemalloc()
+        request = lambda: self.app.get('/ok')
+        request |should| allocate_less_than(10 * 1024 * 1024)
+        request |should| have_peak_memory_below(10 * 1024 * 1024)
+
+    def should_report_allocation_sites(self):
+        self.need_tracemalloc()
+        request = lambda: self.app.get('/big')
+        try:
+            request |should| allocate_less_than(1000)
+        except ShouldNotSatisfied as e:
+            message = str(e)
+        else:
+            self.fail('Request was within budget')
+        message |should| include(
+            'Expected the memory allocated by the request to be less '
+            'than 1000B'
+            )
+        message |should| include('Top allocation sites:')
+
+    def should_check_peak_memory(self):
+        self.need_tracemalloc()
+        request = lambda: self.app.get('/table')
+        request |should| allocate_less_than(1024 * 1024)
+        request |should_not| have_peak_memory_below(1024 * 1024)
+
+    def should_leave_tracing_as_it_was(self):
+        self.need_tracemalloc()
+        tracing = self.tracemalloc.is_tracing()
+        (lambda: self.app.get('/ok')) |should| allocate_less_than(10 ** 7)
+        self.tracemalloc.is_tracing() |should| equal_to(tracing)
+
+    def should_need_tracemalloc(self):
+        profiling = flask_should_dsl.profiling
+        profiling.tracemalloc = None
+        request = lambda: self.app.get('/ok')
+        try:
+            self.assertRaises(
+                RuntimeError,
+                lambda: request |should| allocate_less_than(10 ** 7)
+                )
+            self.assertRaises(
+                RuntimeError,
+                lambda: request |should| have_peak_memory_below(10 ** 7)
+                )
+        finally:
+            profiling.tracemalloc = self.tracemalloc
+
+
+class TestSnapshots(BaseTest):
+    def setUp(self):
+        super(TestSnapshots, self).setUp()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def snapshot(self, url, name='page', **kwargs):
+        self.app.get(url) |should| match_snapshot(
+            name, directory=self.directory, update=True, **kwargs
+            )
+
+    def failure(self, url, name='page', **kwargs):
+        try:
+            self.app.get(url) |should| match_snapshot(
+                name, directory=self.directory, **kwargs
+                )
+        except ShouldNotSatisfied as e:
+            return str(e)
+        self.fail('Response matched the snapshot')
+
+    def should_match_stored_snapshots(self):
+        self.snapshot('/download', 'pages/download')
+        os.path.exists(
+            os.path.join(self.directory, 'pages', 'download.body')
+            ) |should| be(True)
+        self.app.get('/download') |should| match_snapshot(
+            'pages/download', directory=self.directory
+            )
+        self.app.get('/big') |should_not| match_snapshot(
+            'pages/download', directory=self.directory
+            )
+
+    def should_report_where_bodies_differ(self):
+        self.snapshot('/big')
+        message = self.failure('/hello')
+        message |should| include("did not match snapshot 'page'")
+        message |should| include('The body differs at byte 0')
+        message |should| include('hello')
+
+    def should_report_header_differences(self):
+        self.snapshot('/headers', headers=('X-Wing',))
+        message = self.failure('/ok', headers=('X-Wing',))
+        message |should| include(
+            "Header 'x-wing' should be 'Awesome', but was missing"
+            )
+        message |should_not| include('The body differs')
+
+    def should_fail_for_missing_snapshots(self):
+        message = self.failure('/ok', 'missing')
+        message |should| include("Snapshot 'missing' does not exist")
+
+    def should_update_snapshots_from_the_environment(self):
+        self.snapshot('/big')
+        os.environ[flask_should_dsl.snapshots.UPDATE_VARIABLE] = '1'
+        try:
+            self.app.get('/hello') |should| match_snapshot(
+                'page', directory=self.directory
+                )
+        finally:
+            del os.environ[flask_should_dsl.snapshots.UPDATE_VARIABLE]
+        self.app.get('/hello') |should| match_snapshot(
+            'page', directory=self.directory
+            )
+
+    def should_reject_names_outside_the_directory(self):
+        self.assertRaises(
+            ValueError, lambda: self.app.get('/ok') |should| match_snapshot(
+                '../page', directory=self.directory
+                )
+            )
+
+
+class TestBulk(BaseTest):
+    def setUp(self):
+        super(TestBulk, self).setUp()
+        self.bulk = flask_should_dsl.bulk
+
+    def should_count_passes_and_failures(self):
+        result = self.bulk.check_responses(
+            app, ['/ok', '/missing'] * 10, 'be_200'
+            )
+        result.total |should| equal_to(20)
+        result.passed |should| equal_to(10)
+        result.failed |should| equal_to(10)
+        result.throughput |should| be_greater_than(0)
+        result.ok |should| be(False)
+
+    def should_keep_the_first_failures(self):
+        result = self.bulk.check_responses(
+            app, ['/missing', '/ok', '/json'], 'be_200',
+            self.bulk.expect('have_json', JSON_DATA), max_failures=1
+            )
+        result.failed |should| equal_to(2)
+        len(result.failures) |should| equal_to(1)
+        request, messages = result.failures[0]
+        request |should| equal_to('/missing')
+        len(messages) |should| equal_to(2)
+        str(result) |should| include('...and 1 more')
+
+    def should_accept_request_arguments(self):
+        requests = ({'path': '/json'} for _ in range(5))
+        result = self.bulk.check_responses(
+            app, requests, self.bulk.expect_not('be_404'),
+            self.bulk.expect('have_json_at', 'a', 'b')
+            )
+        result.passed |should| equal_to(5)
+        result.assert_passed()
+
+    def should_check_responses_in_processes(self):
+        if not hasattr(os, 'fork'):
+            raise SkipTest('Worker processes need fork')
+        result = self.bulk.check_responses(
+            app, ['/ok', '/missing', '/json'] * 4, 'be_200',
+            workers=2, processes=True
+            )
+        result.passed |should| equal_to(8)
+        result.failed |should| equal_to(4)
+        request, messages = result.failures[0]
+        request |should| equal_to('/missing')
+        len(messages) |should| equal_to(1)
+
+    def should_raise_a_summary_of_failures(self):
+        result = self.bulk.check_responses(app, ['/redir'], 'be_200')
+        self.assertRaises(ShouldNotSatisfied, result.assert_passed)
+
+    def should_reject_unknown_matchers(self):
+        self.assertRaises(
+            ValueError, self.bulk.check_responses, app, ['/ok'], 'be_fine'
+            )
+
+    def should_not_negate_shared_matchers(self):
+        shared = should_not._matchers_by_name['be_404']()
+        shared.run_with_negate = False
+        negated = self.bulk.expect_not('be_404').matcher()
+        negated.run_with_negate |should| be(True)
+        shared.run_with_negate |should| be(False)
+        result = self.bulk.check_responses(
+            app, ['/ok', '/missing'] * 50,
+            self.bulk.expect_not('be_404'), self.bulk.expect('be_404'),
+            workers=8
+            )
+        result.passed |should| equal_to(0)
+        result.failed |should| equal_to(100)
+        for request, messages in result.failures:
+            len(messages) |should| equal_to(1)
+
+
+class TestInstrumentation(BaseTest):
+    def setUp(self):
+        super(TestInstrumentation, self).setUp()
+        self.instrumentation = flask_should_dsl.instrumentation
+        self.stats = self.instrumentation.Stats()
+        self.instrumentation.add_hook(self.stats)
+
+    def tearDown(self):
+        self.instrumentation.remove_hook(self.stats)
+
+    def should_count_matches_per_matcher(self):
+        response = self.app.get('/json')
+        response |should| be_200
+        response |should_not| be_404
+        response |should| have_json(JSON_DATA)
+        self.assertRaises(
+            ShouldNotSatisfied,
+            lambda: response |should| have_json({})
+            )
+        summary = self.stats.summary()
+        summary['be_200']['calls'] |should| equal_to(1)
+        summary['be_404']['passed'] |should| equal_to(1)
+        summary['have_json']['calls'] |should| equal_to(2)
+        summary['have_json']['passed'] |should| equal_to(1)
+        summary['have_json']['failed'] |should| equal_to(1)
+        summary['have_json']['bytes_read'] |should| be_greater_than(0)
+        summary['be_200']['bytes_read'] |should| equal_to(0)
+
+    def should_count_errors(self):
+        response = self.app.get('/bad_json')
+        self.assertRaises(
+            ValueError, lambda: response |should| have_json({})
+            )
+        self.stats.summary()['have_json']['errors'] |should| equal_to(1)
+
+    def should_unwrap_matchers_without_hooks(self):
+        status_matcher = flask_should_dsl.matchers.StatusMatcher
+        wrapped = status_matcher.match
+        self.instrumentation.remove_hook(self.stats)
+        try:
+            status_matcher.match |should_not| equal_to(wrapped)
+        finally:
+            self.instrumentation.add_hook(self.stats)
+
+    def should_export_summaries(self):
+        response = self.app.get('/ok')
+        response |should| be_200
+        stream = StringIO()
+        self.stats.report(stream)
+        stream.getvalue() |should| include('be_200')
+
+
+class TestResponseCache(BaseTest):
+    def should_share_views_between_matchers(self):
+        view_for = flask_should_dsl.cache.view_for
+        response = self.app.get('/json')
+        view_for(response) |should| be(view_for(response))
+
+    def should_read_body_once(self):
+        response = CountingResponse(b'{"a": "b", "c": "d"}')
+        response |should| have_json(JSON_DATA)
+        response |should_not| have_json({})
+        response |should| be_200
+        response |should_not| have_content('hello')
+        response.reads |should| equal_to(1)
+
+    def should_handle_responses_without_weakrefs(self):
+        fakeResponse = namedtuple('fakeResponse', ['json'])
+        view_for = flask_should_dsl.cache.view_for
+        view_for(fakeResponse(JSON_DATA)).json |should| equal_to(JSON_DATA)
+
+    def should_replay_streamed_bodies(self):
+        cache = flask_should_dsl.cache
+        spool_memory = cache.SPOOL_MEMORY
+        cache.SPOOL_MEMORY = 4
+        try:
+            stream = cache.BodyStream(iter([b'ab', b'cd', b'ef', u'gh']))
+            first, second = iter(stream), iter(stream)
+            next(first) |should| equal_to(b'ab')
+            b''.join(second) |should| equal_to(b'abcdefgh')
+            b''.join(first) |should| equal_to(b'cdefgh')
+            b''.join(stream) |should| equal_to(b'abcdefgh')
+        finally:
+            cache.SPOOL_MEMORY = spool_memory
+
+    def should_index_headers_case_insensitively(self):
+        response = self.app.get('/headers')
+        headers = flask_should_dsl.cache.view_for(response).headers
+        headers['x-wing'] |should| equal_to(['Awesome'])
+
+
+class TestStreamEvents(BaseTest):
+    def should_check_the_first_server_sent_events(self):
+        response = self.app.get('/events')
+        response |should| stream_events(['{"n": 0}', {'n': 1}])
+        self.app.get('/events') |should_not| stream_events([{'n': 1}])
+
+    def should_parse_server_sent_event_fields(self):
+        response = self.app.get('/events')
+        Event = flask_should_dsl.events.Event
+        response |should| stream_events([Event('{"n": 0}', 'tick', '0', 500)])
+
+    def should_stop_reading_and_close_the_stream(self):
+        EVENT_STATE['sent'] = 0
+        response = self.app.get('/events')
+        response |should| stream_events(count=3, close=True)
+        EVENT_STATE['sent'] |should| equal_to(3)
+        EVENT_STATE['closed'] |should| be(True)
+        self.assertRaises(
+            ValueError, lambda: response |should| stream_events(count=4)
+            )
+        self.assertRaises(
+            ValueError, lambda: response |should| have_content('', find=True)
+            )
+
+    def should_leave_the_stream_open_by_default(self):
+        response = self.app.get('/ndjson')
+        response |should| stream_events(count=2)
+        response |should| stream_events(count=6)
+        response |should| have_content('"n": 5', find=True)
+
+    def should_count_events_matching_a_predicate(self):
+        response = self.app.get('/ndjson')
+        response |should| stream_events(where=lambda event: event['even'])
+        self.app.get('/ndjson') |should| stream_events(
+            count=3, where=lambda event: event['even']
+            )
+        self.app.get('/ndjson') |should_not| stream_events(
+            count=4, where=lambda event: event['even']
+            )
+
+    def should_parse_newline_delimited_json(self):
+        response = self.app.get('/ndjson')
+        response |should| stream_events(count=6)
+        self.app.get('/ndjson') |should_not| stream_events(count=7)
+        self.app.get('/ndjson') |should| stream_events(
+            [{'n': 0, 'even': True}, {'n': 1, 'even': False}]
+            )
+
+    def should_describe_failures(self):
+        try:
+            self.app.get('/ndjson') |should| stream_events(
+                count=4, where=lambda event: event['even']
+                )
+        except ShouldNotSatisfied as e:
+            message = str(e)
+        message |should| include(
+            'stream 4 events matching the predicate, but it ended after 3'
+            )
+        try:
+            self.app.get('/ndjson') |should| stream_events([{'n': 1}])
+        except ShouldNotSatisfied as e:
+            message = str(e)
+        message |should| include('Expected event 0 of the stream to be')
+
+    def should_need_a_known_format(self):
+        self.assertRaises(
+            ValueError, lambda: self.app.get('/download') |should|
+            stream_events(count=1)
+            )
+        self.assertRaises(
+            ValueError, lambda: self.app.get('/hello') |should|
+            stream_events(count=1, format='ndjson')
+            )
+
+    def should_split_lines_across_chunks(self):
+        iter_lines = flask_should_dsl.events.iter_lines
+        chunks = [b'a\r', b'\nb\rc', b'\n', b'\r', b'd\r']
+        list(iter_lines(chunks)) |should| equal_to(
+            [b'a', b'b', b'c', b'', b'd']
+            )
+
+
+class TestDirectClient(BaseTest):
+    def setUp(self):
+        super(TestDirectClient, self).setUp()
+        self.client = flask_should_dsl.direct.DirectClient(app)
+
+    def should_make_requests_without_the_test_client(self):
+        self.client.get('/ok') |should| be_200
+        self.client.get('/missing') |should| be_404
+        self.client.get('/redir') |should| redirect_to('/redir_target')
+        self.client.get('/json') |should| have_json(JSON_DATA)
+        self.client.get('/json') |should| \
+            have_content_type('application/json')
+        self.client.get('/headers') |should| have_header('X-Multi', 'two')
+        self.client.get('/hello') |should| have_content('hello')
+
+    def should_build_requests_from_the_template(self):
+        response = self.client.post(
+            '/echo?a=1&b=%20', json={'x': 1}, headers={'X-Test': 'yes'}
+            )
+        response |should| have_json({
+            'method': 'POST', 'path': '/echo', 'args': {'a': '1', 'b': ' '},
+            'body': '{"x": 1}', 'content_type': 'application/json',
+            'header': 'yes'
+            })
+        self.client.get('/echo') |should| have_json_at('body', '')
+
+    def should_stream_bodies_lazily(self):
+        STREAM_STATE['chunks'] = 0
+        response = self.client.get('/download')
+        response |should| have_content('line 0009', find=True)
+        STREAM_STATE['chunks'] |should| equal_to(10)
+        len(response.data) |should| equal_to(10000)
+        response.close()
+
+    def should_build_environs_of_native_strings(self):
+        client = flask_should_dsl.direct.DirectClient(app)
+        environ = client.environ(u'/caf%C3%A9?q=\xe9', method=u'get')
+        for key in ('REQUEST_METHOD', 'PATH_INFO', 'QUERY_STRING'):
+            type(environ[key]) |should| be(str)
+        environ['REQUEST_METHOD'] |should| equal_to('GET')
+        if str is bytes:
+            environ['PATH_INFO'] |should| equal_to(b'/caf\xc3\xa9')
+        else:
+            environ['PATH_INFO'] |should| equal_to(u'/caf\xc3\xa9')
+        self.client.get(u'/echo?q=\xe9') |should| have_json_at(
+            'args.q', u'\xe9'
+            )
+
+    def should_wait_for_apps_that_start_late(self):
+        def wsgi_app(environ, start_response):
+            start_response('201 CREATED', [('Content-Type', 'text/plain')])
+            yield b'made '
+            path = environ['PATH_INFO']
+            if not isinstance(path, bytes):
+                # On python 3, the path is its bytes decoded as latin-1
+                path = path.encode('latin-1')
+            yield path
+        client = flask_should_dsl.direct.DirectClient(wsgi_app)
+        response = client.get(u'/caf%C3%A9')
+        response |should| have_status(201)
+        response |should| have_content(u'made /caf\xe9'.encode('utf-8'))
+
+
+class TestTracing(BaseTest):
+    def setUp(self):
+        super(TestTracing, self).setUp()
+        self.tracing = flask_should_dsl.tracing
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'trace.ndjson')
+        self.client = flask_should_dsl.direct.DirectClient(app)
+
+    def tearDown(self):
+        self.tracing.stop()
+        shutil.rmtree(self.directory)
+
+    def should_record_every_match(self):
+        self.tracing.start(self.path, hash_bodies=True)
+        response = self.client.get('/json')
+        response |should| be_200
+        response |should| have_json_at('a', 'b')
+        self.assertRaises(
+            ShouldNotSatisfied, lambda: response |should| have_json({})
+            )
+        self.tracing.stop()
+        records = list(self.tracing.read_trace(self.path))
+        [record['matcher'] for record in records] |should| equal_to(
+            ['be_200', 'have_json_at', 'have_json']
+            )
+        records[1]['arguments'] |should| equal_to('"a", "b"')
+        records[1]['request'] |should| equal_to('GET /json')
+        records[1]['status'] |should| equal_to(200)
+        records[2]['passed'] |should| be(False)
+        records[2]['body_size'] |should| equal_to(len(response.data))
+        records[0]['body_sha1'] |should| equal_to(
+            hashlib.sha1(response.data).hexdigest()
+            )
+
+    def should_only_record_what_was_read_by_default(self):
+        self.tracing.start(self.path)
+        STREAM_STATE['chunks'] = 0
+        response = self.client.get('/download')
+        response |should| have_content('line 0009', find=True)
+        self.tracing.stop()
+        STREAM_STATE['chunks'] |should| equal_to(10)
+        record = list(self.tracing.read_trace(self.path))[0]
+        record |should_not| include('body_sha1')
+        record['body_size'] |should| equal_to(100)
+
+    def should_write_records_in_batches(self):
+        self.tracing.start(self.path, batch_size=3)
+        for _ in range(4):
+            self.client.get('/ok') |should| be_200
+        len(list(self.tracing.read_trace(self.path))) |should| equal_to(3)
+        self.tracing.stop()
+        len(list(self.tracing.read_trace(self.path))) |should| equal_to(4)
+
+    def should_aggregate_traces(self):
+        self.tracing.start(self.path)
+        self.client.get('/ok') |should| be_200
+        self.client.get('/big') |should| be_200
+        self.client.get('/big') |should| have_content('XYZ', find=True)
+        self.tracing.stop()
+        with open(self.path, 'a') as trace:
+            trace.write('{"matcher": "be_2')
+        summary = self.tracing.aggregate(self.path)
+        summary['GET /big']['calls'] |should| equal_to(2)
+        summary['GET /big']['max_size'] |should| equal_to(10003)
+        summary['GET /ok']['passed'] |should| equal_to(1)
+        by_matcher = self.tracing.aggregate([self.path], key='matcher')
+        by_matcher['be_200']['calls'] |should| equal_to(2)
+        stream = StringIO()
+        self.tracing.report(summary, sort='max_size', stream=stream)
+        lines = stream.getvalue().splitlines()
+        lines[1] |should| include('GET /big')